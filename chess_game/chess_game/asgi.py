@@ -19,10 +19,11 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'chess_game.settings')
 django_asgi_app = get_asgi_application()
 
 from engine import routing
+from engine.startup import with_startup
 
-application = ProtocolTypeRouter({
+application = with_startup(ProtocolTypeRouter({
     "http": django_asgi_app,
     "websocket": AllowedHostsOriginValidator(
         AuthMiddlewareStack(URLRouter(routing.websocket_urlpatterns))
     ),
-})
+}))
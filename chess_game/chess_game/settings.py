@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/4.1/ref/settings/
 import os
 from pathlib import Path
 import environ
+from django.core.exceptions import ImproperlyConfigured
 
 env = environ.Env()
 environ.Env.read_env()
@@ -57,6 +58,7 @@ SESSION_COOKIE_AGE = 900  # 900 seconds = 15 minutes
 SESSION_EXPIRE_AT_BROWSER_CLOSE = True  # Expire session when browser is closed
 
 MIDDLEWARE = [
+    'engine.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -99,27 +101,133 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Online presence of lobby sockets. Use users.presence.LocalPresenceBackend
+# (options: {"ttl": ...}) for tests or single-process development.
+PRESENCE_BACKEND = "users.presence.RedisPresenceBackend"
+PRESENCE_OPTIONS = {
+    "ttl": 60,  # Seconds a socket stays online without a heartbeat
+    "url": "redis://0.0.0.0:6379/0",
+}
+PRESENCE_HEARTBEAT_INTERVAL = 20  # Seconds between client heartbeats
+
+# Shared cache, e.g. for the players' game history pages and analyses. It has
+# a Redis instance of its own (see supervisord.conf), bounded by maxmemory and
+# evicting least recently used keys, so it never evicts channel-layer,
+# presence or leaderboard keys.
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": "redis://0.0.0.0:6380/0",
+    },
+}
+
+GAME_HISTORY_PAGE_SIZE = 20  # Games per history page sent to the lobby
+GAME_HISTORY_CACHE_TIMEOUT = 300  # Seconds a cached first page is kept
+
+# Played moves are buffered and stored in batches
+MOVE_FLUSH_INTERVAL = 0.5  # Seconds between batched Move writes
+MOVE_FLUSH_BATCH_SIZE = 500  # Flush early once this many moves are buffered
+
+# Timer wheel that flags time losses of all timed games in the process
+CLOCK_TICK = 0.1  # Seconds per slot
+CLOCK_WHEEL_SLOTS = 600  # Slots per turn of the wheel
+
+# Events queued per spectator socket before it is resynced instead
+SPECTATOR_MAX_QUEUE = 32
+
+# Maximum number of live games kept in memory per process by the move pipeline
+GAME_STATE_CACHE_SIZE = 1024
+# Recent events kept per live game to replay to reconnecting clients
+GAME_REPLAY_BUFFER_SIZE = 64
+
+# Server processes sharing the games, see engine.sharding. Every game is
+# played by one of them; GAME_WORKER_INDEX (0 to GAME_WORKERS - 1) must be
+# unique per process across all nodes.
+GAME_WORKERS = env.int("GAME_WORKERS", default=1)
+GAME_WORKER_INDEX = env.int("GAME_WORKER_INDEX", default=0)
+# Rating difference accepted by a new seek, growing by MATCHMAKING_WINDOW_GROWTH per second of waiting
+MATCHMAKING_BASE_WINDOW = 50
+MATCHMAKING_WINDOW_GROWTH = 10
+MATCHMAKING_MAX_WINDOW = 400
+MATCHMAKING_RATING_BUCKET = 50  # Rating points per pairing band of the seek pool
+# Seconds between retries of the waiting seeks
+MATCHMAKING_SWEEP_INTERVAL = 1.0
+# Challenges between players, see engine.challenges
+CHALLENGE_TTL = 10 * 60  # Seconds a challenge waits for an answer before it expires
+CHALLENGE_MAX_PENDING = 20  # Pending challenges a player may have sent at once
+CHALLENGE_RETENTION = 7 * 24 * 3600  # Seconds accepted and rejected challenges are kept
+CHALLENGE_SWEEP_INTERVAL = 60.0  # Seconds between sweeps of the challenge table
+CHALLENGE_SWEEP_CHUNK = 1000  # Rows deleted per statement by a sweep
+# Glicko-2 system constant, constrains how fast volatility changes
+GLICKO2_TAU = 0.5
+
+# Leaderboard shared between processes; use "engine.leaderboard.LocalLeaderboard"
+# (options: {}) for tests or single-process development.
+LEADERBOARD_BACKEND = "engine.leaderboard.RedisLeaderboard"
+LEADERBOARD_OPTIONS = {
+    "url": "redis://0.0.0.0:6379/0",
+}
+LEADERBOARD_SIZE = 50  # Players shown on the leaderboard page
+
+# Half-moves of every finished game added to the opening explorer
+POSITION_INDEX_MAX_PLY = 30
+
+# Computer opponent, see engine.bot
+BOT_USERNAME = "computer"
+BOT_WORKERS = 2  # Search processes per server process
+BOT_MAX_QUEUE = 8  # Searches running or waiting before new bot games are refused
+BOT_NICENESS = 10  # Scheduling priority reduction of the search processes
+BOT_MAX_DEPTH = 4  # Half-moves searched, before quiescence
+BOT_MOVE_TIME = 2.0  # Seconds of thinking per move at most
+BOT_TABLE_SIZE = 200000  # Transposition table entries per search
+BOT_RETRY_DELAY = 0.5  # Seconds before the bot retries a move while saturated
+
+# Position analysis API, searched by the bot's worker processes
+ANALYSIS_DEPTH = 5  # Default search depth in half-moves
+ANALYSIS_MAX_DEPTH = 8  # Deepest search a client may ask for
+ANALYSIS_TIME = 3.0  # Seconds of search at most
+ANALYSIS_CACHE_SIZE = 10000  # Analyses kept in memory per process
+ANALYSIS_CACHE_TIMEOUT = 7 * 24 * 3600  # Seconds an analysis stays in the shared cache
+
+PGN_EXPORT_CHUNK_SIZE = 500  # Games read per query by the streaming PGN exports
+PGN_IMPORT_BATCH_SIZE = 1000  # Games written per transaction by manage.py import_pgn
+PGN_PLAYER_PREFIX = "pgn:"  # Prefix of the placeholder users of imported players
+BOARD_RENDER_CACHE_SIZE = 4096  # Rendered board fragments kept per process
+
+# Per-action latency, query and channel layer metrics, served at /metrics/
+METRICS_ENABLED = env.bool("METRICS_ENABLED", default=False)
+METRICS_LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)  # Seconds
+METRICS_MAX_ACTIONS = 100  # Action names kept per kind before the rest count as "other"
+METRICS_LOOP_PROBE_INTERVAL = 0.5  # Seconds between event loop lag samples
+
 
 # Database
 # https://docs.djangoproject.com/en/4.1/ref/settings/#databases
 
-# DATABASES = {
-#     'default': {
-#         'ENGINE': 'django.db.backends.postgresql_psycopg2',
-#         'NAME': env("DB_NAME"),
-#         'USER': env("DB_USER"),
-#         'PASSWORD': env("DB_PASSWORD"),
-#         'HOST': env("DB_HOST"),
-#         'PORT': env("DB_PORT"),
-#     }
-# }
-
-DATABASES = {
-    "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+# PostgreSQL when DB_NAME is set, SQLite otherwise
+if env("DB_NAME", default=None):
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql_psycopg2',
+            'NAME': env("DB_NAME"),
+            'USER': env("DB_USER"),
+            'PASSWORD': env("DB_PASSWORD"),
+            'HOST': env("DB_HOST"),
+            'PORT': env("DB_PORT"),
+        }
     }
-}
+else:
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": BASE_DIR / "db.sqlite3",
+        }
+    }
+
+# SQLite takes one writer at a time, so several processes committing moves
+# fail with "database is locked"
+if GAME_WORKERS > 1 and DATABASES["default"]["ENGINE"] == "django.db.backends.sqlite3":
+    raise ImproperlyConfigured("GAME_WORKERS > 1 needs a database server; set DB_NAME and the other DB_ variables.")
 
 
 # Password validation
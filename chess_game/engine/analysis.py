@@ -0,0 +1,113 @@
+from collections import OrderedDict
+
+import chess
+from django.conf import settings
+from django.core.cache import cache
+
+from .bot import bot_pool
+from .positions import position_key
+from .search import analyse
+
+
+class EvalCache:
+    """
+    Analyses keyed by Zobrist hash: a per-process LRU in front of the shared
+    Django cache, whose Redis backend evicts least recently used keys.
+
+    An analysis is only replaced by a deeper one. Entries carry the position
+    so a hash collision is a miss, not a wrong answer.
+    """
+
+    def __init__(self, max_size, timeout):
+        self.max_size = max_size
+        self.timeout = timeout
+        self._entries = OrderedDict()
+
+    def _cache_key(self, key):
+        return f"analysis:{key}"
+
+    async def get(self, board, depth):
+        """
+        Return a cached analysis of `board` searched to `depth`, or as deep as
+        the time limit allowed when that depth was asked for, else None.
+        """
+        key = position_key(board)
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = await cache.aget(self._cache_key(key))
+            if entry is not None:
+                self._store(key, entry)
+        else:
+            self._entries.move_to_end(key)
+        if entry is None or entry["epd"] != board.epd():
+            return None
+        if entry["depth"] < depth and entry["target"] < depth:
+            return None
+        return entry
+
+    async def put(self, board, entry):
+        key = position_key(board)
+        entry["epd"] = board.epd()
+        shared = await cache.aget(self._cache_key(key))
+        if shared is None or shared["epd"] != entry["epd"] or shared["depth"] <= entry["depth"]:
+            await cache.aset(self._cache_key(key), entry, self.timeout)
+        else:
+            entry = shared
+        self._store(key, entry)
+
+    def _store(self, key, entry):
+        local = self._entries.get(key)
+        if local is not None and local["epd"] == entry["epd"] and local["depth"] > entry["depth"]:
+            return
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+
+eval_cache = EvalCache(settings.ANALYSIS_CACHE_SIZE, settings.ANALYSIS_CACHE_TIMEOUT)
+
+
+def analysis_depth(value):
+    """
+    Return the search depth a client asked for, as an integer or its text,
+    or ANALYSIS_DEPTH for None. Raises ValueError unless it is a whole
+    number from 1 to ANALYSIS_MAX_DEPTH.
+    """
+    if value is None:
+        return settings.ANALYSIS_DEPTH
+    depth = 0
+    if isinstance(value, (int, str)) and not isinstance(value, bool):
+        try:
+            depth = int(value)
+        except ValueError:
+            pass
+    if not 1 <= depth <= settings.ANALYSIS_MAX_DEPTH:
+        raise ValueError(f"Depth must be between 1 and {settings.ANALYSIS_MAX_DEPTH}.")
+    return depth
+
+
+async def analyse_position(fen, depth=None):
+    """
+    Return the evaluation and best line of `fen`, from the cache or from a
+    search in the bot's worker processes. Raises ValueError for an invalid
+    FEN or depth (see analysis_depth) and BotBusy when the workers are
+    saturated.
+    """
+    board = chess.Board(fen)
+    depth = analysis_depth(depth)
+    entry = await eval_cache.get(board, depth)
+    if entry is None:
+        entry = await bot_pool.run(
+            analyse, board.fen(), depth, settings.ANALYSIS_TIME, settings.BOT_TABLE_SIZE
+        )
+        entry["target"] = depth
+        await eval_cache.put(board, entry)
+    return {
+        "fen": board.fen(),
+        "depth": entry["depth"],
+        "score": entry["score"],
+        "mate": entry["mate"],
+        "pv": entry["pv"],
+        "pv_san": board.variation_san([chess.Move.from_uci(move) for move in entry["pv"]]),
+    }
@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class EngineConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'engine'
+
+    def ready(self):
+        import engine.signals
+
+        from django.conf import settings
+        if settings.METRICS_ENABLED:
+            from engine.metrics import install
+            install()
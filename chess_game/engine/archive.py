@@ -0,0 +1,115 @@
+"""
+Compact archive of the moves of finished games.
+
+The move pipeline appends a Move row per ply, which is what live games
+need. Once a game is over and indexed, archive_games() packs its moves
+into a single GameArchive blob and deletes its rows. Every ply is stored
+as the index of the move among the legal moves of its position, sorted by
+squares, so it fits in one byte (no position has more than 218 legal
+moves); the blob starts with a format byte.
+
+Readers go through load_game_moves() or archived_moves() and do not need
+to know where the moves of a game are kept.
+"""
+from collections import defaultdict
+
+import chess
+from django.db import transaction
+
+from .models import Game, GameArchive, Move
+
+ARCHIVE_FORMAT = 1
+
+
+def _sorted_legal_moves(board):
+    return sorted(board.legal_moves, key=lambda move: (move.from_square, move.to_square, move.promotion or 0))
+
+
+def encode_moves(moves):
+    """
+    Pack UCI moves played from the starting position. Returns the packed
+    bytes and the final board. Raises ValueError on an illegal move.
+    """
+    board = chess.Board()
+    packed = bytearray([ARCHIVE_FORMAT])
+    for uci_move in moves:
+        move = chess.Move.from_uci(uci_move)
+        packed.append(_sorted_legal_moves(board).index(move))
+        board.push(move)
+    return bytes(packed), board
+
+
+def decode_moves(packed, max_ply=None):
+    """
+    Return the UCI moves of packed bytes, the first `max_ply` only if given.
+    """
+    packed = bytes(packed)
+    if packed[:1] != bytes([ARCHIVE_FORMAT]):
+        raise ValueError(f"Unknown game archive format {packed[:1]!r}")
+    board = chess.Board()
+    moves = []
+    for index in packed[1:None if max_ply is None else max_ply + 1]:
+        move = _sorted_legal_moves(board)[index]
+        moves.append(move.uci())
+        board.push(move)
+    return moves
+
+
+def archived_moves(game_id):
+    """
+    Return the UCI moves of an archived game, or None if it is not archived.
+    """
+    packed = GameArchive.objects.filter(game_id=game_id).values_list("moves", flat=True).first()
+    return None if packed is None else decode_moves(packed)
+
+
+def load_game_moves(game_ids, max_ply=None):
+    """
+    Return {game id: UCI moves} of the given games, archived or not, up to
+    `max_ply` half-moves if given.
+    """
+    rows = Move.objects.filter(game_id__in=game_ids)
+    if max_ply is not None:
+        rows = rows.filter(move_number__lte=max_ply)
+    moves = defaultdict(list)
+    for game_id, uci_move in rows.order_by("game_id", "move_number").values_list("game_id", "uci_move"):
+        moves[game_id].append(uci_move)
+    for game_id, packed in GameArchive.objects.filter(game_id__in=game_ids).values_list("game_id", "moves"):
+        moves[game_id] = decode_moves(packed, max_ply)
+    return moves
+
+
+def archive_games(chunk_size=1000):
+    """
+    Archive the finished and indexed games, `chunk_size` games per
+    transaction. A game is archived only if its stored moves replay to its
+    final position, so moves the move writer has not flushed yet are never
+    lost. Returns (archived, skipped).
+    """
+    archived = skipped = 0
+    last_id = 0
+    while True:
+        games = list(
+            Game.objects.filter(game_over=True, indexed=True, archive__isnull=True, id__gt=last_id)
+            .order_by("id")
+            .values_list("id", "current_fen")[:chunk_size]
+        )
+        if not games:
+            return archived, skipped
+        last_id = games[-1][0]
+        moves = load_game_moves([game_id for game_id, _ in games])
+        archives = []
+        for game_id, fen in games:
+            try:
+                packed, board = encode_moves(moves[game_id])
+            except ValueError:
+                packed, board = None, None
+            if board is None or board.fen() != fen:
+                # Moves missing or out of order; left as rows and retried next time
+                skipped += 1
+                continue
+            archives.append(GameArchive(game_id=game_id, moves=packed))
+        with transaction.atomic():
+            GameArchive.objects.bulk_create(archives)
+            Move.objects.filter(game_id__in=[archive.game_id for archive in archives]).delete()
+        archived += len(archives)
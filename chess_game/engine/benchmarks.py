@@ -0,0 +1,348 @@
+"""
+Load benchmarks of HomeConsumer and GameConsumer.
+
+Simulated clients are driven through channels' WebsocketCommunicator against
+the in-memory channel layer, local presence and leaderboard backends and a
+throwaway SQLite database, so a run needs neither Redis nor a server.
+
+Every scenario measures one action at a time and reports its latency
+percentiles and the database queries and websocket messages it cost.
+"""
+import asyncio
+import json
+import statistics
+import time
+
+import chess
+from asgiref.sync import sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connections
+
+from .consumers import GameConsumer, HomeConsumer
+from .leaderboard import get_leaderboard
+from .models import Game
+from .move_log import move_writer
+from users.presence import get_presence_backend
+
+# Overrides the benchmarks run under
+BENCHMARK_SETTINGS = {
+    "CHANNEL_LAYERS": {
+        "default": {
+            "BACKEND": "channels.layers.InMemoryChannelLayer",
+            # Lobby fan-out must be neither dropped nor expired, or messages
+            # per action would lie
+            "CONFIG": {"capacity": 100000, "expiry": 3600},
+        },
+    },
+    "CACHES": {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+    "PRESENCE_BACKEND": "users.presence.LocalPresenceBackend",
+    "PRESENCE_OPTIONS": {"ttl": 60},
+    "LEADERBOARD_BACKEND": "engine.leaderboard.LocalLeaderboard",
+    "LEADERBOARD_OPTIONS": {},
+}
+
+# Legall's mate: a full game ending in checkmate, so a benchmarked game also
+# pays for the game-over path (rating, position index)
+GAME_MOVES = "e2e4 e7e5 g1f3 d7d6 f1c4 c8g4 b1c3 g7g6 f3e5 g4d1 c4f7 e8e7 c3d5".split()
+
+# Seconds without any message after which a phase is over
+SETTLE_TIME = 1.0
+
+# Seconds a client waits for an expected message before the run fails
+TIMEOUT = 120
+
+
+def reset_backends():
+    """
+    Drop the backends built from the settings before the overrides.
+    """
+    get_presence_backend.cache_clear()
+    get_leaderboard.cache_clear()
+
+
+class QueryCounter:
+    """
+    Counts the queries run on the database connections of the threads it
+    is installed in.
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+    def install(self):
+        for connection in connections.all():
+            if self not in connection.execute_wrappers:
+                connection.execute_wrappers.append(self)
+
+    def uninstall(self):
+        for connection in connections.all():
+            if self in connection.execute_wrappers:
+                connection.execute_wrappers.remove(self)
+
+
+class Client:
+    """
+    A simulated websocket client. A reader task takes every message the
+    consumer sends, so waiting for one never drops the others.
+    """
+
+    def __init__(self, consumer, path, user, kwargs=None):
+        self.communicator = WebsocketCommunicator(consumer.as_asgi(), path)
+        self.communicator.scope["user"] = user
+        self.communicator.scope["url_route"] = {"kwargs": kwargs or {}}
+        self.user = user
+        self.received = 0
+        self._waiters = []  # (message kind, future)
+        self._reader = None
+
+    async def connect(self):
+        connected, _ = await self.communicator.connect(timeout=TIMEOUT)
+        if not connected:
+            raise RuntimeError(f"Connection of {self.user.username} was refused")
+        self._reader = asyncio.get_running_loop().create_task(self._read())
+
+    async def disconnect(self):
+        if self._reader is not None:
+            self._reader.cancel()
+        await self.communicator.disconnect(timeout=TIMEOUT)
+
+    async def _read(self):
+        while True:
+            message = await self.communicator.receive_output(timeout=None)
+            if message["type"] != "websocket.send":
+                return
+            self.received += 1
+            content = json.loads(message["text"])
+            kind = content.get("type") or content.get("status")
+            for waiter in [waiter for waiter in self._waiters if waiter[0] == kind]:
+                self._waiters.remove(waiter)
+                if not waiter[1].done():
+                    waiter[1].set_result(content)
+
+    def expect(self, kind):
+        """
+        Return a future of the next message of `kind` (its "type", or its
+        "status" for status replies). Call it before triggering the message.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append((kind, future))
+        return future
+
+    async def send(self, content):
+        await self.communicator.send_json_to(content)
+
+
+class Phase:
+    """
+    Latencies, queries and messages of one benchmarked action.
+    """
+
+    def __init__(self, name, clients, queries):
+        self.name = name
+        self.clients = clients
+        self.queries = queries
+        self.latencies = []
+
+    async def timed(self, coroutine):
+        started = time.perf_counter()
+        result = await asyncio.wait_for(coroutine, TIMEOUT)
+        self.finished = time.perf_counter()
+        self.latencies.append(self.finished - started)
+        return result
+
+    def __enter__(self):
+        self._queries = self.queries.count
+        self._received = sum(client.received for client in self.clients)
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        # Throughput counts until the last action completed, not the fan-out after it
+        self.elapsed = self.finished - self._started
+        self.query_count = self.queries.count - self._queries
+        self.messages = sum(client.received for client in self.clients) - self._received
+
+    def result(self):
+        latencies = sorted(self.latencies)
+        actions = len(latencies)
+        return {
+            "actions": actions,
+            "p50_ms": round(statistics.median(latencies) * 1000, 2),
+            "p99_ms": round(latencies[min(actions - 1, int(actions * 0.99))] * 1000, 2),
+            "queries_per_action": round(self.query_count / actions, 2),
+            "messages_per_action": round(self.messages / actions, 2),
+            "actions_per_second": round(actions / self.elapsed, 1),
+        }
+
+
+def create_users(prefix, count):
+    User.objects.bulk_create(
+        [User(username=f"{prefix}{i}", password=make_password(None)) for i in range(count)]
+    )
+    return list(User.objects.filter(username__startswith=prefix).order_by("id"))
+
+
+async def settle(clients):
+    """
+    Let the fan-out of the previous phase reach every client, so it is not
+    counted against the next one.
+    """
+    received = None
+    while received != sum(client.received for client in clients):
+        received = sum(client.received for client in clients)
+        await asyncio.sleep(SETTLE_TIME)
+
+
+async def connect_lobby(users):
+    clients = [Client(HomeConsumer, "/ws/home/", user) for user in users]
+    await asyncio.gather(*(client.connect() for client in clients))
+    return clients
+
+
+async def disconnect_all(clients):
+    await asyncio.gather(*(client.disconnect() for client in clients))
+
+
+async def lobby_storm(clients_count, queries):
+    """
+    All clients connect to the lobby at once. The latency of a connect runs
+    until the client has its first game history page, the last message of
+    HomeConsumer.connect().
+    """
+    users = await sync_to_async(create_users)("storm", clients_count)
+    clients = [Client(HomeConsumer, "/ws/home/", user) for user in users]
+
+    async def connect(client):
+        history = client.expect("game_history")
+        await client.connect()
+        await history
+
+    with Phase("lobby.connect", clients, queries) as phase:
+        await asyncio.gather(*(phase.timed(connect(client)) for client in clients))
+        await settle(clients)
+    await disconnect_all(clients)
+    return [phase]
+
+
+async def challenges(pairs, queries):
+    """
+    Lobby players challenge each other in pairs, then every challenge is
+    accepted. A challenge runs until the challenger's confirmation, an
+    accept until the challenger is sent to the new game.
+    """
+    users = await sync_to_async(create_users)("challenge", pairs * 2)
+    clients = await connect_lobby(users)
+    await settle(clients)
+    pairings = list(zip(clients[::2], clients[1::2]))
+    challenge_ids = {}
+
+    async def challenge(challenger, challenged):
+        sent = challenger.expect("success")
+        received = challenged.expect("challenge_added")
+        await challenger.send({"action": "send_challenge", "player_id": challenged.user.id})
+        await sent
+        challenge_ids[challenged] = (await received)["challenge"]["id"]
+
+    async def accept(challenger, challenged):
+        started = challenger.expect("game_start")
+        await challenged.send({
+            "action": "respond_challenge",
+            "challenge_id": challenge_ids[challenged],
+            "response": "accept",
+        })
+        await started
+
+    with Phase("challenge.send", clients, queries) as send_phase:
+        await asyncio.gather(*(send_phase.timed(challenge(*pairing)) for pairing in pairings))
+        await settle(clients)
+    with Phase("challenge.accept", clients, queries) as accept_phase:
+        await asyncio.gather(*(accept_phase.timed(accept(*pairing)) for pairing in pairings))
+        await settle(clients)
+    await disconnect_all(clients)
+    return [send_phase, accept_phase]
+
+
+def create_games(users):
+    return list(Game.objects.bulk_create([
+        Game(player_white=white, player_black=black, current_fen=chess.Board().fen())
+        for white, black in zip(users[::2], users[1::2])
+    ]))
+
+
+async def games(count, queries):
+    """
+    Play `count` games at once, each the moves of GAME_MOVES. A move runs
+    until the opponent receives the update.
+    """
+    users = await sync_to_async(create_users)("player", count * 2)
+    game_list = await sync_to_async(create_games)(users)
+    sides = [
+        (
+            Client(GameConsumer, f"/ws/game/{game.id}/", game.player_white, {"game_id": str(game.id)}),
+            Client(GameConsumer, f"/ws/game/{game.id}/", game.player_black, {"game_id": str(game.id)}),
+        )
+        for game in game_list
+    ]
+    clients = [client for pair in sides for client in pair]
+    await asyncio.gather(*(client.connect() for client in clients))
+
+    async def move(mover, opponent, uci_move):
+        update = opponent.expect("game_update")
+        await mover.send({"action": "move", "move": uci_move})
+        await update
+
+    async def play(white, black, phase):
+        for ply, uci_move in enumerate(GAME_MOVES):
+            mover, opponent = (white, black) if ply % 2 == 0 else (black, white)
+            await phase.timed(move(mover, opponent, uci_move))
+
+    with Phase("game.move", clients, queries) as phase:
+        await asyncio.gather(*(play(white, black, phase) for white, black in sides))
+        # The moves' rows are part of their cost
+        await move_writer.flush()
+        await settle(clients)
+    await disconnect_all(clients)
+    return [phase]
+
+
+async def run_benchmarks(clients, pairs, game_count):
+    """
+    Run every scenario and return {phase name: result}.
+    """
+    queries = QueryCounter()
+    # Consumers run their queries in the sync_to_async thread
+    await sync_to_async(queries.install)()
+    phases = []
+    try:
+        phases += await lobby_storm(clients, queries)
+        phases += await challenges(pairs, queries)
+        phases += await games(game_count, queries)
+    finally:
+        await sync_to_async(queries.uninstall)()
+    return {phase.name: phase.result() for phase in phases}
+
+
+def compare(results, baseline, tolerance):
+    """
+    Return the regressions of `results` against `baseline`: latency above the
+    baseline by more than `tolerance` (a fraction), or any more queries or
+    messages per action.
+    """
+    regressions = []
+    for name, result in results.items():
+        expected = baseline.get(name)
+        if expected is None:
+            continue
+        for metric in ("p50_ms", "p99_ms"):
+            if result[metric] > expected[metric] * (1 + tolerance):
+                regressions.append(f"{name} {metric}: {result[metric]} > {expected[metric]}")
+        for metric in ("queries_per_action", "messages_per_action"):
+            if result[metric] > expected[metric] + 0.01:
+                regressions.append(f"{name} {metric}: {result[metric]} > {expected[metric]}")
+    return regressions
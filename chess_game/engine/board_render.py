@@ -0,0 +1,54 @@
+"""
+HTML of the board fragment served by update_board.
+
+Fragments are cached by piece placement and orientation, and built from
+cached rank rows, so a position that was rendered before costs a dict
+lookup instead of a template render.
+"""
+from functools import lru_cache
+
+from django.conf import settings
+
+PIECE_ENTITIES = {
+    "P": "&#9817;", "R": "&#9814;", "N": "&#9816;", "B": "&#9815;", "Q": "&#9813;", "K": "&#9812;",
+    "p": "&#9823;", "r": "&#9820;", "n": "&#9822;", "b": "&#9821;", "q": "&#9819;", "k": "&#9818;",
+}
+EMPTY_TILE = '<div class="chessTile">&nbsp;</div>'
+FILES = "abcdefgh"
+
+
+def _label(text):
+    return f'<div class="labelTile">{text}</div>'
+
+
+@lru_cache(maxsize=4096)
+def render_rank(rank, label, flipped=False):
+    """
+    Render one rank of a FEN piece placement (e.g. "r3k2r") as a row of tiles.
+    """
+    tiles = []
+    for char in rank:
+        if char.isdigit():
+            tiles.extend([EMPTY_TILE] * int(char))
+        else:
+            tiles.append(f'<div class="chessTile">{PIECE_ENTITIES[char]}</div>')
+    if flipped:
+        tiles.reverse()
+    return _label(label) + "".join(tiles)
+
+
+@lru_cache(maxsize=settings.BOARD_RENDER_CACHE_SIZE)
+def render_board(placement, flipped=False):
+    """
+    Render the board of a FEN piece placement, from Black's side if `flipped`.
+    """
+    files = FILES[::-1] if flipped else FILES
+    ranks = list(zip(placement.split("/"), range(8, 0, -1)))
+    if flipped:
+        ranks.reverse()
+    return (
+        '<div id="chessboard-with-border"><div class="emptyTile"></div>'
+        + "".join(_label(file) for file in files)
+        + "".join(render_rank(rank, label, flipped) for rank, label in ranks)
+        + "</div>"
+    )
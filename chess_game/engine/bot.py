@@ -0,0 +1,187 @@
+import asyncio
+import logging
+import multiprocessing
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import chess
+from asgiref.sync import sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+
+from .game_state import broadcast_events, game_states
+from .models import Game
+from .search import choose_move, lower_priority
+
+logger = logging.getLogger(__name__)
+
+
+class BotBusy(Exception):
+    """
+    Raised when the bot's job queue is full.
+    """
+
+
+class BotUnavailable(Exception):
+    """
+    Raised when BOT_USERNAME is the account of a player, see bot_user_id().
+    """
+
+
+class BotPool:
+    """
+    Runs the bot's searches in worker processes so they never block the
+    event loop. At most `max_queue` searches are running or waiting; more
+    are refused with BotBusy rather than queued.
+    """
+
+    def __init__(self, workers, max_queue, niceness):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.niceness = niceness
+        self.pending = 0
+        self._executor = None
+
+    @property
+    def saturated(self):
+        return self.pending >= self.max_queue
+
+    def _get_executor(self):
+        if self._executor is None:
+            # Spawned workers only import engine.search, not Django
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=lower_priority,
+                initargs=(self.niceness,),
+            )
+        return self._executor
+
+    async def best_move(self, fen, time_limit):
+        return await self.run(choose_move, fen, settings.BOT_MAX_DEPTH, time_limit, settings.BOT_TABLE_SIZE)
+
+    async def run(self, function, *args):
+        """
+        Run a function of engine.search in a worker process.
+        """
+        if self.saturated:
+            raise BotBusy()
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._get_executor(), function, *args)
+        except BrokenProcessPool:
+            # A worker died; start a fresh pool for the next search
+            self._executor = None
+            raise
+        finally:
+            self.pending -= 1
+
+
+bot_pool = BotPool(settings.BOT_WORKERS, settings.BOT_MAX_QUEUE, settings.BOT_NICENESS)
+
+_bot_user_id = None  # None until looked up, False if the account is a player's
+
+
+def bot_user_id():
+    """
+    Id of the user the bot plays as, or False if BOT_USERNAME belongs to a
+    player. The bot's account has an unusable password (migration 0016
+    creates it), so an account someone can log in to is never taken over.
+    """
+    global _bot_user_id
+    if _bot_user_id is None:
+        user = User.objects.filter(username=settings.BOT_USERNAME).first()
+        if user is None:
+            # BOT_USERNAME changed since the migration
+            user, _ = User.objects.get_or_create(
+                username=settings.BOT_USERNAME, defaults={"password": make_password(None)}
+            )
+        if user.has_usable_password():
+            logger.error("The bot is disabled: %r is the account of a player", settings.BOT_USERNAME)
+            _bot_user_id = False
+        else:
+            _bot_user_id = user.id
+    return _bot_user_id
+
+
+def create_bot_game(user, game_fields):
+    """
+    Create a game of `user` against the bot, with random colours.
+    """
+    bot_id = bot_user_id()
+    if not bot_id:
+        raise BotUnavailable()
+    white_id, black_id = random.choice([(user.id, bot_id), (bot_id, user.id)])
+    return Game.objects.create(
+        player_white_id=white_id,
+        player_black_id=black_id,
+        current_fen=chess.Board().fen(),
+        **game_fields
+    )
+
+
+def _time_limit(state):
+    """
+    Thinking time for the next move: BOT_MOVE_TIME, but never more than a
+    thirtieth of the bot's remaining clock.
+    """
+    if state.clock is None:
+        return settings.BOT_MOVE_TIME
+    left = state.clock.time_left(state.turn, state.turn, time.time()) / 1000
+    return max(0.05, min(settings.BOT_MOVE_TIME, left / 30))
+
+
+# Games the bot is thinking about in this process
+_thinking = set()
+
+
+async def schedule_bot_move(state):
+    """
+    Start the bot's search if it is to move in the game of `state` and not
+    already thinking about it.
+    """
+    if state.game_over or state.game_id in _thinking:
+        return
+    bot_id = _bot_user_id
+    if bot_id is None:
+        # Only the first lookup of a process needs the database
+        bot_id = await sync_to_async(bot_user_id)()
+    if bot_id and state.player_to_move == bot_id:
+        _thinking.add(state.game_id)
+        asyncio.get_running_loop().create_task(play_bot_move(state.game_id))
+
+
+async def play_bot_move(game_id):
+    try:
+        await _play_bot_move(game_id)
+    finally:
+        _thinking.discard(game_id)
+
+
+async def _play_bot_move(game_id):
+    state = await game_states.get(game_id)
+    ply = state.board.ply()
+    while True:
+        try:
+            uci_move = await bot_pool.best_move(state.board.fen(), _time_limit(state))
+            break
+        except BotBusy:
+            # Shed load: the bot's clock keeps running while it waits
+            await asyncio.sleep(settings.BOT_RETRY_DELAY)
+            if state.game_over:
+                return
+    if uci_move is None:
+        return
+
+    # The cached state may have been evicted while the bot was thinking
+    state = await game_states.get(game_id)
+    async with state.lock:
+        if state.game_over or state.board.ply() != ply:
+            return
+        events = await game_states.play(state, chess.Move.from_uci(uci_move), time.time())
+    if events:
+        await broadcast_events(get_channel_layer(), state, events)
@@ -0,0 +1,221 @@
+"""
+Lifecycle of challenges between players.
+
+A challenge is pending until it is answered or CHALLENGE_TTL runs out. A
+player has at most one pending challenge to another, so repeating a
+challenge is a no-op, and at most CHALLENGE_MAX_PENDING pending ones in
+all. One process sweeps the table periodically, deleting expired
+challenges and answered ones older than CHALLENGE_RETENTION in chunks.
+
+Lobby sockets load the pending challenges of their user once and then
+keep them up to date from challenge_added and challenge_removed events,
+so a spammed player does not cost every lobby refresh a query.
+"""
+import asyncio
+import logging
+from collections import namedtuple
+from datetime import timedelta
+
+import chess
+from asgiref.sync import sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .clock import clock_fields
+from .models import Challenge, Game
+from .startup import on_startup
+
+logger = logging.getLogger(__name__)
+
+ChallengeSnapshot = namedtuple(
+    "ChallengeSnapshot", ["id", "challenger_id", "challenger_name", "challenged_id", "accepted"]
+)
+
+
+class TooManyChallenges(Exception):
+    """
+    Raised when a player already has CHALLENGE_MAX_PENDING pending challenges.
+    """
+
+
+def challenge_snapshot(challenge):
+    return ChallengeSnapshot(
+        challenge.id,
+        challenge.challenger_id,
+        challenge.challenger.username,
+        challenge.challenged_id,
+        challenge.accepted,
+    )
+
+
+def challenge_added_event(challenge_id, challenger_name):
+    return {"type": "challenge_added", "challenge": {"id": challenge_id, "challenger": challenger_name}}
+
+
+def challenge_removed_event(challenge_id):
+    return {"type": "challenge_removed", "challenge_id": challenge_id}
+
+
+def pending(now=None):
+    """
+    Challenges still waiting for an answer. Expired ones stay in the table
+    until the next sweep, so every read filters them out.
+    """
+    now = timezone.now() if now is None else now
+    return Challenge.objects.filter(
+        accepted__isnull=True, created_at__gte=now - timedelta(seconds=settings.CHALLENGE_TTL)
+    )
+
+
+def pending_challenges(user_id):
+    return [
+        {"id": challenge_id, "challenger": challenger}
+        for challenge_id, challenger in pending().filter(challenged_id=user_id)
+        .order_by("id")
+        .values_list("id", "challenger__username")
+    ]
+
+
+def _insert_challenge(challenger, challenged_id, base_time, increment):
+    with transaction.atomic():
+        return Challenge.objects.create(
+            challenger=challenger,
+            challenged_id=challenged_id,
+            base_time=base_time or None,
+            increment=increment or 0,
+        )
+
+
+def create_challenge(challenger, challenged_id, base_time=None, increment=0):
+    """
+    Challenge `challenged_id` on behalf of the `challenger` user. Returns
+    (challenge id, [(user id, event)] to send); repeating a pending
+    challenge returns it again with no events.
+    Raises User.DoesNotExist and TooManyChallenges.
+    """
+    if not User.objects.filter(id=challenged_id).exists():
+        raise User.DoesNotExist()
+    challenged_id = int(challenged_id)
+    sent = dict(pending().filter(challenger=challenger).values_list("challenged_id", "id"))
+    if challenged_id in sent:
+        return sent[challenged_id], []
+    if len(sent) >= settings.CHALLENGE_MAX_PENDING:
+        raise TooManyChallenges()
+
+    events = []
+    try:
+        challenge = _insert_challenge(challenger, challenged_id, base_time, increment)
+    except IntegrityError:
+        existing = pending().filter(challenger=challenger, challenged_id=challenged_id).values_list("id", flat=True).first()
+        if existing is not None:
+            # The same challenge sent concurrently from another socket
+            return existing, []
+        # An expired challenge of the pair holds its place until swept
+        expired = list(
+            Challenge.objects.filter(challenger=challenger, challenged_id=challenged_id, accepted__isnull=True)
+            .values_list("id", flat=True)
+        )
+        Challenge.objects.filter(id__in=expired).delete()
+        events = [(challenged_id, challenge_removed_event(challenge_id)) for challenge_id in expired]
+        challenge = _insert_challenge(challenger, challenged_id, base_time, increment)
+    events.append((challenged_id, challenge_added_event(challenge.id, challenger.username)))
+    return challenge.id, events
+
+
+def respond_to_challenge(challenge_id, user_id, accept):
+    """
+    Accept or reject a challenge made to `user_id`, creating the game when
+    accepted. Returns (challenge snapshot, new game id or None); the
+    challenge is left unchanged if it was made to someone else.
+    Raises Challenge.DoesNotExist unless the challenge is pending.
+    """
+    with transaction.atomic():
+        challenge = pending().select_related("challenger").get(id=challenge_id)
+        if challenge.challenged_id != user_id:
+            return challenge_snapshot(challenge), None
+        # Only one answer can move the row off pending; a concurrent one
+        # updates nothing and finds the challenge already answered
+        if not Challenge.objects.filter(id=challenge_id, accepted__isnull=True).update(accepted=accept):
+            raise Challenge.DoesNotExist()
+        challenge.accepted = accept
+        game_id = None
+        if accept:
+            game_id = Game.objects.create(
+                player_white_id=challenge.challenger_id,
+                player_black_id=challenge.challenged_id,
+                current_fen=chess.Board().fen(),
+                **clock_fields(challenge.base_time, challenge.increment)
+            ).id
+    return challenge_snapshot(challenge), game_id
+
+
+def _delete_in_chunks(queryset, fields):
+    """
+    Delete the rows of `queryset`, CHALLENGE_SWEEP_CHUNK at a time, and
+    return the `fields` of the deleted rows.
+    """
+    deleted = []
+    while True:
+        chunk = list(queryset.order_by("created_at").values_list("id", *fields)[:settings.CHALLENGE_SWEEP_CHUNK])
+        if not chunk:
+            return deleted
+        # Filtered again, so a row answered meanwhile is not deleted as expired
+        queryset.filter(id__in=[row[0] for row in chunk]).delete()
+        deleted += chunk
+
+
+def sweep_challenges(now=None):
+    """
+    Delete expired challenges and answered ones past their retention.
+    Returns [(user id, event)] removing the expired ones from the lobbies.
+    """
+    now = timezone.now() if now is None else now
+    expired = _delete_in_chunks(
+        Challenge.objects.filter(
+            accepted__isnull=True, created_at__lt=now - timedelta(seconds=settings.CHALLENGE_TTL)
+        ),
+        ["challenged_id"],
+    )
+    _delete_in_chunks(
+        Challenge.objects.filter(
+            accepted__isnull=False, created_at__lt=now - timedelta(seconds=settings.CHALLENGE_RETENTION)
+        ),
+        [],
+    )
+    return [(challenged_id, challenge_removed_event(challenge_id)) for challenge_id, challenged_id in expired]
+
+
+async def send_challenge_events(channel_layer, events):
+    for user_id, event in events:
+        await channel_layer.group_send(f"user_{user_id}", event)
+
+
+class ChallengeSweeper:
+    """
+    Runs sweep_challenges every CHALLENGE_SWEEP_INTERVAL seconds, in the
+    process of GAME_WORKER_INDEX 0 only.
+    """
+
+    def __init__(self):
+        self._task = None
+
+    def start(self):
+        if settings.GAME_WORKER_INDEX == 0 and self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        channel_layer = get_channel_layer()
+        while True:
+            await asyncio.sleep(settings.CHALLENGE_SWEEP_INTERVAL)
+            try:
+                events = await sync_to_async(sweep_challenges)()
+                await send_challenge_events(channel_layer, events)
+            except Exception:
+                logger.exception("Challenge sweep failed")
+
+
+challenge_sweeper = ChallengeSweeper()
+on_startup(challenge_sweeper.start)
@@ -0,0 +1,138 @@
+import asyncio
+import math
+import time
+
+import chess
+from django.conf import settings
+
+
+class ChessClock:
+    """
+    Remaining time of both sides in milliseconds.
+
+    The clock of the side to move runs from `running_since` (wall-clock
+    seconds), so it can be stored and resumed in another process. The clocks
+    start with White's first move.
+    """
+
+    def __init__(self, white_ms, black_ms, increment_ms, running_since=None):
+        self.remaining = {chess.WHITE: white_ms, chess.BLACK: black_ms}
+        self.increment_ms = increment_ms
+        self.running_since = running_since
+
+    @classmethod
+    def for_game(cls, base_time, increment, white_time_ms, black_time_ms, clock_updated_at):
+        """
+        Build the clock from stored Game fields, or return None for untimed games.
+        """
+        if base_time is None:
+            return None
+        running_since = clock_updated_at.timestamp() if clock_updated_at else None
+        return cls(white_time_ms, black_time_ms, increment * 1000, running_since)
+
+    def copy(self):
+        return ChessClock(
+            self.remaining[chess.WHITE], self.remaining[chess.BLACK], self.increment_ms, self.running_since
+        )
+
+    def time_left(self, color, turn, now):
+        left = self.remaining[color]
+        if color == turn and self.running_since is not None:
+            left -= int((now - self.running_since) * 1000)
+        return left
+
+    def deadline(self, turn):
+        """
+        Wall-clock time at which the side to move runs out of time.
+        """
+        if self.running_since is None:
+            return None
+        return self.running_since + self.remaining[turn] / 1000
+
+    def press(self, color, now):
+        """
+        Stop the clock of `color` after its move and start the opponent's.
+        """
+        if self.running_since is not None:
+            self.remaining[color] = self.time_left(color, color, now) + self.increment_ms
+        self.running_since = now
+
+    def snapshot(self, turn, now):
+        return {
+            "white": max(0, self.time_left(chess.WHITE, turn, now)),
+            "black": max(0, self.time_left(chess.BLACK, turn, now)),
+        }
+
+
+def clock_fields(base_time, increment):
+    """
+    Game fields for a new game with the given time control in seconds.
+    """
+    if not base_time:
+        return {}
+    base_time, increment = int(base_time), int(increment or 0)
+    return {
+        "base_time": base_time,
+        "increment": increment,
+        "white_time_ms": base_time * 1000,
+        "black_time_ms": base_time * 1000,
+    }
+
+
+class TimerWheel:
+    """
+    Hashed timer wheel: one asyncio task per process fires callbacks for any
+    number of keyed deadlines, with `tick` seconds of resolution.
+
+    Deadlines further away than one turn of the wheel stay in their slot and
+    are skipped until their round comes.
+    """
+
+    def __init__(self, tick, slots):
+        self.tick = tick
+        self._slots = [{} for _ in range(slots)]
+        self._slot_of = {}
+        self._cursor = 0
+        self._cursor_time = None
+        self._task = None
+
+    def __len__(self):
+        return len(self._slot_of)
+
+    def schedule(self, key, deadline, callback):
+        """
+        Call `callback()` (a coroutine function) once `deadline` has passed,
+        replacing any timer already scheduled for `key`.
+        """
+        self.cancel(key)
+        if self._task is None or self._task.done():
+            self._cursor_time = time.time()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        ticks = max(0, math.ceil((deadline - self._cursor_time) / self.tick))
+        slot = (self._cursor + ticks) % len(self._slots)
+        self._slots[slot][key] = (deadline, callback)
+        self._slot_of[key] = slot
+
+    def cancel(self, key):
+        slot = self._slot_of.pop(key, None)
+        if slot is not None:
+            del self._slots[slot][key]
+
+    async def _run(self):
+        while self._slot_of:
+            await asyncio.sleep(self.tick)
+            now = time.time()
+            while self._cursor_time <= now:
+                self._fire(self._slots[self._cursor], now)
+                self._cursor = (self._cursor + 1) % len(self._slots)
+                self._cursor_time += self.tick
+
+    def _fire(self, slot, now):
+        for key, (deadline, callback) in list(slot.items()):
+            if deadline <= now:
+                del slot[key]
+                del self._slot_of[key]
+                asyncio.get_running_loop().create_task(callback())
+
+
+timer_wheel = TimerWheel(settings.CLOCK_TICK, settings.CLOCK_WHEEL_SLOTS)
@@ -1,17 +1,37 @@
 import json
+import logging
+import time
 from channels.generic.websocket import AsyncWebsocketConsumer, AsyncJsonWebsocketConsumer
 from django.contrib.auth.models import AnonymousUser, User
 from django.urls import reverse
-from django.db import models
-from asgiref.sync import sync_to_async
+from channels.layers import get_channel_layer
 from .models import Game, Challenge
-from users.models import UserStatus
+from . import repository
+from .challenges import TooManyChallenges, challenge_removed_event, send_challenge_events
+from .clock import clock_fields
+from .analysis import analyse_position, analysis_depth
+from .bot import BotBusy, BotUnavailable, bot_pool, schedule_bot_move
+from .game_state import broadcast_events, game_states, invalidate_game
+from .matchmaking import Seek, handle_seek_message, submit_seek, withdraw_seek
+from .metrics import MeasuredEventsMixin, measure
+from .move_log import move_writer
+from .spectators import add_spectator, remove_spectator
+from .sharding import GameWorker, forward, owns_game
+from .startup import on_startup
+from .protocol import COMPACT_SUBPROTOCOL, OP_MOVE, OP_RESIGN, OP_SYNC, decode_move, pack_update, unpack_client_frame
+from users.presence import get_presence_backend, player_joined_event, player_left_event
 import chess
 
-class HomeConsumer(AsyncJsonWebsocketConsumer):
+logger = logging.getLogger(__name__)
+
+
+class HomeConsumer(MeasuredEventsMixin, AsyncJsonWebsocketConsumer):
+    metrics_kind = "home"
+
     async def connect(self):
         if self.scope["user"].is_authenticated:
             self.user = self.scope["user"]
+            self.challenges = None  # {challenge id: challenger name}, loaded by send_challenges
             # Add the user to a personal group for challenge
             await self.channel_layer.group_add(
                 f"user_{self.user.id}",
@@ -22,9 +42,12 @@ class HomeConsumer(AsyncJsonWebsocketConsumer):
                 self.channel_name
             )
             await self.accept()
-            # Mark user as online
-            await sync_to_async(UserStatus.objects.filter(user=self.user).update)(is_logged_in=True)
-            await self.send_available_players()  # Notify all users of the updated list
+            # Mark user as online; other tabs of the same user don't count twice
+            came_online = await get_presence_backend().connect(self.user, self.channel_name)
+            await self.send_available_players()
+            if came_online:
+                # Notify everyone else with a single delta instead of a full list
+                await self.channel_layer.group_send("home", player_joined_event(self.user))
             await self.send_game_history()
         else:
             await self.close()
@@ -39,28 +62,44 @@ class HomeConsumer(AsyncJsonWebsocketConsumer):
                 "home",
                 self.channel_name
             )
-            # Mark user as offline
-            await sync_to_async(UserStatus.objects.filter(user=self.user).update)(is_logged_in=False)
-            await self.send_available_players()  # Notify all users of the updated list
+            # A seek dies with the socket that placed it
+            await withdraw_seek(self.channel_layer, self.user.id, self.channel_name)
+            # Mark user as offline once their last socket is gone
+            went_offline = await get_presence_backend().disconnect(self.user.id, self.channel_name)
+            if went_offline:
+                await self.channel_layer.group_send("home", player_left_event(self.user.id))
 
     async def receive_json(self, content):
         action = content.get("action")
-        if action == "get_challenges":
-            await self.send_challenges()
-        elif action == "check_game_start":
-            await self.check_game_start()
-        elif action == "get_available_players":
-            await self.send_available_players()
-        elif action == "respond_challenge":
-            await self.handle_challenge_response(content)
-        elif action == "send_challenge":
-            await self.handle_send_challenge(content)
-        elif action == "edit_journal":
-            await self.handle_edit_journal(content)
-        elif action == "delete_game":
-            await self.handle_delete_game(content)
-        elif action == "save_journal":
-            await self.save_journal(content)
+        with measure("home", action):
+            if action == "get_challenges":
+                await self.send_challenges()
+            elif action == "check_game_start":
+                await self.check_game_start()
+            elif action == "get_available_players":
+                await self.send_available_players()
+            elif action == "heartbeat":
+                await self.handle_heartbeat()
+            elif action == "respond_challenge":
+                await self.handle_challenge_response(content)
+            elif action == "send_challenge":
+                await self.handle_send_challenge(content)
+            elif action == "edit_journal":
+                await self.handle_edit_journal(content)
+            elif action == "delete_game":
+                await self.handle_delete_game(content)
+            elif action == "save_journal":
+                await self.save_journal(content)
+            elif action == "get_game_history":
+                await self.send_game_history(content.get("before"))
+            elif action == "seek":
+                await self.handle_seek(content)
+            elif action == "cancel_seek":
+                await self.handle_cancel_seek()
+            elif action == "play_bot":
+                await self.handle_play_bot(content)
+            elif action == "explore":
+                await self.send_explorer(content.get("fen") or chess.STARTING_FEN)
 
     async def handle_edit_journal(self, content):
         game_id = content.get("game_id")
@@ -69,21 +108,20 @@ class HomeConsumer(AsyncJsonWebsocketConsumer):
             return
 
         try:
-            game = await sync_to_async(Game.objects.get)(id=game_id)
-            player_white = await sync_to_async(lambda: game.player_white)()
-            player_black = await sync_to_async(lambda: game.player_black)()
-
-            if player_white == self.user or player_black == self.user:
-                game_data = {
-                    "id": game.id,
-                    "journal_entry": game.journal_entry or "",
-                    "opponent": player_black.username if player_white == self.user else player_white.username,
-                }
-                await self.send_json({"type": "edit_journal_data", "game": game_data})
-            else:
-                await self.send_json({"type": "error", "message": "You are not authorized to edit this journal."})
+            game = await repository.get_game(game_id)
         except Game.DoesNotExist:
             await self.send_json({"type": "error", "message": "Game not found."})
+            return
+
+        if self.user.id in (game.white_id, game.black_id):
+            game_data = {
+                "id": game.id,
+                "journal_entry": game.journal_entry or "",
+                "opponent": game.black_name if game.white_id == self.user.id else game.white_name,
+            }
+            await self.send_json({"type": "edit_journal_data", "game": game_data})
+        else:
+            await self.send_json({"type": "error", "message": "You are not authorized to edit this journal."})
 
     async def save_journal(self, content):
         game_id = content.get("game_id")
@@ -94,35 +132,17 @@ class HomeConsumer(AsyncJsonWebsocketConsumer):
             return
 
         try:
-            game = await sync_to_async(Game.objects.get)(id=game_id)
-            player_white = await sync_to_async(lambda: game.player_white)()
-            player_black = await sync_to_async(lambda: game.player_black)()
-
-            if player_white == self.user or player_black == self.user:
-                game.journal_entry = journal_entry
-                await sync_to_async(game.save)()
-                player_white_id = player_white.id if player_white else None
-                player_black_id = player_black.id if player_black else None
-                if player_white_id:
-                    await self.channel_layer.group_send(
-                        f"user_{player_white_id}",
-                        {
-                            "type": "send_game_broadcast",
-                            "game_id": game_id,
-                        }
-                    )
-                if player_black_id:
-                    await self.channel_layer.group_send(
-                        f"user_{player_black_id}",
-                        {
-                            "type": "send_game_broadcast",
-                            "game_id": game_id,
-                        }
-                    )
-            else:
-                await self.send_json({"type": "error", "message": "You are not authorized to edit this journal."})
+            events = await repository.update_journal(game_id, self.user.id, journal_entry)
         except Game.DoesNotExist:
             await self.send_json({"type": "error", "message": "Game not found."})
+            return
+
+        if events is None:
+            await self.send_json({"type": "error", "message": "You are not authorized to edit this journal."})
+            return
+        # Push the changed row only, instead of the whole history
+        for user_id, event in events.items():
+            await self.channel_layer.group_send(f"user_{user_id}", event)
 
     async def handle_delete_game(self, content):
         game_id = content.get("game_id")
@@ -131,45 +151,57 @@ class HomeConsumer(AsyncJsonWebsocketConsumer):
             return
 
         try:
-            game = await sync_to_async(Game.objects.get)(id=game_id)
-            player_white = await sync_to_async(lambda: game.player_white)()
-            player_black = await sync_to_async(lambda: game.player_black)()
-            if player_white == self.user or player_black == self.user:
-                # Get the IDs of both players
-                player_white_id = player_white.id if player_white else None
-                player_black_id = player_black.id if player_black else None
-
-                # Delete the game
-                await sync_to_async(game.delete)()
-                print(f"Game {game_id} deleted by user {self.user.id}. Broadcasting to involved players.")
-
-                # Notify both players of the deletion
-                if player_white_id:
-                    await self.channel_layer.group_send(
-                        f"user_{player_white_id}",
-                        {
-                            "type": "delete_game_broadcast",
-                            "game_id": game_id,
-                        }
-                    )
-                if player_black_id:
-                    await self.channel_layer.group_send(
-                        f"user_{player_black_id}",
-                        {
-                            "type": "delete_game_broadcast",
-                            "game_id": game_id,
-                        }
-                    )
-            else:
-                await self.send_json({"type": "error", "message": "You are not authorized to delete this game."})
+            game = await repository.delete_game(game_id, self.user.id)
         except Game.DoesNotExist:
             await self.send_json({"type": "error", "message": "Game not found."})
+            return
+
+        if game is None:
+            await self.send_json({"type": "error", "message": "You are not authorized to delete this game."})
+            return
+        await invalidate_game(self.channel_layer, game.id)
+        logger.info("Game %s deleted by user %s", game.id, self.user.id)
+
+        # Notify both players of the deletion
+        for player_id in (game.white_id, game.black_id):
+            if player_id:
+                await self.channel_layer.group_send(
+                    f"user_{player_id}",
+                    {
+                        "type": "delete_game_broadcast",
+                        "game_id": game.id,
+                    }
+                )
 
     async def delete_game_broadcast(self, event):
         """
         Broadcast game deletion to the user.
         """
-        await self.send_game_history()
+        await self.send_json({
+            "type": "delete_game",
+            "game_id": event["game_id"],
+        })
+
+    async def game_over(self, event):
+        """
+        Tell the user one of their games has finished.
+        """
+        await self.send_json({
+            "type": "game_over",
+            "game_id": event["game_id"],
+            "winner": event["winner"],
+            "result": event["result"],
+            "termination": event["termination"],
+        })
+
+    async def game_changed(self, event):
+        """
+        Send a single updated or new game history row to the user.
+        """
+        await self.send_json({
+            "type": "game_changed",
+            "game": event["game"],
+        })
 
     async def handle_send_challenge(self, content):
         """
@@ -181,34 +213,99 @@ class HomeConsumer(AsyncJsonWebsocketConsumer):
             return
 
         try:
-            challenged_player = await sync_to_async(User.objects.get)(id=player_id)
-            # Create challenge
-            challenge = await sync_to_async(Challenge.objects.create)(
-                challenger=self.user, challenged=challenged_player
+            _, events = await repository.create_challenge(
+                self.user, player_id, content.get("base_time"), content.get("increment")
             )
-
-            # Notify challenged player
-            await self.channel_layer.group_send(
-                f"user_{player_id}",
-                {"type": "broadcast_challenges"}
-            )
-            await self.send_json({"type": "success", "message": "Challenge sent successfully!"})
         except User.DoesNotExist:
-            await self.send_json({"type": "error", "message": "Player not found."})        
+            await self.send_json({"type": "error", "message": "Player not found."})
+            return
+        except TooManyChallenges:
+            await self.send_json({"type": "error", "message": "You have too many pending challenges."})
+            return
+
+        # Notify challenged player; a repeated challenge has nothing new to tell
+        await send_challenge_events(self.channel_layer, events)
+        await self.send_json({"type": "success", "message": "Challenge sent successfully!"})
+
+    async def handle_seek(self, content):
+        """
+        Queue the user for the next compatible opponent; replaces an open seek.
+        """
+        try:
+            base_time = int(content.get("base_time") or 0) or None
+            increment = int(content.get("increment") or 0)
+        except (TypeError, ValueError):
+            await self.send_json({"type": "error", "message": "Invalid time control."})
+            return
+        if await repository.ongoing_game_id(self.user.id):
+            await self.send_json({"type": "error", "message": "You already have a game in progress."})
+            return
+        rating = await repository.player_rating(self.user.id)
+        await self.send_json({"type": "seek_started", "base_time": base_time, "increment": increment})
+        await submit_seek(self.channel_layer, Seek(
+            self.user.id, self.user.username, rating, base_time, increment, channel_name=self.channel_name
+        ))
+
+    async def handle_cancel_seek(self):
+        await withdraw_seek(self.channel_layer, self.user.id)
+        await self.send_json({"type": "seek_cancelled"})
+
+    async def handle_play_bot(self, content):
+        """
+        Start a game against the computer, unless it is saturated.
+        """
+        if bot_pool.saturated:
+            await self.send_json({"type": "error", "message": "The computer is busy, please try again later."})
+            return
+        try:
+            game_fields = clock_fields(content.get("base_time"), content.get("increment"))
+        except (TypeError, ValueError):
+            await self.send_json({"type": "error", "message": "Invalid time control."})
+            return
+        try:
+            game_id = await repository.create_bot_game(self.user, game_fields)
+        except BotUnavailable:
+            await self.send_json({"type": "error", "message": "The computer is not available."})
+            return
+        await self.channel_layer.group_send(
+            f"user_{self.user.id}",
+            {
+                "type": "broadcast_game_start",
+                "game_id": game_id
+            }
+        )
+        # The bot opens the game when it plays White
+        if owns_game(game_id):
+            await schedule_bot_move(await game_states.get(game_id))
+        else:
+            await forward(self.channel_layer, game_id, {"type": "game.wake"})
 
-    async def send_challenges(self):
+    async def send_explorer(self, fen):
         """
-        Send the list of challenges to the user.
+        Send the opening explorer moves of a position.
+        """
+        try:
+            position = await repository.explore(fen)
+        except ValueError:
+            await self.send_json({"type": "error", "message": "Invalid FEN."})
+            return
+        await self.send_json({"type": "explorer", **position})
+
+    async def send_challenges(self, reload=False):
         """
-        challenges = await sync_to_async(
-            lambda: Challenge.objects.filter(challenged=self.user, accepted=None)
-        )()
-        challenges_data = await sync_to_async(
-            lambda: [{"id": ch.id, "challenger": ch.challenger.username} for ch in challenges]
-        )()
+        Send the list of challenges to the user, loaded once per socket.
+        """
+        if self.challenges is None or reload:
+            self.challenges = {
+                challenge["id"]: challenge["challenger"]
+                for challenge in await repository.pending_challenges(self.user.id)
+            }
         await self.send_json({
             "type": "challenges",
-            "challenges": challenges_data
+            "challenges": [
+                {"id": challenge_id, "challenger": challenger}
+                for challenge_id, challenger in self.challenges.items()
+            ],
         })
 
     
@@ -225,48 +322,40 @@ class HomeConsumer(AsyncJsonWebsocketConsumer):
             })
             return
 
-        challenge = await sync_to_async(Challenge.objects.get)(id=challenge_id)
-        challenger = await sync_to_async(lambda: challenge.challenger)()
-        challenged = await sync_to_async(lambda: challenge.challenged)()
-        if challenged != self.user:
+        if response not in ("accept", "reject"):
+            await self.send_challenges()
+            return
+
+        try:
+            challenge, game_id = await repository.respond_to_challenge(
+                challenge_id, self.user.id, response == "accept"
+            )
+        except Challenge.DoesNotExist:
+            await self.send_json({"type": "error", "message": "Challenge not found."})
+            return
+        if challenge.challenged_id != self.user.id:
             await self.send_json({
                 "type": "error",
                 "message": "You are not authorized to respond to this challenge."
             })
             return
 
-        if response == "accept":
-            challenge.accepted = True
-            await sync_to_async(challenge.save)()
-
-            game = await sync_to_async(Game.objects.create)(
-                player_white=challenger,
-                player_black=challenged,
-                current_fen=chess.Board().fen()
-            )
-
+        if game_id is not None:
             # Notify both players of game start
-            await self.channel_layer.group_send(
-                f"user_{challenger.id}",
-                {
-                    "type": "broadcast_game_start",
-                    "game_id": game.id
-                }
-            )
-            await self.channel_layer.group_send(
-                f"user_{challenged.id}",
-                {
-                    "type": "broadcast_game_start",
-                    "game_id": game.id
-                }
-            )
-        elif response == "reject":
-            challenge.accepted = False
-            await sync_to_async(challenge.save)()
-
+            for player_id in (challenge.challenger_id, challenge.challenged_id):
+                # Neither player can be paired into a second game
+                await withdraw_seek(self.channel_layer, player_id)
+                await self.channel_layer.group_send(
+                    f"user_{player_id}",
+                    {
+                        "type": "broadcast_game_start",
+                        "game_id": game_id
+                    }
+                )
+        else:
             # Notify challenger of rejection
             await self.channel_layer.group_send(
-                f"user_{challenger.id}",
+                f"user_{challenge.challenger_id}",
                 {
                     "type": "challenge_rejected",
                     "challenger": self.user.username,
@@ -274,7 +363,8 @@ class HomeConsumer(AsyncJsonWebsocketConsumer):
                 }
             )
 
-        await self.send_challenges()
+        # Answered from this socket, gone from every socket of the user
+        await self.channel_layer.group_send(f"user_{self.user.id}", challenge_removed_event(challenge.id))
     
     async def challenge_rejected(self, event):
         # Send a message back to the WebSocket client indicating the rejection.
@@ -283,76 +373,61 @@ class HomeConsumer(AsyncJsonWebsocketConsumer):
             "message": f"Your challenge was rejected by {event.get('challenger', 'unknown')}."
         })
 
-    async def send_available_players(self):
-        online_users = await sync_to_async(
-            lambda: list(UserStatus.objects.filter(is_logged_in=True).values_list('user_id', flat=True))
-        )()
-
-        # Broadcast personalized lists to each online user
-        for user_id in online_users:
-            # Get the available players excluding the current user
-            available_players = await sync_to_async(
-                lambda: list(
-                    UserStatus.objects.filter(is_logged_in=True).exclude(user_id=user_id)
-                )
-            )()
-
-            players_data = await sync_to_async(
-                lambda: [{"id": player.user.id, "username": player.user.username} for player in available_players]
-            )()
+    async def handle_heartbeat(self):
+        """
+        Keep this socket online and expire users whose sockets stopped beating.
+        """
+        presence = get_presence_backend()
+        if await presence.heartbeat(self.user, self.channel_name):
+            await self.channel_layer.group_send("home", player_joined_event(self.user))
+        for user_id in await presence.expire_stale():
+            await self.channel_layer.group_send("home", player_left_event(user_id))
 
-            # Send personalized list to each user
-            await self.channel_layer.group_send(
-                f"user_{user_id}",
-                {
-                    "type": "broadcast_available_players",
-                    "players": players_data,
-                }
-            )
+    async def send_available_players(self):
+        """
+        Send the snapshot of online players to this socket only.
+        """
+        players = await get_presence_backend().online_players()
+        await self.send_json({
+            "type": "available_players",
+            "players": players,
+        })
 
     async def check_game_start(self):
-        game = await sync_to_async(
-            lambda: Game.objects.filter(
-                models.Q(player_white=self.user) | models.Q(player_black=self.user),
-                game_over=False
-            ).first()
-        )()
-        if game:
+        game_id = await repository.ongoing_game_id(self.user.id)
+        if game_id:
             await self.send_json({
                 "type": "game_start",
-                "url": reverse("game_detail", args=[game.id])
-            })
-
-    async def send_game_history(self):
-        games = await sync_to_async(
-            lambda: list(Game.objects.filter(
-                models.Q(player_white=self.user) | models.Q(player_black=self.user)
-            ).order_by('-id'))
-        )()
-
-        games_data = []
-        for game in games:
-            player_white = await sync_to_async(lambda: game.player_white)()
-            player_black = await sync_to_async(lambda: game.player_black)()
-            winner = await sync_to_async(lambda: game.winner)()
-            games_data.append({
-                "id": game.id,
-                "opponent": player_black.username if player_white == self.user else player_white.username,
-                "result": "Win" if winner == self.user else "Loss" if winner else "Ongoing",
-                "move_count": game.move_count,
-                "journal_entry": game.journal_entry or "None",
+                "url": reverse("game_detail", args=[game_id])
             })
 
+    async def send_game_history(self, before=None):
+        """
+        Send one page of the user's game history, starting after the `before` cursor.
+        """
+        games, next_cursor = await repository.history_page(self.user.id, before)
         await self.send_json({
             "type": "game_history",
-            "games": games_data,
+            "games": games,
+            "before": before,
+            "next_cursor": next_cursor,
         })
 
     async def broadcast_game_history(self, event):
         await self.send_game_history()
 
     async def broadcast_challenges(self, event):
-        await self.send_challenges()
+        await self.send_challenges(reload=True)
+
+    async def challenge_added(self, event):
+        if self.challenges is not None:
+            self.challenges[event["challenge"]["id"]] = event["challenge"]["challenger"]
+        await self.send_json(event)
+
+    async def challenge_removed(self, event):
+        if self.challenges is not None:
+            self.challenges.pop(event["challenge_id"], None)
+        await self.send_json(event)
 
     async def broadcast_game_start(self, event):
         game_id = event.get("game_id")
@@ -378,121 +453,394 @@ class HomeConsumer(AsyncJsonWebsocketConsumer):
             "players": event["players"]
         })
 
-class GameConsumer(AsyncJsonWebsocketConsumer):
+    async def player_joined(self, event):
+        if event["player"]["id"] == self.user.id:
+            return
+        await self.send_json({
+            "type": "player_joined",
+            "player": event["player"],
+        })
+
+    async def player_left(self, event):
+        if event["player_id"] == self.user.id:
+            return
+        await self.send_json({
+            "type": "player_left",
+            "player_id": event["player_id"],
+        })
+
+class GameConsumer(MeasuredEventsMixin, AsyncJsonWebsocketConsumer):
+    metrics_kind = "game"
+
     async def connect(self):
-        self.game_id = self.scope['url_route']['kwargs']['game_id']
+        self.game_id = int(self.scope['url_route']['kwargs']['game_id'])
         self.game_group_name = f'game_{self.game_id}'
+        self.spectator = False
+        # Whether this process owns the game; otherwise actions go to the owner
+        self.local = owns_game(self.game_id)
+        # Position the game_update events of this socket are replayed on
+        self.board = None
+        self.awaiting_sync = False
 
-        # Add the user to the group
-        await self.channel_layer.group_add(
-            self.game_group_name,
-            self.channel_name
-        )
-        print(f"Added user to game group: {self.game_group_name}")
+        try:
+            if self.local:
+                state = await game_states.get(self.game_id)
+                self.white_id, self.black_id = state.white_id, state.black_id
+            else:
+                self.white_id, self.black_id, fen = await repository.game_position(self.game_id)
+        except Game.DoesNotExist:
+            await self.close()
+            return
+        is_player = self.scope["user"].id in (self.white_id, self.black_id)
 
-        await self.accept()
+        # Clients asking for the compact subprotocol get binary updates
+        self.compact = COMPACT_SUBPROTOCOL in self.scope.get("subprotocols", [])
+        await self.accept(subprotocol=COMPACT_SUBPROTOCOL if self.compact else None)
+
+        if is_player:
+            # Add the player to the group
+            await self.channel_layer.group_add(
+                self.game_group_name,
+                self.channel_name
+            )
+        else:
+            # Spectators are served by the process-wide relay of the game
+            self.spectator = True
+            await add_spectator(self, self.game_id)
+        if not self.compact:
+            # Taken after joining, so every later update follows this position.
+            # A move saved before the remote read shows up as a gap, see game_update
+            self.board = chess.Board(state.board.fen() if self.local else fen)
+        if self.local:
+            await self.joined(state)
+        else:
+            await forward(self.channel_layer, self.game_id, {
+                "type": "game.wake",
+                "reply_channel": self.channel_name,
+                "compact": self.compact,
+            })
+
+    async def joined(self, state):
+        """
+        The part of connecting that needs the game's owner.
+        """
+        # Resume the bot's turn if its search was lost, e.g. by a restart
+        await schedule_bot_move(state)
+        if self.compact:
+            await self.send_sync()
 
     async def disconnect(self, close_code):
-        # Remove the user from the group
-        await self.channel_layer.group_discard(
-            self.game_group_name,
-            self.channel_name
-        )
+        if not hasattr(self, "compact"):
+            return
+        if self.spectator:
+            await remove_spectator(self, self.game_id)
+        else:
+            # Remove the player from the group
+            await self.channel_layer.group_discard(
+                self.game_group_name,
+                self.channel_name
+            )
+
+    async def receive(self, text_data=None, bytes_data=None):
+        if not self.local:
+            with measure("game", "forward"):
+                await self.forward_action(text_data, bytes_data)
+            return
+
+        if bytes_data is not None:
+            with measure("game", "compact"):
+                await self.receive_compact(bytes_data)
+            return
 
-    async def receive(self, text_data):
         data = json.loads(text_data)
         action = data.get('action')
 
-        if action == 'move':
-            print("INSIDE MOVE RECIEVE")
-            await self.handle_move(data.get("move"))
-        elif action == 'game_resigned':
-            user = self.scope['user']
-            await self.handle_resignation(user)
-    
+        with measure("game", action):
+            if action == 'move':
+                await self.handle_move(data.get("move"))
+            elif action == 'game_resigned':
+                user = self.scope['user']
+                await self.handle_resignation(user)
+            elif action == 'sync':
+                await self.send_sync()
+            elif action == 'resume':
+                await self.handle_resume(data.get("last_seq"))
+            elif action == 'analyse':
+                await self.send_analysis(data.get("depth"))
+
+    async def receive_compact(self, bytes_data):
+        try:
+            opcode, move = unpack_client_frame(bytes_data)
+        except ValueError as e:
+            await self.send_json({"status": "error", "message": f"Invalid frame: {e}"})
+            return
+
+        if opcode == OP_MOVE:
+            await self.handle_move(move.uci())
+        elif opcode == OP_SYNC:
+            await self.send_sync()
+        elif opcode == OP_RESIGN:
+            await self.handle_resignation(self.scope['user'])
+
+    async def send_analysis(self, depth=None):
+        """
+        Send the evaluation and best line of the current position.
+        """
+        try:
+            state = await game_states.get(self.game_id)
+        except Game.DoesNotExist:
+            await self.send_json({"status": "error", "message": "Game not found"})
+            return
+        try:
+            depth = analysis_depth(depth)
+        except ValueError as e:
+            await self.send_json({"status": "error", "message": str(e)})
+            return
+        try:
+            analysis = await analyse_position(state.board.fen(), depth)
+        except BotBusy:
+            await self.send_json({"status": "error", "message": "Analysis is busy, please try again later."})
+            return
+        await self.send_json({"type": "analysis", **analysis})
+
+    async def send_sync(self):
+        """
+        Send the full position, used on connect and whenever a client resyncs.
+        """
+        if not self.local:
+            await self.forward_action(json.dumps({"action": "sync"}), None)
+            return
+        try:
+            state = await game_states.get(self.game_id)
+        except Game.DoesNotExist:
+            await self.send_json({"status": "error", "message": "Game not found"})
+            return
+        await self.synced({
+            "type": "sync",
+            "fen": state.board.fen(),
+            "turn": state.turn == chess.WHITE,
+            "ply": state.board.ply(),
+            "clock": state.clock_snapshot(time.time()),
+            "game_over": state.game_over,
+            "legal_moves": state.legal_moves_text(),
+            "seq": state.seq,
+            "role": "spectator" if self.spectator else "player",
+        })
+
+    async def synced(self, sync):
+        """
+        Send a sync frame and follow its position from now on.
+        """
+        self.board = chess.Board(sync["fen"])
+        self.awaiting_sync = False
+        await self.send_json(sync)
+
+    async def forwarded_sync(self, event):
+        # The sync the owning worker built for this socket
+        await self.synced(event["sync"])
+
     async def game_resigned(self, event):
-        winner = event.get("winner")
-        print(f"Game resigned event received. Winner: {winner}")
         await self.send_json({
             "status": "game_resigned",
-            "winner": winner
+            "winner": event.get("winner"),
+            "seq": event.get("seq"),
         })
     
     async def handle_resignation(self, user):
         try:
-            game = await sync_to_async(Game.objects.get)(id=self.game_id)
-
-            player_white = await sync_to_async(lambda: game.player_white)()
-            player_black = await sync_to_async(lambda: game.player_black)()
-
-            if user == player_white:
-                game.winner = player_black
-            elif user == player_black:
-                game.winner = player_white
-            else:
-                return
+            state = await game_states.get(self.game_id)
+        except Game.DoesNotExist:
+            logger.warning("Resignation in missing game %s by user %s", self.game_id, user.id)
+            return
 
-            game.resignation = True
-            game.game_over = True
-            await sync_to_async(game.save)()
+        event = await game_states.resign(state, user.id)
+        if event is False:
+            await self.send_conflict()
+            return
+        if event is None:
+            return
 
-            # Broadcast the resignation to all players in the group
-            await self.channel_layer.group_send(
-                self.game_group_name,
-                {
-                    'type': 'game_resigned',
-                    'winner': game.winner.username
-                }
-            )
+        # Broadcast the resignation to all players in the group
+        await self.channel_layer.group_send(self.game_group_name, event)
 
+    async def handle_resume(self, last_seq):
+        """
+        Send a reconnecting client the events it missed after `last_seq`, or
+        the full position if they are no longer buffered.
+        """
+        try:
+            state = await game_states.get(self.game_id)
         except Game.DoesNotExist:
-            print("Game not found.")
+            await self.send_json({"status": "error", "message": "Game not found"})
+            return
+        missed = state.events_since(last_seq) if isinstance(last_seq, int) else None
+        if missed is None:
+            await self.send_sync()
+            return
+        plies = [event["ply"] for event in missed if event["type"] == "game_update"]
+        if plies and not self.compact:
+            # Replay the missed moves from the position before the first one
+            board = state.board.copy()
+            while board.ply() >= plies[0] and board.move_stack:
+                board.pop()
+            if board.ply() != plies[0] - 1:
+                await self.send_sync()
+                return
+            self.board = board
+        for event in missed:
+            await self.dispatch(event)
 
     async def game_update(self, event):
+        if self.compact:
+            await self.send(bytes_data=pack_update(event["ply"], event["move"], event["clock"]))
+            return
+        if self.board is not None and event["ply"] <= self.board.ply():
+            # Already part of the position of the last sync
+            return
+        if self.board is None or event["ply"] != self.board.ply() + 1:
+            # Missed an update; one resync covers every update until it lands
+            if not self.awaiting_sync:
+                self.awaiting_sync = True
+                await self.send_sync()
+            return
+        self.board.push(decode_move(event["move"]))
+        to_move = self.white_id if self.board.turn == chess.WHITE else self.black_id
         await self.send_json({
             "type": "game_update",
-            "fen": event["fen"],
-            "turn": event["turn"],
+            "fen": self.board.fen(),
+            "turn": self.board.turn == chess.WHITE,
+            "clock": event["clock"],
+            # Only the side to move can use them
+            "legal_moves": event["legal_moves"] if to_move == self.scope["user"].id else "",
+            "seq": event["seq"],
+        })
+
+    async def send_conflict(self):
+        """
+        Tell the sender its action lost the race against a change made
+        elsewhere, and resync it with the position that won.
+        """
+        await self.send_json({
+            "status": "conflict",
+            "message": "The game changed before your action was saved, please try again.",
         })
+        await self.send_sync()
 
     async def handle_move(self, move):
         try:
-            print("Inside handle_move")
-            game = await sync_to_async(Game.objects.get)(id=self.game_id)
-            board = chess.Board(game.current_fen)
-            player_white = await sync_to_async(lambda: game.player_white)()
-            player_black = await sync_to_async(lambda: game.player_black)()
-
-            print(f"player_white = {player_white}")
-            print(f"player_black = {player_black}")
-            print(f"board.turn = {board.turn}")
-            current_player = player_white if board.turn == chess.WHITE else player_black
-            print(f"current_player = {current_player}") 
-            if self.scope["user"] != current_player:
-                print("Not your turn!")
-                await self.send_json({"status": "error", "message": "Not your turn!"})
+            state = await game_states.get(self.game_id)
+        except Game.DoesNotExist:
+            logger.warning("Move in missing game %s", self.game_id)
+            await self.send_json({"status": "error", "message": "Game not found"})
+            return
+
+        async with state.lock:
+            if state.game_over:
+                await self.send_json({"status": "error", "message": "The game is over."})
                 return
 
-            chess_move = chess.Move.from_uci(move)
-            if chess_move in board.legal_moves:
-                board.push(chess_move)
-                game.current_fen = board.fen()
-                await sync_to_async(game.save)()
+            if self.spectator:
+                await self.send_json({"status": "error", "message": "Spectators cannot move."})
+                return
 
-                await self.channel_layer.group_send(
-                    self.game_group_name,
-                    {
-                        "type": "game_update",
-                        "fen": board.fen(),
-                        "turn": board.turn == chess.WHITE,
-                    }
-                )
-                print(f"Turn: {board.turn}")
-                print(f"Broadcasted update: FEN={board.fen()} Turn={board.turn == chess.WHITE}")
-            else:
-                print(f"Invalid move: {move}")
+            if self.scope["user"].id != state.player_to_move:
+                await self.send_json({"status": "error", "message": "Not your turn!"})
+                return
+
+            if not isinstance(move, str) or move not in state.legal_moves:
                 await self.send_json({"status": "error", "message": f"Invalid move: {move} is not allowed!"})
                 return
-        except Game.DoesNotExist:
-            print("GAME NOT FOUND")
-            await self.send_json({"status": "error", "message": "Game not found"})
\ No newline at end of file
+
+            events = await game_states.play(state, chess.Move.from_uci(move), time.time())
+            if events is None:
+                await self.send_conflict()
+                return
+
+        await broadcast_events(self.channel_layer, state, events)
+        await schedule_bot_move(state)
+
+    async def game_over(self, event):
+        await self.send_json({
+            "type": "game_over",
+            "winner": event["winner"],
+            "result": event["result"],
+            "termination": event["termination"],
+            "seq": event["seq"],
+        })
+
+    async def forward_action(self, text_data, bytes_data):
+        """
+        Have the worker owning the game run a frame of this socket.
+        """
+        await forward(self.channel_layer, self.game_id, {
+            "type": "game.action",
+            "user_id": self.scope["user"].id,
+            "reply_channel": self.channel_name,
+            "compact": self.compact,
+            "text": text_data,
+            "bytes": bytes_data,
+        })
+
+    async def forwarded_send(self, event):
+        # A frame the owning worker sent to this socket
+        await self.base_send(event["message"])
+
+
+class ForwardedGameConsumer(GameConsumer):
+    """
+    Stands in, on the worker owning a game, for a socket connected to
+    another worker: runs its actions with the GameConsumer code and sends
+    every frame back to that socket through the channel layer.
+    """
+
+    def __init__(self, channel_layer, state, user_id, reply_channel, compact):
+        super().__init__()
+        self.channel_layer = channel_layer
+        self.scope = {"type": "websocket", "user": User(id=user_id)}
+        self.game_id = state.game_id
+        self.game_group_name = f'game_{state.game_id}'
+        self.white_id, self.black_id = state.white_id, state.black_id
+        self.spectator = not state.is_player(user_id)
+        self.compact = compact
+        self.local = True
+        self.board = None
+        self.awaiting_sync = False
+        self.reply_channel = reply_channel
+
+    async def base_send(self, message):
+        if self.reply_channel is not None:
+            await self.channel_layer.send(self.reply_channel, {"type": "forwarded_send", "message": message})
+
+    async def synced(self, sync):
+        # The socket follows the position of the sync as well
+        self.board = chess.Board(sync["fen"])
+        self.awaiting_sync = False
+        if self.reply_channel is not None:
+            await self.channel_layer.send(self.reply_channel, {"type": "forwarded_sync", "sync": sync})
+
+
+async def handle_forwarded(message):
+    """
+    Run a message forwarded to this worker by another one, see engine.sharding.
+    """
+    if message["type"] in ("seek.add", "seek.remove"):
+        handle_seek_message(message)
+        return
+    if message["type"] == "game.invalidate":
+        game_states.invalidate(message["game_id"])
+        return
+    try:
+        state = await game_states.get(message["game_id"])
+    except Game.DoesNotExist:
+        return
+    consumer = ForwardedGameConsumer(
+        get_channel_layer(), state, message.get("user_id"), message.get("reply_channel"), message.get("compact", False)
+    )
+    if message["type"] == "game.wake":
+        await consumer.joined(state)
+    elif message["type"] == "game.action":
+        await consumer.receive(text_data=message["text"], bytes_data=message["bytes"])
+
+
+game_worker = GameWorker(handle_forwarded)
+on_startup(game_worker.start)
\ No newline at end of file
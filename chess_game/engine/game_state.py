@@ -0,0 +1,480 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+
+import chess
+from asgiref.sync import sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+from .archive import archived_moves
+from .clock import ChessClock, timer_wheel
+from .history import invalidate_history
+from .models import Game, Move
+from .move_log import move_writer, replay
+from .outcome import GameResult, broadcast_game_over, evaluate_outcome, game_over_event, time_forfeit
+from .positions import index_game
+from .protocol import encode_move
+from .ratings import rate_game
+from .sharding import forward, owns_game
+from .startup import on_startup
+
+logger = logging.getLogger(__name__)
+
+
+class GameState:
+    """
+    Live state of a single game, kept in memory while the game is being played.
+    """
+
+    def __init__(self, game_id, board, white_id, black_id, white_name="", black_name="", game_over=False, clock=None,
+                 version=0):
+        self.game_id = game_id
+        self.board = board
+        self.white_id = white_id
+        self.black_id = black_id
+        self.white_name = white_name
+        self.black_name = black_name
+        self.game_over = game_over
+        self.clock = clock  # ChessClock, or None for games without time control
+        self.version = version  # Game.version the board was loaded or last committed at
+        # Every game event is stamped with the next sequence number. Moves and
+        # the final result each take one, so a reloaded game continues the
+        # same numbering.
+        self.seq = board.ply() + (1 if game_over else 0)
+        self.events = deque(maxlen=settings.GAME_REPLAY_BUFFER_SIZE)
+        self._legal_moves = None
+        # Serialises moves for this game within the process
+        self.lock = asyncio.Lock()
+
+    @property
+    def turn(self):
+        return self.board.turn
+
+    @property
+    def player_to_move(self):
+        return self.white_id if self.board.turn == chess.WHITE else self.black_id
+
+    def is_player(self, user_id):
+        return user_id in (self.white_id, self.black_id)
+
+    @property
+    def legal_moves(self):
+        """
+        UCI strings of the legal moves in the current position, generated
+        once per position and dropped whenever the board changes.
+        """
+        if self._legal_moves is None:
+            self._legal_moves = frozenset(move.uci() for move in self.board.legal_moves)
+        return self._legal_moves
+
+    def legal_moves_text(self):
+        """
+        The legal moves as one space-separated string, the form sent to
+        clients; empty once the game is over.
+        """
+        if self.game_over:
+            return ""
+        return " ".join(sorted(self.legal_moves))
+
+    def player_name(self, color):
+        return self.white_name if color == chess.WHITE else self.black_name
+
+    def stamp(self, event):
+        """
+        Give a game event the next sequence number and keep it for replay.
+        Must be called while holding the lock.
+        """
+        self.seq += 1
+        event["seq"] = self.seq
+        self.events.append(event)
+        return event
+
+    def events_since(self, last_seq):
+        """
+        Return the events after `last_seq`, or None if some of them have
+        already left the replay buffer.
+        """
+        if last_seq >= self.seq:
+            return []
+        oldest = self.events[0]["seq"] if self.events else self.seq + 1
+        if last_seq + 1 < oldest:
+            return None
+        return [event for event in self.events if event["seq"] > last_seq]
+
+    def push(self, move, now):
+        """
+        Play a validated move and press the mover's clock. Returns the clock
+        as it was before, to be handed to pop() if the move is rolled back.
+        """
+        previous_clock = None
+        if self.clock is not None:
+            previous_clock = self.clock.copy()
+            self.clock.press(self.board.turn, now)
+        self.board.push(move)
+        self._legal_moves = None
+        return previous_clock
+
+    def pop(self, previous_clock):
+        self.board.pop()
+        self._legal_moves = None
+        self.clock = previous_clock
+
+    def time_forfeit(self, now):
+        """
+        Return the result if the side to move has run out of time, else None.
+        """
+        if self.clock is None or self.clock.time_left(self.turn, self.turn, now) > 0:
+            return None
+        return time_forfeit(self.board)
+
+    def clock_snapshot(self, now):
+        if self.clock is None:
+            return None
+        return self.clock.snapshot(self.turn, now)
+
+
+class GameFinisher:
+    """
+    Rates and indexes finished games one at a time on a task of its own, in
+    a thread outside the one that commits the moves of every game, so the
+    end of a game does not hold up the others. Both steps are claimed in the
+    database, so running them again is harmless.
+    """
+
+    def __init__(self):
+        self._pending = deque()  # (game id, UCI moves or None)
+        self._task = None
+
+    def add(self, game_id, moves):
+        self._pending.append((game_id, moves))
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while self._pending:
+            game_id, moves = self._pending.popleft()
+            try:
+                await sync_to_async(self._finish, thread_sensitive=False)(game_id, moves)
+            except Exception:
+                logger.exception("Failed to rate and index game %s", game_id)
+
+    def _finish(self, game_id, moves):
+        rate_game(game_id)
+        index_game(game_id, moves)
+
+
+game_finisher = GameFinisher()
+
+
+class GameStateCache:
+    """
+    Per-process LRU cache of live games with write-through persistence.
+
+    Moves are validated against the cached board; only the resulting FEN and
+    clocks are written back to the database.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._states = OrderedDict()
+        self._clocks_recovered = False
+
+    def __contains__(self, game_id):
+        return int(game_id) in self._states
+
+    def __len__(self):
+        return len(self._states)
+
+    async def get(self, game_id):
+        """
+        Return the state for `game_id`, loading it from the database on a miss.
+        Raises Game.DoesNotExist if the game is unknown.
+        """
+        game_id = int(game_id)
+        state = self._states.get(game_id)
+        if state is not None:
+            self._states.move_to_end(game_id)
+            return state
+
+        loaded = await self.load(game_id)
+        # Another coroutine may have loaded the game while we were waiting
+        state = self._states.get(game_id)
+        if state is None:
+            state = loaded
+            self._store(state)
+            self.arm_clock(state)
+        return state
+
+    async def load(self, game_id):
+        """
+        Return a fresh state for `game_id` from the database, without caching
+        it. Raises Game.DoesNotExist if the game is unknown.
+        """
+        game_id = int(game_id)
+        row, moves = await sync_to_async(self._load)(game_id)
+        # Moves still buffered by the writer are not in the database yet
+        moves.update(move_writer.pending_moves(game_id))
+        return GameState(
+            game_id,
+            self._build_board(row["current_fen"], moves),
+            row["player_white_id"],
+            row["player_black_id"],
+            white_name=row["player_white__username"],
+            black_name=row["player_black__username"],
+            game_over=row["game_over"],
+            clock=self._build_clock(row),
+            version=row["version"],
+        )
+
+    def _load(self, game_id):
+        row = Game.objects.values(
+            "current_fen", "player_white_id", "player_black_id",
+            "player_white__username", "player_black__username", "game_over",
+            "base_time", "increment", "white_time_ms", "black_time_ms", "clock_updated_at", "version",
+        ).get(id=game_id)
+        moves = dict(Move.objects.filter(game_id=game_id).values_list("move_number", "uci_move"))
+        if not moves and row["game_over"]:
+            moves = dict(enumerate(archived_moves(game_id) or [], start=1))
+        return row, moves
+
+    def _build_board(self, fen, moves):
+        """
+        Replay the move list so the board has its history (needed for
+        repetition), falling back to the stored FEN for games without one.
+        """
+        if moves:
+            board = replay(None, moves=[moves[number] for number in sorted(moves)])
+            if board.fen() == fen:
+                return board
+        return chess.Board(fen)
+
+    def _build_clock(self, row):
+        return ChessClock.for_game(
+            row["base_time"], row["increment"], row["white_time_ms"], row["black_time_ms"], row["clock_updated_at"]
+        )
+
+    def _store(self, state):
+        self._states[state.game_id] = state
+        self._states.move_to_end(state.game_id)
+        while len(self._states) > self.max_size:
+            self._states.popitem(last=False)
+
+    async def commit(self, state, result=None):
+        """
+        Write the current position of `state` back to the database, finishing
+        the game in the same statement when `result` is given.
+
+        The write is a compare-and-swap on Game.version. Returns False if the
+        game was changed or finished elsewhere since `state` was loaded (e.g.
+        a move through another process); the stale state is then dropped so
+        the next access reloads it.
+        """
+        committed = await sync_to_async(self._save)(state, result)
+        if not committed:
+            self.invalidate(state.game_id)
+            return False
+        state.version += 1
+        if result is not None:
+            state.game_over = True
+            standard_start = state.board.root().fen() == chess.STARTING_FEN
+            game_finisher.add(state.game_id, [move.uci() for move in state.board.move_stack] if standard_start else None)
+        self.arm_clock(state)
+        return True
+
+    def _save(self, state, result):
+        fields = {"current_fen": state.board.fen(), "version": state.version + 1}
+        if state.clock is not None:
+            # The clocks are stored with every move so they survive a restart
+            fields["white_time_ms"] = state.clock.remaining[chess.WHITE]
+            fields["black_time_ms"] = state.clock.remaining[chess.BLACK]
+            if state.clock.running_since is not None:
+                fields["clock_updated_at"] = datetime.fromtimestamp(state.clock.running_since, timezone.utc)
+        if result is not None:
+            fields["game_over"] = True
+            fields["termination"] = result.termination
+            fields["resignation"] = result.termination == "resignation"
+            if result.winner is not None:
+                fields["winner_id"] = state.white_id if result.winner == chess.WHITE else state.black_id
+        updated = Game.objects.filter(id=state.game_id, game_over=False, version=state.version).update(**fields)
+        if updated and result is not None:
+            # update() bypasses post_save, so drop the players' history pages
+            # here; a move alone leaves the cached result as it was
+            invalidate_history(state.white_id, state.black_id)
+        return updated == 1
+
+    async def resign(self, state, user_id):
+        """
+        Finish the game of `state` by the resignation of `user_id`. Returns
+        the game_resigned event, None if the game is over or `user_id` does
+        not play it, or False if the game changed elsewhere meanwhile.
+        """
+        async with state.lock:
+            if state.game_over or not state.is_player(user_id):
+                return None
+            winner = chess.BLACK if user_id == state.white_id else chess.WHITE
+            if not await self.commit(state, GameResult(winner, "resignation")):
+                return False
+            return state.stamp({
+                "type": "game_resigned",
+                "winner": state.player_name(winner),
+            })
+
+    async def play(self, state, move, now):
+        """
+        Play a legal move of the side to move, commit it and record it. Must be
+        called while holding the state's lock.
+
+        Returns the stamped events to broadcast with broadcast_events(), which
+        only hold the result if the flag had already fallen, or None if the
+        commit lost against a change made elsewhere.
+        """
+        result = state.time_forfeit(now)
+        if result is not None:
+            # The move came in after the flag fell
+            if not await self.commit(state, result):
+                return None
+            return [state.stamp(game_over_event(state, result))]
+
+        previous_clock = state.push(move, now)
+        result = evaluate_outcome(state.board)
+        try:
+            committed = await self.commit(state, result)
+        except Exception:
+            state.pop(previous_clock)
+            raise
+        if not committed:
+            state.pop(previous_clock)
+            return None
+        move_writer.record(state.game_id, state.board.ply(), move.uci())
+        # The move goes on the channel layer rather than the FEN; sockets
+        # replay it on their own copy of the position, see
+        # GameConsumer.game_update. The legal moves are generated once here,
+        # and the same set then validates the next move.
+        events = [state.stamp({
+            "type": "game_update",
+            "ply": state.board.ply(),
+            "move": encode_move(move),
+            "clock": state.clock_snapshot(now),
+            "legal_moves": state.legal_moves_text(),
+        })]
+        if result is not None:
+            events.append(state.stamp(game_over_event(state, result)))
+        return events
+
+    def arm_clock(self, state):
+        """
+        Schedule the time-loss check of the side to move on the timer wheel.
+        """
+        deadline = None
+        if state.clock is not None and not state.game_over:
+            deadline = state.clock.deadline(state.turn)
+        if deadline is None:
+            timer_wheel.cancel(state.game_id)
+        else:
+            timer_wheel.schedule(state.game_id, deadline, lambda: self.flag(state.game_id))
+
+    async def flag(self, game_id):
+        """
+        End a game on time if the side to move has run out of it.
+        """
+        try:
+            state = await self.get(game_id)
+        except Game.DoesNotExist:
+            return
+        async with state.lock:
+            if state.game_over:
+                return
+            result = state.time_forfeit(time.time())
+            if result is None:
+                self.arm_clock(state)
+                return
+            if not await self.commit(state, result):
+                return
+            event = state.stamp(game_over_event(state, result))
+        await broadcast_game_over(get_channel_layer(), state, event)
+
+    async def recover_clocks(self):
+        """
+        Re-arm the timers of running clocks after a process (re)start, so
+        games nobody reconnects to still end on time. Runs once per process,
+        at startup.
+        """
+        if self._clocks_recovered:
+            return
+        self._clocks_recovered = True
+        for game_id, deadline in await sync_to_async(self._running_clocks)():
+            # Other workers run the clocks of the games they own
+            if game_id not in self._states and owns_game(game_id):
+                timer_wheel.schedule(game_id, deadline, lambda game_id=game_id: self.flag(game_id))
+
+    def _running_clocks(self):
+        games = Game.objects.filter(
+            game_over=False, base_time__isnull=False, clock_updated_at__isnull=False
+        ).values_list("id", "current_fen", "white_time_ms", "black_time_ms", "clock_updated_at")
+        deadlines = []
+        for game_id, fen, white_time_ms, black_time_ms, clock_updated_at in games:
+            white_to_move = fen.split()[1] == "w"
+            remaining = white_time_ms if white_to_move else black_time_ms
+            deadlines.append((game_id, clock_updated_at.timestamp() + remaining / 1000))
+        return deadlines
+
+    def invalidate(self, game_id):
+        """
+        Drop a cached game so the next access reloads it from the database.
+        Must be called whenever a game is changed outside the move pipeline.
+        """
+        self._states.pop(int(game_id), None)
+
+
+async def invalidate_game(channel_layer, game_id):
+    """
+    Drop a game changed outside the move pipeline from the cache of the
+    worker owning it.
+    """
+    if owns_game(game_id):
+        game_states.invalidate(game_id)
+    else:
+        await forward(channel_layer, game_id, {"type": "game.invalidate"})
+
+
+async def resign_game(channel_layer, game_id, user_id):
+    """
+    Resign `user_id` from a game outside its sockets, e.g. from a view, and
+    send the game_resigned event to the game. Returns it, or None if the
+    resignation was refused (see GameStateCache.resign).
+    Raises Game.DoesNotExist.
+    """
+    if owns_game(game_id):
+        state = await game_states.get(game_id)
+    else:
+        # The owner's cached state fails its next commit and is dropped below
+        state = await game_states.load(game_id)
+    event = await game_states.resign(state, user_id)
+    if not event:
+        return None
+    if not owns_game(game_id):
+        await invalidate_game(channel_layer, game_id)
+    await channel_layer.group_send(f"game_{game_id}", event)
+    return event
+
+
+async def broadcast_events(channel_layer, state, events):
+    """
+    Send events returned by GameStateCache.play() in order.
+    """
+    for event in events:
+        if event["type"] == "game_over":
+            await broadcast_game_over(channel_layer, state, event)
+        else:
+            await channel_layer.group_send(f"game_{state.game_id}", event)
+
+
+game_states = GameStateCache(settings.GAME_STATE_CACHE_SIZE)
+
+
+@on_startup
+def recover_clocks_at_startup():
+    asyncio.get_running_loop().create_task(game_states.recover_clocks())
@@ -0,0 +1,81 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import models
+
+from .models import Game
+
+
+def _cache_key(user_id):
+    return f"game_history:{user_id}"
+
+
+def game_summary(game, user_id):
+    """
+    Summarise a game as shown in the history table of `user_id`.
+    The game must have player_white and player_black loaded.
+    """
+    if game.player_white_id == user_id:
+        opponent = game.player_black
+    else:
+        opponent = game.player_white
+
+    if game.winner_id is None:
+        result = "Draw" if game.game_over else "Ongoing"
+    elif game.winner_id == user_id:
+        result = "Win"
+    else:
+        result = "Loss"
+
+    return {
+        "id": game.id,
+        "opponent": opponent.username,
+        "result": result,
+        "move_count": game.move_count,
+        "journal_entry": game.journal_entry or "None",
+    }
+
+
+def history_page(user_id, before=None, limit=None):
+    """
+    Return one page of a user's games, newest first, as (games, next_cursor).
+    Pass `next_cursor` back as `before` to get the following page. The first
+    page is cached until one of the user's games changes.
+    """
+    limit = limit or settings.GAME_HISTORY_PAGE_SIZE
+    if before is None:
+        page = cache.get(_cache_key(user_id))
+        if page is not None:
+            return page
+
+    games = Game.objects.filter(
+        models.Q(player_white_id=user_id) | models.Q(player_black_id=user_id)
+    ).select_related("player_white", "player_black").order_by("-id")
+    if before is not None:
+        games = games.filter(id__lt=before)
+    games = list(games[:limit + 1])
+
+    next_cursor = games[limit - 1].id if len(games) > limit else None
+    page = ([game_summary(game, user_id) for game in games[:limit]], next_cursor)
+    if before is None:
+        cache.set(_cache_key(user_id), page, settings.GAME_HISTORY_CACHE_TIMEOUT)
+    return page
+
+
+def invalidate_history(*user_ids):
+    cache.delete_many([_cache_key(user_id) for user_id in user_ids if user_id])
+
+
+def game_changed_events(game):
+    """
+    Build a "game_changed" channel event for each player of `game`, keyed by
+    user id, so receivers can update a single history row without a query.
+    """
+    return {
+        user_id: {"type": "game_changed", "game": game_summary(game, user_id)}
+        for user_id in (game.player_white_id, game.player_black_id)
+    }
+
+
+def load_game_changed_events(game_id):
+    game = Game.objects.select_related("player_white", "player_black").get(id=game_id)
+    return game_changed_events(game)
@@ -0,0 +1,128 @@
+from bisect import bisect_left, insort
+from functools import lru_cache
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+class BaseLeaderboard:
+    """
+    Players ordered by rating, maintained incrementally as games are rated
+    so that the top of the table and any player's rank are read without
+    sorting the ratings table.
+    """
+
+    def update(self, user_id, username, rating):
+        """
+        Insert or move a player.
+        """
+        raise NotImplementedError
+
+    def rank(self, user_id):
+        """
+        Return the 1-based rank of a player, or None if unrated.
+        """
+        raise NotImplementedError
+
+    def top(self, count):
+        """
+        Return the best `count` players as {"id", "username", "rating"}.
+        """
+        raise NotImplementedError
+
+    def rebuild(self, entries):
+        """
+        Replace the whole table with (user id, username, rating) entries.
+        """
+        raise NotImplementedError
+
+
+class LocalLeaderboard(BaseLeaderboard):
+    """
+    In-process leaderboard for tests and single-process development servers.
+    """
+
+    def __init__(self):
+        self._order = []  # sorted (-rating, user id)
+        self._players = {}  # user id -> (username, rating)
+
+    def update(self, user_id, username, rating):
+        old = self._players.get(user_id)
+        if old is not None:
+            del self._order[bisect_left(self._order, (-old[1], user_id))]
+        self._players[user_id] = (username, rating)
+        insort(self._order, (-rating, user_id))
+
+    def rank(self, user_id):
+        player = self._players.get(user_id)
+        if player is None:
+            return None
+        return bisect_left(self._order, (-player[1], user_id)) + 1
+
+    def top(self, count):
+        return [
+            {"id": user_id, "username": self._players[user_id][0], "rating": -rating}
+            for rating, user_id in self._order[:count]
+        ]
+
+    def rebuild(self, entries):
+        self._order = []
+        self._players = {}
+        for user_id, username, rating in entries:
+            self._players[user_id] = (username, rating)
+            self._order.append((-rating, user_id))
+        self._order.sort()
+
+
+class RedisLeaderboard(BaseLeaderboard):
+    """
+    Shares the leaderboard between processes through Redis.
+
+    leaderboard:ratings  sorted set of user ids scored by rating
+    leaderboard:names    hash of user id -> username
+    """
+
+    RATINGS_KEY = "leaderboard:ratings"
+    NAMES_KEY = "leaderboard:names"
+
+    def __init__(self, url):
+        import redis
+
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+
+    def update(self, user_id, username, rating):
+        with self.client.pipeline(transaction=True) as pipe:
+            pipe.zadd(self.RATINGS_KEY, {user_id: rating})
+            pipe.hset(self.NAMES_KEY, user_id, username)
+            pipe.execute()
+
+    def rank(self, user_id):
+        rank = self.client.zrevrank(self.RATINGS_KEY, user_id)
+        return None if rank is None else rank + 1
+
+    def top(self, count):
+        if count <= 0:
+            return []
+        entries = self.client.zrevrange(self.RATINGS_KEY, 0, count - 1, withscores=True)
+        if not entries:
+            return []
+        usernames = self.client.hmget(self.NAMES_KEY, [user_id for user_id, _ in entries])
+        return [
+            {"id": int(user_id), "username": username, "rating": rating}
+            for (user_id, rating), username in zip(entries, usernames)
+        ]
+
+    def rebuild(self, entries):
+        entries = list(entries)
+        with self.client.pipeline(transaction=True) as pipe:
+            pipe.delete(self.RATINGS_KEY, self.NAMES_KEY)
+            if entries:
+                pipe.zadd(self.RATINGS_KEY, {user_id: rating for user_id, _, rating in entries})
+                pipe.hset(self.NAMES_KEY, mapping={user_id: username for user_id, username, _ in entries})
+            pipe.execute()
+
+
+@lru_cache(maxsize=None)
+def get_leaderboard():
+    backend_class = import_string(settings.LEADERBOARD_BACKEND)
+    return backend_class(**settings.LEADERBOARD_OPTIONS)
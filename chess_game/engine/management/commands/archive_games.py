@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from engine.archive import archive_games
+
+
+class Command(BaseCommand):
+    help = "Pack the moves of finished games into the compact game archive."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=1000, help="Games archived per transaction.")
+
+    def handle(self, *args, **options):
+        archived, skipped = archive_games(options["chunk_size"])
+        self.stdout.write(self.style.SUCCESS(f"Archived {archived} games."))
+        if skipped:
+            self.stdout.write(self.style.WARNING(
+                f"Skipped {skipped} games whose stored moves do not reach their final position."
+            ))
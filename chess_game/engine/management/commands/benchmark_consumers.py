@@ -0,0 +1,77 @@
+import asyncio
+import json
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from engine.benchmarks import BENCHMARK_SETTINGS, compare, reset_backends, run_benchmarks
+
+DEFAULT_BASELINE = Path(__file__).resolve().parents[2] / "benchmark_baseline.json"
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark HomeConsumer and GameConsumer with simulated websocket clients "
+        "and compare the results with a baseline."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--clients", type=int, default=500, help="Clients of the lobby connect storm.")
+        parser.add_argument("--pairs", type=int, default=250, help="Challenges sent and accepted.")
+        parser.add_argument("--games", type=int, default=100, help="Games played at once.")
+        parser.add_argument("--baseline", default=str(DEFAULT_BASELINE), help="Baseline file to compare with.")
+        parser.add_argument(
+            "--save-baseline",
+            action="store_true",
+            help="Write the results to the baseline file instead of comparing.",
+        )
+        parser.add_argument(
+            "--tolerance",
+            type=float,
+            default=0.5,
+            help="Latency increase over the baseline, as a fraction, reported as a regression.",
+        )
+
+    def handle(self, *args, **options):
+        parameters = {"clients": options["clients"], "pairs": options["pairs"], "games": options["games"]}
+        with override_settings(**BENCHMARK_SETTINGS):
+            reset_backends()
+            # A throwaway copy of the database, never the real one
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            try:
+                results = asyncio.run(
+                    run_benchmarks(options["clients"], options["pairs"], options["games"])
+                )
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+                reset_backends()
+
+        self.stdout.write(f"{'action':<18}{'count':>7}{'p50 ms':>10}{'p99 ms':>10}{'queries':>9}{'msgs':>9}{'per s':>9}")
+        for name, result in results.items():
+            self.stdout.write(
+                f"{name:<18}{result['actions']:>7}{result['p50_ms']:>10}{result['p99_ms']:>10}"
+                f"{result['queries_per_action']:>9}{result['messages_per_action']:>9}{result['actions_per_second']:>9}"
+            )
+
+        baseline_path = Path(options["baseline"])
+        if options["save_baseline"]:
+            baseline_path.write_text(json.dumps({"parameters": parameters, "results": results}, indent=2) + "\n")
+            self.stdout.write(self.style.SUCCESS(f"Baseline written to {baseline_path}."))
+            return
+
+        if not baseline_path.exists():
+            self.stdout.write(self.style.WARNING(f"No baseline at {baseline_path}, run with --save-baseline."))
+            return
+        baseline = json.loads(baseline_path.read_text())
+        if baseline["parameters"] != parameters:
+            # Fan-out and batching change with the load, so only like runs compare
+            self.stdout.write(self.style.WARNING(
+                f"The baseline was recorded with {baseline['parameters']}, not compared."
+            ))
+            return
+        regressions = compare(results, baseline["results"], options["tolerance"])
+        if regressions:
+            raise CommandError("Regressions against the baseline:\n" + "\n".join(regressions))
+        self.stdout.write(self.style.SUCCESS("No regressions against the baseline."))
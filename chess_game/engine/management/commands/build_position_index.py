@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from engine.positions import rebuild_index
+
+
+class Command(BaseCommand):
+    help = "Rebuild the opening explorer position index from all finished games."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=1000, help="Games read per query.")
+
+    def handle(self, *args, **options):
+        count = rebuild_index(options["chunk_size"])
+        self.stdout.write(self.style.SUCCESS(f"Indexed {count} games."))
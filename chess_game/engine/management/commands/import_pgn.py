@@ -0,0 +1,36 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from engine.pgn import PgnImporter
+
+
+class Command(BaseCommand):
+    help = "Bulk-import the finished games of a PGN file into Game and Move."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="PGN file to import.")
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=settings.PGN_IMPORT_BATCH_SIZE,
+            help="Games written per transaction.",
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+
+        def progress(imported, skipped):
+            rate = imported / max(time.monotonic() - started, 0.001)
+            self.stdout.write(f"{imported} games imported, {skipped} skipped ({rate:.0f} games/s)")
+
+        try:
+            handle = open(options["path"], encoding="utf-8-sig", errors="replace")
+        except OSError as e:
+            raise CommandError(f"Cannot open {options['path']}: {e}")
+        with handle:
+            imported = PgnImporter(options["batch_size"]).run(handle, progress)
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {imported} games. Run recompute_ratings and build_position_index to include them."
+        ))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from engine.ratings import rebuild_leaderboard, recompute_ratings
+
+
+class Command(BaseCommand):
+    help = "Recompute every Glicko-2 rating from the game history and rebuild the leaderboard."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--leaderboard-only",
+            action="store_true",
+            help="Only reload the leaderboard from the stored ratings.",
+        )
+
+    def handle(self, *args, **options):
+        if options["leaderboard_only"]:
+            rebuild_leaderboard()
+            self.stdout.write(self.style.SUCCESS("Leaderboard rebuilt."))
+            return
+        count = recompute_ratings()
+        self.stdout.write(self.style.SUCCESS(f"Rated {count} games."))
@@ -0,0 +1,271 @@
+import asyncio
+import random
+import time
+from bisect import bisect_left, insort
+
+import chess
+from asgiref.sync import sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+from .clock import clock_fields
+from .history import load_game_changed_events
+from .models import Game
+from .sharding import worker_channel
+
+# Worker holding the seek pool when GAME_WORKERS is above 1, so players
+# connected to different workers can be paired
+SEEK_POOL_WORKER = 0
+
+class Seek:
+    """
+    A player waiting in the "play now" queue for an opponent.
+    """
+
+    def __init__(self, user_id, username, rating, base_time=None, increment=0, channel_name=None, created_at=None):
+        self.user_id = user_id
+        self.username = username
+        self.rating = rating
+        self.time_control = (base_time, increment) if base_time else (None, 0)
+        self.channel_name = channel_name
+        self.created_at = time.time() if created_at is None else created_at
+
+    def as_message(self):
+        """
+        The seek as a channel-layer message to the worker holding the pool.
+        """
+        base_time, increment = self.time_control
+        return {
+            "type": "seek.add",
+            "user_id": self.user_id,
+            "username": self.username,
+            "rating": self.rating,
+            "base_time": base_time,
+            "increment": increment,
+            "channel_name": self.channel_name,
+            "created_at": self.created_at,
+        }
+
+    @classmethod
+    def from_message(cls, message):
+        return cls(
+            message["user_id"],
+            message["username"],
+            message["rating"],
+            message["base_time"],
+            message["increment"],
+            channel_name=message["channel_name"],
+            created_at=message["created_at"],
+        )
+
+    def key(self):
+        # Sort key within a band; the user id breaks rating ties
+        return (self.rating, self.user_id)
+
+    def bucket(self):
+        """
+        Pairing bucket of the seek: its time control and rating band.
+        """
+        return (self.time_control, int(self.rating // settings.MATCHMAKING_RATING_BUCKET))
+
+    def window(self, now):
+        """
+        Largest rating difference this seek accepts, growing while it waits.
+        """
+        waited = now - self.created_at
+        return min(
+            settings.MATCHMAKING_MAX_WINDOW,
+            settings.MATCHMAKING_BASE_WINDOW + settings.MATCHMAKING_WINDOW_GROWTH * waited,
+        )
+
+
+class SeekPool:
+    """
+    Open seeks, bucketed by time control and rating band of
+    MATCHMAKING_RATING_BUCKET points. Only the pool of SEEK_POOL_WORKER is
+    used; the other workers send it their seeks, see submit_seek().
+
+    A band keeps its seeks sorted by rating. A new seek is paired with the
+    closest-rated compatible seek by visiting the bands of its time control
+    outwards from its own and, in each, walking away from its rating from a
+    binary search, stopping as soon as no farther seek can be closer. Seeks
+    left waiting are retried, oldest first, by one background task as their
+    windows widen. Pairing happens synchronously on the event loop, so a
+    seek can never be matched twice.
+    """
+
+    def __init__(self, on_match):
+        self.on_match = on_match  # Coroutine function called with (first, second)
+        self._buckets = {}  # (time control, rating band) -> sorted list of seek keys
+        self._seeks = {}  # user id -> seek, oldest first
+        self._task = None
+
+    def __len__(self):
+        return len(self._seeks)
+
+    def __contains__(self, user_id):
+        return user_id in self._seeks
+
+    def add(self, seek):
+        """
+        Queue `seek`, replacing an earlier one of the same user, and start the
+        game at once if an opponent is already waiting.
+        """
+        self.remove(seek.user_id)
+        opponent = self._find_opponent(seek, time.time())
+        if opponent is not None:
+            self.remove(opponent.user_id)
+            self._start(opponent, seek)
+            return
+        self._seeks[seek.user_id] = seek
+        insort(self._buckets.setdefault(seek.bucket(), []), seek.key())
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def remove(self, user_id, channel_name=None):
+        """
+        Drop the seek of `user_id`, if any (only when it belongs to
+        `channel_name`, when given). Returns whether a seek was removed.
+        """
+        seek = self._seeks.get(user_id)
+        if seek is None or (channel_name is not None and seek.channel_name != channel_name):
+            return False
+        del self._seeks[user_id]
+        bucket = self._buckets[seek.bucket()]
+        del bucket[bisect_left(bucket, seek.key())]
+        if not bucket:
+            del self._buckets[seek.bucket()]
+        return True
+
+    def _find_opponent(self, seek, now):
+        """
+        Return the closest-rated seek of the same time control that accepts
+        `seek` and is accepted by it, or None.
+        """
+        size = settings.MATCHMAKING_RATING_BUCKET
+        window = seek.window(now)
+        time_control, band = seek.bucket()
+        best = None
+        best_diff = None
+        for distance in range(int(window // size) + 2):
+            # Ratings in a band `distance` away differ by more than (distance - 1) * size
+            if best is not None and (distance - 1) * size >= best_diff:
+                break
+            for index in {band - distance, band + distance}:
+                bucket = self._buckets.get((time_control, index))
+                if bucket:
+                    best, best_diff = self._closest_in_band(bucket, seek, now, window, best, best_diff)
+        return best
+
+    def _closest_in_band(self, bucket, seek, now, window, best, best_diff):
+        """
+        Walk a band down and up from the rating of `seek` and return the
+        closer of (best, best_diff) and the closest compatible seek found.
+        """
+        start = bisect_left(bucket, seek.key())
+        for indexes in (range(start - 1, -1, -1), range(start, len(bucket))):
+            for i in indexes:
+                rating, user_id = bucket[i]
+                diff = abs(rating - seek.rating)
+                if diff > window or (best is not None and diff >= best_diff):
+                    break
+                other = self._seeks[user_id]
+                if user_id != seek.user_id and diff <= other.window(now):
+                    best, best_diff = other, diff
+                    break
+        return best, best_diff
+
+    def sweep(self, now=None):
+        """
+        Pair waiting seeks whose windows have widened enough, oldest first.
+        """
+        now = time.time() if now is None else now
+        for seek in list(self._seeks.values()):
+            if seek.user_id not in self._seeks:
+                continue  # Already paired during this sweep
+            opponent = self._find_opponent(seek, now)
+            if opponent is not None:
+                self.remove(seek.user_id)
+                self.remove(opponent.user_id)
+                self._start(seek, opponent)
+
+    def _start(self, first, second):
+        asyncio.get_running_loop().create_task(self.on_match(first, second))
+
+    async def _run(self):
+        while self._seeks:
+            await asyncio.sleep(settings.MATCHMAKING_SWEEP_INTERVAL)
+            self.sweep()
+
+
+def _create_game(first, second):
+    if random.random() < 0.5:
+        first, second = second, first
+    base_time, increment = first.time_control
+    return Game.objects.create(
+        player_white_id=first.user_id,
+        player_black_id=second.user_id,
+        current_fen=chess.Board().fen(),
+        **clock_fields(base_time, increment)
+    )
+
+
+async def start_matched_game(first, second):
+    """
+    Create the game of two paired seeks, with random colours, and send both
+    players to it.
+    """
+    game = await sync_to_async(_create_game)(first, second)
+    channel_layer = get_channel_layer()
+    for seek in (first, second):
+        await channel_layer.group_send(
+            f"user_{seek.user_id}",
+            {
+                "type": "broadcast_game_start",
+                "game_id": game.id
+            }
+        )
+    events = await sync_to_async(load_game_changed_events)(game.id)
+    for user_id, event in events.items():
+        await channel_layer.group_send(f"user_{user_id}", event)
+
+
+seek_pool = SeekPool(start_matched_game)
+
+
+def holds_seek_pool():
+    return settings.GAME_WORKERS <= 1 or settings.GAME_WORKER_INDEX == SEEK_POOL_WORKER
+
+
+async def submit_seek(channel_layer, seek):
+    """
+    Queue `seek` in the pool of the worker holding it.
+    """
+    if holds_seek_pool():
+        seek_pool.add(seek)
+    else:
+        await channel_layer.send(worker_channel(SEEK_POOL_WORKER), seek.as_message())
+
+
+async def withdraw_seek(channel_layer, user_id, channel_name=None):
+    """
+    Drop the seek of `user_id` from the pool, see SeekPool.remove().
+    """
+    if holds_seek_pool():
+        seek_pool.remove(user_id, channel_name)
+    else:
+        await channel_layer.send(worker_channel(SEEK_POOL_WORKER), {
+            "type": "seek.remove",
+            "user_id": user_id,
+            "channel_name": channel_name,
+        })
+
+
+def handle_seek_message(message):
+    """
+    Apply a seek.add or seek.remove message sent by another worker.
+    """
+    if message["type"] == "seek.add":
+        seek_pool.add(Seek.from_message(message))
+    else:
+        seek_pool.remove(message["user_id"], message["channel_name"])
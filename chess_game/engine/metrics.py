@@ -0,0 +1,301 @@
+"""
+Per-action instrumentation of the consumers and the engine views.
+
+Every measured action records its latency in a histogram, the database
+queries it ran and their time, and the channel layer messages it sent and
+their size. The lag of the event loop is sampled alongside, so a slow
+action can be told apart from a loop that was busy with something else.
+Work done outside any action (timers, the move writer, the bot) is counted
+under the "background" kind.
+
+The figures are per process and served in the Prometheus text format by
+the metrics view. With METRICS_ENABLED off, measure() returns a shared
+no-op context manager and no hooks are installed.
+"""
+import asyncio
+import contextvars
+import json
+import time
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.utils.module_loading import import_string
+
+# Measurement of the action running in the current context, seen by the
+# database hook in sync_to_async threads too
+_current = contextvars.ContextVar("metrics_measurement", default=None)
+_disabled = nullcontext()
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # The last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Measurement:
+    """
+    Costs of a single call of an action, collected while it runs.
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.layer_sends = 0
+        self.layer_bytes = 0
+        self.closed = False
+
+
+class ActionMetrics(Measurement):
+    """
+    Totals of every call of an action.
+    """
+
+    def __init__(self, buckets):
+        super().__init__()
+        self.duration = Histogram(buckets)
+        self.errors = 0
+
+    def add(self, elapsed, measurement, failed):
+        self.duration.observe(elapsed)
+        self.queries += measurement.queries
+        self.query_seconds += measurement.query_seconds
+        self.layer_sends += measurement.layer_sends
+        self.layer_bytes += measurement.layer_bytes
+        if failed:
+            self.errors += 1
+
+
+class Registry:
+    def __init__(self, buckets, max_actions):
+        self.buckets = tuple(buckets)
+        self.max_actions = max_actions
+        self.actions = {}  # (kind, action) -> ActionMetrics
+        self._kind_sizes = {}
+        self.loop_lag = Histogram(self.buckets)
+        self.background = self.action("background", "unattributed")
+
+    def action(self, kind, action):
+        """
+        Return the totals of an action. Actions come from clients, so names
+        that are not identifiers, and any beyond `max_actions` per kind,
+        are grouped.
+        """
+        if not isinstance(action, str) or not action.isidentifier():
+            action = "unknown"
+        key = (kind, action)
+        metrics = self.actions.get(key)
+        if metrics is None:
+            if self._kind_sizes.get(kind, 0) >= self.max_actions:
+                key = (kind, "other")
+                metrics = self.actions.get(key)
+            if metrics is None:
+                metrics = self.actions[key] = ActionMetrics(self.buckets)
+                self._kind_sizes[kind] = self._kind_sizes.get(kind, 0) + 1
+        return metrics
+
+
+registry = Registry(settings.METRICS_LATENCY_BUCKETS, settings.METRICS_MAX_ACTIONS)
+
+
+def measure(kind, action):
+    """
+    Context manager measuring one call of an action.
+    """
+    if not settings.METRICS_ENABLED:
+        return _disabled
+    return _measure(kind, action)
+
+
+@contextmanager
+def _measure(kind, action):
+    _start_loop_probe()
+    measurement = Measurement()
+    token = _current.set(measurement)
+    started = time.perf_counter()
+    failed = False
+    try:
+        yield measurement
+    except Exception:
+        failed = True
+        raise
+    finally:
+        measurement.closed = True
+        _current.reset(token)
+        registry.action(kind, action).add(time.perf_counter() - started, measurement, failed)
+
+
+class MeasuredEventsMixin:
+    """
+    Consumer mixin measuring the handlers of channel layer events, such as
+    the fan-out of game updates, as actions of kind "<metrics_kind>_event".
+    """
+
+    metrics_kind = None
+
+    async def dispatch(self, message):
+        if not settings.METRICS_ENABLED or message["type"].startswith("websocket."):
+            return await super().dispatch(message)
+        with _measure(f"{self.metrics_kind}_event", message["type"]):
+            return await super().dispatch(message)
+
+
+class MetricsMiddleware:
+    """
+    Measures the views of engine.views, labelled by their URL name.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.METRICS_ENABLED:
+            return self.get_response(request)
+        measurement = Measurement()
+        token = _current.set(measurement)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            measurement.closed = True
+            _current.reset(token)
+        match = request.resolver_match
+        if match is not None and match.func.__module__ == "engine.views":
+            registry.action("view", match.url_name).add(
+                time.perf_counter() - started, measurement, response.status_code >= 500
+            )
+        return response
+
+
+def _target():
+    """
+    Measurement to charge: the running action's, or the background totals.
+    Tasks started by an action inherit its context and may outlive it.
+    """
+    measurement = _current.get()
+    if measurement is None or measurement.closed:
+        return registry.background
+    return measurement
+
+
+def _count_query(execute, sql, params, many, context):
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        measurement = _target()
+        measurement.queries += 1
+        measurement.query_seconds += time.perf_counter() - started
+
+
+def _install_query_hook(sender=None, connection=None, **kwargs):
+    if _count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_count_query)
+
+
+def _count_layer_sends(layer_class):
+    for name in ("send", "group_send"):
+        original = getattr(layer_class, name)
+        if getattr(original, "measured", False):
+            continue
+
+        async def counted(self, target, message, _original=original):
+            measurement = _target()
+            measurement.layer_sends += 1
+            measurement.layer_bytes += len(json.dumps(message, default=str))
+            return await _original(self, target, message)
+
+        counted.measured = True
+        setattr(layer_class, name, counted)
+
+
+def install():
+    """
+    Hook the database connections and the channel layer backends. Called
+    once at startup when METRICS_ENABLED is on.
+    """
+    connection_created.connect(_install_query_hook)
+    for connection in connections.all():
+        _install_query_hook(connection=connection)
+    for config in settings.CHANNEL_LAYERS.values():
+        _count_layer_sends(import_string(config["BACKEND"]))
+
+
+_probed_loop = None
+
+
+def _start_loop_probe():
+    """
+    Start sampling the lag of the running event loop, once per loop.
+    """
+    global _probed_loop
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    if loop is not _probed_loop:
+        _probed_loop = loop
+        loop.create_task(_probe_loop(settings.METRICS_LOOP_PROBE_INTERVAL))
+
+
+async def _probe_loop(interval):
+    # A sleep that wakes up late means something held the loop meanwhile
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        registry.loop_lag.observe(max(0.0, time.perf_counter() - started - interval))
+
+
+def _histogram_lines(name, labels, histogram):
+    suffix = f"{{{labels}}}" if labels else ""
+    lines = []
+    cumulative = 0
+    for bound, count in zip(histogram.buckets + (None,), histogram.counts):
+        cumulative += count
+        le = "+Inf" if bound is None else repr(float(bound))
+        lines.append(f'{name}_bucket{{{labels + "," if labels else ""}le="{le}"}} {cumulative}')
+    lines.append(f"{name}_sum{suffix} {histogram.sum}")
+    lines.append(f"{name}_count{suffix} {histogram.count}")
+    return lines
+
+
+COUNTERS = (
+    ("chess_action_errors_total", "Actions that raised or answered with a server error.", "errors"),
+    ("chess_action_db_queries_total", "Database queries run by actions.", "queries"),
+    ("chess_action_db_seconds_total", "Seconds actions spent in database queries.", "query_seconds"),
+    ("chess_action_layer_sends_total", "Channel layer send and group_send calls of actions.", "layer_sends"),
+    ("chess_action_layer_bytes_total", "JSON size of the channel layer messages actions sent.", "layer_bytes"),
+)
+
+
+def render_metrics():
+    """
+    The metrics of this process in the Prometheus text exposition format.
+    """
+    actions = sorted(registry.actions.items())
+    lines = [
+        "# HELP chess_action_duration_seconds Latency of consumer actions, channel layer events and engine views.",
+        "# TYPE chess_action_duration_seconds histogram",
+    ]
+    for (kind, action), metrics in actions:
+        lines += _histogram_lines("chess_action_duration_seconds", f'kind="{kind}",action="{action}"', metrics.duration)
+    for name, help_text, attribute in COUNTERS:
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+        for (kind, action), metrics in actions:
+            lines.append(f'{name}{{kind="{kind}",action="{action}"}} {getattr(metrics, attribute)}')
+    lines += [
+        "# HELP chess_event_loop_lag_seconds Delay of the event loop in waking up a sleeping task.",
+        "# TYPE chess_event_loop_lag_seconds histogram",
+    ]
+    lines += _histogram_lines("chess_event_loop_lag_seconds", "", registry.loop_lag)
+    return "\n".join(lines) + "\n"
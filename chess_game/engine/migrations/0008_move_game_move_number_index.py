@@ -0,0 +1,17 @@
+# Generated by Django 4.2.16 on 2026-10-18 18:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('engine', '0007_remove_game_is_logged_in'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='move',
+            index=models.Index(fields=['game', 'move_number'], name='engine_move_game_id_12e71c_idx'),
+        ),
+    ]
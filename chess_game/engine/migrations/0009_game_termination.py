@@ -0,0 +1,18 @@
+# Generated by Django 4.2.16 on 2026-10-18 18:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('engine', '0008_move_game_move_number_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='termination',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+    ]
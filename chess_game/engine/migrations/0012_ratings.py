@@ -0,0 +1,31 @@
+# Generated by Django 4.2.16 on 2026-10-18 19:03
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('engine', '0011_game_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Rating',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='rating', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('rating', models.FloatField(default=1500.0)),
+                ('deviation', models.FloatField(default=350.0)),
+                ('volatility', models.FloatField(default=0.06)),
+                ('games', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='game',
+            name='rated',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.16 on 2026-10-18 19:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('engine', '0012_ratings'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PositionStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('zobrist_hash', models.BigIntegerField()),
+                ('uci_move', models.CharField(max_length=10)),
+                ('games', models.PositiveIntegerField(default=0)),
+                ('white_wins', models.PositiveIntegerField(default=0)),
+                ('black_wins', models.PositiveIntegerField(default=0)),
+                ('draws', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='game',
+            name='indexed',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddConstraint(
+            model_name='positionstat',
+            constraint=models.UniqueConstraint(fields=('zobrist_hash', 'uci_move'), name='unique_position_move'),
+        ),
+    ]
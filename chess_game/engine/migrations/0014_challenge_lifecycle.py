@@ -0,0 +1,44 @@
+# Generated by Django 4.2.16 on 2026-10-18 19:55
+
+from django.db import migrations, models
+
+
+def drop_duplicate_pending(apps, schema_editor):
+    # Keep the latest pending challenge of every pair, so the constraint holds
+    Challenge = apps.get_model('engine', 'Challenge')
+    duplicated = (
+        Challenge.objects.filter(accepted__isnull=True)
+        .values('challenger', 'challenged')
+        .annotate(latest=models.Max('id'), count=models.Count('id'))
+        .filter(count__gt=1)
+    )
+    for pair in duplicated:
+        Challenge.objects.filter(
+            challenger=pair['challenger'],
+            challenged=pair['challenged'],
+            accepted__isnull=True,
+            id__lt=pair['latest'],
+        ).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('engine', '0013_position_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='challenge',
+            index=models.Index(fields=['challenged', 'accepted', 'created_at'], name='engine_chal_challen_e3f777_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='challenge',
+            index=models.Index(fields=['accepted', 'created_at'], name='engine_chal_accepte_eae016_idx'),
+        ),
+        migrations.RunPython(drop_duplicate_pending, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='challenge',
+            constraint=models.UniqueConstraint(condition=models.Q(('accepted__isnull', True)), fields=('challenger', 'challenged'), name='unique_pending_challenge'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.16 on 2026-10-18 20:01
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('engine', '0014_challenge_lifecycle'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GameArchive',
+            fields=[
+                ('game', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='archive', serialize=False, to='engine.game')),
+                ('moves', models.BinaryField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='game',
+            index=models.Index(condition=models.Q(('game_over', False)), fields=['player_white'], name='live_game_white_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='game',
+            index=models.Index(condition=models.Q(('game_over', False)), fields=['player_black'], name='live_game_black_idx'),
+        ),
+    ]
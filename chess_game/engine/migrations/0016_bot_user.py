@@ -0,0 +1,27 @@
+# Generated by Django 4.2.16 on 2026-10-18 20:52
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.db import migrations
+
+
+def create_bot_user(apps, schema_editor):
+    # The bot's own account, which nobody can log in to; a player who already
+    # registered the name keeps their account and the bot refuses to use it
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+    User.objects.get_or_create(
+        username=settings.BOT_USERNAME,
+        defaults={'password': make_password(None)},
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('engine', '0015_game_archive'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_bot_user, migrations.RunPython.noop),
+    ]
@@ -9,7 +9,26 @@ class Game(models.Model):
     game_over = models.BooleanField(default=False)  # Track if the game is finished
     winner = models.ForeignKey(User, related_name='games_won', null=True, blank=True, on_delete=models.SET_NULL)
     resignation = models.BooleanField(default=False)
+    termination = models.CharField(max_length=32, blank=True, default='')  # How the game ended, e.g. "checkmate"
     journal_entry = models.TextField(null=True, blank=True)  # Allow null and blank for optional entries
+    # Time control in seconds; games without base_time are untimed
+    base_time = models.PositiveIntegerField(null=True, blank=True)
+    increment = models.PositiveIntegerField(default=0)
+    # Remaining time of each side when the clock of the side to move started at clock_updated_at
+    white_time_ms = models.IntegerField(null=True, blank=True)
+    black_time_ms = models.IntegerField(null=True, blank=True)
+    clock_updated_at = models.DateTimeField(null=True, blank=True)
+    # Bumped by every commit of the move pipeline, which only writes if it is unchanged
+    version = models.PositiveIntegerField(default=0)
+    rated = models.BooleanField(default=False)  # Set once the result has been applied to the ratings
+    indexed = models.BooleanField(default=False)  # Set once the positions were added to PositionStat
+
+    class Meta:
+        indexes = [
+            # Ongoing game lookups only go through the live games
+            models.Index(fields=['player_white'], condition=models.Q(game_over=False), name='live_game_white_idx'),
+            models.Index(fields=['player_black'], condition=models.Q(game_over=False), name='live_game_black_idx'),
+        ]
 
     # Add a method for move count
     @property
@@ -21,6 +40,10 @@ class Game(models.Model):
             return int(fen_parts[5])  # Full-move number from FEN
         return 0
 
+    @property
+    def termination_label(self):
+        return self.termination.replace('_', ' ')
+
     def __str__(self):
         return f"Game {self.id} - {self.player_white.username} vs {self.player_black.username}"
 
@@ -28,17 +51,86 @@ class Game(models.Model):
 class Move(models.Model):
     game = models.ForeignKey(Game, related_name='moves', on_delete=models.CASCADE)
     uci_move = models.CharField(max_length=10)  # Store the move in UCI format
-    move_number = models.IntegerField()
+    move_number = models.IntegerField()  # Ply of the move, starting at 1
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['game', 'move_number']),
+        ]
 
     def __str__(self):
         return f"Move {self.move_number}: {self.uci_move}"
 
 
+class GameArchive(models.Model):
+    """
+    Moves of a finished game packed by engine.archive, replacing its Move rows.
+    """
+    game = models.OneToOneField(Game, primary_key=True, related_name='archive', on_delete=models.CASCADE)
+    moves = models.BinaryField()
+
+    def __str__(self):
+        return f"Archive of game {self.game_id}"
+
+
 class Challenge(models.Model):
     challenger = models.ForeignKey(User, related_name='challenges_made', on_delete=models.CASCADE)
     challenged = models.ForeignKey(User, related_name='challenges_received', on_delete=models.CASCADE)
     accepted = models.BooleanField(null=True)  # `None` means pending, `True` means accepted, `False` means rejected
     created_at = models.DateTimeField(auto_now_add=True)
+    # Time control of the game to play, in seconds
+    base_time = models.PositiveIntegerField(null=True, blank=True)
+    increment = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['challenged', 'accepted', 'created_at']),  # Pending challenges of a player
+            models.Index(fields=['accepted', 'created_at']),  # Sweeps, see engine.challenges
+        ]
+        constraints = [
+            # A player has at most one pending challenge to another
+            models.UniqueConstraint(
+                fields=['challenger', 'challenged'],
+                condition=models.Q(accepted__isnull=True),
+                name='unique_pending_challenge',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.challenger.username} challenged {self.challenged.username}"
+
+
+class Rating(models.Model):
+    """
+    Glicko-2 rating of a player, see engine.ratings.
+    """
+    user = models.OneToOneField(User, primary_key=True, related_name='rating', on_delete=models.CASCADE)
+    rating = models.FloatField(default=1500.0)
+    deviation = models.FloatField(default=350.0)
+    volatility = models.FloatField(default=0.06)
+    games = models.PositiveIntegerField(default=0)  # Rated games played
+
+    def __str__(self):
+        return f"{self.user.username}: {self.rating:.0f}"
+
+
+class PositionStat(models.Model):
+    """
+    How often a move was played from a position in finished games, and how
+    those games ended. Positions are identified by Zobrist hash, see
+    engine.positions.
+    """
+    zobrist_hash = models.BigIntegerField()
+    uci_move = models.CharField(max_length=10)
+    games = models.PositiveIntegerField(default=0)
+    white_wins = models.PositiveIntegerField(default=0)
+    black_wins = models.PositiveIntegerField(default=0)
+    draws = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['zobrist_hash', 'uci_move'], name='unique_position_move'),
+        ]
 
     def __str__(self):
-        return f"{self.challenger.username} challenged {self.challenged.username}"
\ No newline at end of file
+        return f"{self.zobrist_hash:016x} {self.uci_move}: {self.games}"
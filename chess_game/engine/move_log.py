@@ -0,0 +1,111 @@
+import asyncio
+import logging
+
+import chess
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, transaction
+
+from .archive import archived_moves
+from .models import Game, Move
+
+logger = logging.getLogger(__name__)
+
+
+class MoveWriter:
+    """
+    Buffers played moves and stores them with one bulk_create per interval,
+    across all games of the process, so the move hot path never waits on it.
+    """
+
+    def __init__(self, flush_interval, batch_size):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._pending = []
+        self._in_flight = []
+        self._task = None
+        self._wakeup = None
+
+    def record(self, game_id, move_number, uci_move):
+        self._pending.append(Move(game_id=game_id, move_number=move_number, uci_move=uci_move))
+        self._ensure_running()
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+
+    def _ensure_running(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def pending_moves(self, game_id):
+        """
+        Return {move_number: uci_move} of moves not yet known to be stored.
+        """
+        return {
+            move.move_number: move.uci_move
+            for move in self._in_flight + self._pending
+            if move.game_id == game_id
+        }
+
+    async def _run(self):
+        while self._pending:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        if not self._pending:
+            return
+        self._in_flight, self._pending = self._pending, []
+        try:
+            await sync_to_async(self._write)(self._in_flight)
+        except Exception:
+            logger.exception("Failed to store %d moves, retrying", len(self._in_flight))
+            # Back in front of the queue, in order, for the next flush
+            self._pending = self._in_flight + self._pending
+            self._ensure_running()
+        finally:
+            self._in_flight = []
+
+    def _write(self, moves):
+        try:
+            with transaction.atomic():
+                Move.objects.bulk_create(moves)
+        except IntegrityError:
+            # Games deleted while their moves were buffered; drop those moves
+            game_ids = set(
+                Game.objects.filter(id__in={move.game_id for move in moves}).values_list("id", flat=True)
+            )
+            Move.objects.bulk_create([move for move in moves if move.game_id in game_ids])
+
+
+def load_moves(game_id):
+    """
+    Return the UCI moves of a game in the order they were played.
+    """
+    moves = list(
+        Move.objects.filter(game_id=game_id).order_by("move_number").values_list("uci_move", flat=True)
+    )
+    if not moves:
+        moves = archived_moves(game_id) or []
+    return moves
+
+
+def replay(game_id, ply=None, moves=None):
+    """
+    Rebuild the board of a game after `ply` half-moves, or after the last
+    stored move if `ply` is None. Moves are trusted, they were validated
+    when played.
+    """
+    if moves is None:
+        moves = load_moves(game_id)
+    board = chess.Board()
+    for uci_move in moves[:ply]:
+        board.push(chess.Move.from_uci(uci_move))
+    return board
+
+
+move_writer = MoveWriter(settings.MOVE_FLUSH_INTERVAL, settings.MOVE_FLUSH_BATCH_SIZE)
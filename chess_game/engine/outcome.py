@@ -0,0 +1,61 @@
+from collections import namedtuple
+
+import chess
+
+# `winner` is chess.WHITE, chess.BLACK or None for a draw
+GameResult = namedtuple("GameResult", ["winner", "termination"])
+
+
+def evaluate_outcome(board):
+    """
+    Return the GameResult of the position on `board`, or None while the game
+    goes on. Threefold repetition and the fifty-move rule end the game
+    without waiting for a claim.
+    """
+    outcome = board.outcome()
+    if outcome is not None:
+        return GameResult(outcome.winner, outcome.termination.name.lower())
+    if board.is_repetition(3):
+        return GameResult(None, "threefold_repetition")
+    if board.is_fifty_moves():
+        return GameResult(None, "fifty_moves")
+    return None
+
+
+def time_forfeit(board):
+    """
+    Return the GameResult when the side to move on `board` runs out of time.
+    The game is drawn if the opponent cannot possibly checkmate.
+    """
+    opponent = not board.turn
+    if board.has_insufficient_material(opponent):
+        return GameResult(None, "timeout_vs_insufficient_material")
+    return GameResult(opponent, "timeout")
+
+
+def result_string(result):
+    if result.winner is None:
+        return "1/2-1/2"
+    return "1-0" if result.winner == chess.WHITE else "0-1"
+
+
+def game_over_event(state, result):
+    """
+    Build the "game_over" channel event for a finished game.
+    """
+    return {
+        "type": "game_over",
+        "game_id": state.game_id,
+        "winner": None if result.winner is None else state.player_name(result.winner),
+        "result": result_string(result),
+        "termination": result.termination,
+    }
+
+
+async def broadcast_game_over(channel_layer, state, event):
+    """
+    Send one game_over event to the game group and to both players' lobbies.
+    """
+    await channel_layer.group_send(f"game_{state.game_id}", event)
+    for user_id in (state.white_id, state.black_id):
+        await channel_layer.group_send(f"user_{user_id}", event)
@@ -0,0 +1,219 @@
+import chess
+import chess.pgn
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from .archive import load_game_moves
+from .history import invalidate_history
+from .models import Game, Move
+from .outcome import evaluate_outcome, result_string
+
+
+def game_result(game):
+    if not game.game_over:
+        return "*"
+    if game.winner_id is None:
+        return "1/2-1/2"
+    return "1-0" if game.winner_id == game.player_white_id else "0-1"
+
+
+def game_board(game, moves):
+    """
+    Replay the UCI moves of a game from the standard position. Legacy games
+    whose Move rows are missing or incomplete do not reach the stored
+    position; they get a board of that position alone, which the PGN then
+    starts from with SetUp and FEN headers.
+    """
+    board = chess.Board()
+    try:
+        for uci_move in moves:
+            board.push_uci(uci_move)
+    except ValueError:
+        return chess.Board(game.current_fen)
+    if board.fen() != game.current_fen:
+        return chess.Board(game.current_fen)
+    return board
+
+
+def game_pgn(game, moves):
+    """
+    Render a game (with players selected) and its UCI moves as PGN text.
+    """
+    pgn = chess.pgn.Game.from_board(game_board(game, moves))
+    pgn.headers["Event"] = "Casual game"
+    pgn.headers["Site"] = f"Game {game.id}"
+    # Imported players get their PGN name back
+    pgn.headers["White"] = game.player_white.username.removeprefix(settings.PGN_PLAYER_PREFIX)
+    pgn.headers["Black"] = game.player_black.username.removeprefix(settings.PGN_PLAYER_PREFIX)
+    pgn.headers["Result"] = game_result(game)
+    if game.base_time:
+        pgn.headers["TimeControl"] = f"{game.base_time}+{game.increment}"
+    if game.termination:
+        pgn.headers["Termination"] = game.termination_label
+    return pgn.accept(chess.pgn.StringExporter(headers=True, variations=False, comments=False)) + "\n\n"
+
+
+def _pgn_chunk(games, after_id, size):
+    """
+    Render the next `size` games after `after_id`. Returns (last id, PGN
+    text), or None when there are no more games.
+    """
+    chunk = list(games.filter(id__gt=after_id).select_related("player_white", "player_black").order_by("id")[:size])
+    if not chunk:
+        return None
+    moves = load_game_moves([game.id for game in chunk])
+    return chunk[-1].id, "".join(game_pgn(game, moves[game.id]) for game in chunk)
+
+
+async def stream_pgn(games):
+    """
+    Yield the PGN of the games of a queryset, one chunk of games at a time,
+    so an export never holds more than PGN_EXPORT_CHUNK_SIZE games in memory.
+    """
+    after_id = 0
+    while True:
+        chunk = await sync_to_async(_pgn_chunk)(games, after_id, settings.PGN_EXPORT_CHUNK_SIZE)
+        if chunk is None:
+            return
+        after_id, text = chunk
+        yield text
+
+
+class MainlineCollector(chess.pgn.BaseVisitor):
+    """
+    Collects the headers, final position and UCI mainline of a PGN game
+    without building the game tree, skipping variations.
+    """
+
+    def begin_game(self):
+        self.headers = chess.pgn.Headers()
+        self.board = None
+        self.moves = []
+        self.errors = False
+
+    def visit_header(self, tagname, tagvalue):
+        self.headers[tagname] = tagvalue
+
+    def begin_variation(self):
+        return chess.pgn.SKIP
+
+    def visit_board(self, board):
+        self.board = board
+
+    def visit_move(self, board, move):
+        self.moves.append(move.uci())
+
+    def handle_error(self, error):
+        self.errors = True
+
+    def result(self):
+        board = self.board.copy() if self.board is not None else chess.Board()
+        return self.headers, board, self.moves, self.errors
+
+
+class PgnImporter:
+    """
+    Bulk-loads PGN games into Game and Move, a batch of games per transaction.
+
+    Players are never matched to the accounts of the site, so a PGN cannot
+    put games on someone's record: every name gets a placeholder user,
+    PGN_PLAYER_PREFIX followed by the name, with an unusable password.
+    Registration does not allow the prefix's ":", so no one can sign up as
+    a placeholder. Unfinished games ("*") are skipped. Imported games are neither rated nor
+    indexed; run recompute_ratings and build_position_index afterwards.
+    """
+
+    def __init__(self, batch_size):
+        self.batch_size = batch_size
+        self.user_ids = {}
+        self.imported = 0
+        self.skipped = 0
+
+    def user_id(self, name):
+        user_id = self.user_ids.get(name)
+        if user_id is None:
+            username = (settings.PGN_PLAYER_PREFIX + name)[:User._meta.get_field("username").max_length]
+            user, _ = User.objects.get_or_create(username=username, defaults={"password": make_password(None)})
+            user_id = self.user_ids[name] = user.id
+        return user_id
+
+    def read(self, handle):
+        """
+        Yield (Game, UCI moves) for every finished game of a PGN file that
+        starts from the standard position.
+        """
+        while True:
+            parsed = chess.pgn.read_game(handle, Visitor=MainlineCollector)
+            if parsed is None:
+                return
+            headers, board, moves, errors = parsed
+            result = headers.get("Result", "*")
+            if result not in ("1-0", "0-1", "1/2-1/2") or errors or "FEN" in headers:
+                self.skipped += 1
+                continue
+            yield self.build_game(headers, board, result), moves
+
+    def build_game(self, headers, board, result):
+        white_id = self.user_id(headers.get("White") or "?")
+        black_id = self.user_id(headers.get("Black") or "?")
+        winner = {"1-0": chess.WHITE, "0-1": chess.BLACK}.get(result)
+        outcome = evaluate_outcome(board)
+        if outcome is not None and result_string(outcome) == result:
+            termination = outcome.termination
+        elif "time" in headers.get("Termination", "").lower():
+            termination = "timeout"
+        elif winner is not None:
+            termination = "resignation"
+        else:
+            termination = "agreement"
+        game = Game(
+            player_white_id=white_id,
+            player_black_id=black_id,
+            current_fen=board.fen(),
+            game_over=True,
+            termination=termination,
+            resignation=termination == "resignation",
+            winner_id=None if winner is None else (white_id if winner == chess.WHITE else black_id),
+        )
+        base_time, _, increment = headers.get("TimeControl", "").partition("+")
+        if base_time.isdigit():
+            game.base_time = int(base_time)
+            game.increment = int(increment) if increment.isdigit() else 0
+        return game
+
+    def save(self, batch):
+        with transaction.atomic():
+            games = Game.objects.bulk_create([game for game, _ in batch])
+            Move.objects.bulk_create(
+                (
+                    Move(game_id=game.id, move_number=number, uci_move=uci_move)
+                    for game, (_, moves) in zip(games, batch)
+                    for number, uci_move in enumerate(moves, start=1)
+                ),
+                batch_size=5000,
+            )
+        self.imported += len(batch)
+
+    def run(self, handle, progress=None):
+        """
+        Import every game of an open PGN file; `progress(imported, skipped)`
+        is called after each batch.
+        """
+        batch = []
+        for game, moves in self.read(handle):
+            batch.append((game, moves))
+            if len(batch) >= self.batch_size:
+                self.save(batch)
+                batch = []
+                if progress is not None:
+                    progress(self.imported, self.skipped)
+        if batch:
+            self.save(batch)
+        if progress is not None:
+            progress(self.imported, self.skipped)
+        # bulk_create bypasses post_save, so drop the players' history pages here
+        invalidate_history(*self.user_ids.values())
+        return self.imported
@@ -0,0 +1,148 @@
+"""
+Opening explorer: how often each move was played from a position and how
+those games ended, across all finished games.
+
+Positions are keyed by their 64-bit Zobrist (Polyglot) hash, stored signed
+to fit a BigIntegerField, so a lookup is a single index range scan.
+"""
+from collections import defaultdict
+
+import chess
+import chess.polyglot
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from .archive import archived_moves, load_game_moves
+from .models import Game, Move, PositionStat
+from .move_log import move_writer
+
+# Counter columns of PositionStat by the result of the game
+RESULT_FIELDS = {"1-0": "white_wins", "0-1": "black_wins", "1/2-1/2": "draws"}
+
+
+def position_key(board):
+    value = chess.polyglot.zobrist_hash(board)
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def game_result(white_id, winner_id):
+    if winner_id is None:
+        return "1/2-1/2"
+    return "1-0" if winner_id == white_id else "0-1"
+
+
+def position_moves(moves, max_ply):
+    """
+    Yield (position key, uci move) for the first `max_ply` moves of a game
+    played from the starting position.
+    """
+    board = chess.Board()
+    for uci_move in moves[:max_ply]:
+        yield position_key(board), uci_move
+        board.push(chess.Move.from_uci(uci_move))
+
+
+def stored_moves(game_id):
+    """
+    UCI moves of a game, including those the move writer has not flushed yet.
+    Stops at the first gap in the move numbers.
+    """
+    numbered = dict(Move.objects.filter(game_id=game_id).values_list("move_number", "uci_move"))
+    if not numbered:
+        numbered = dict(enumerate(archived_moves(game_id) or [], start=1))
+    numbered.update(move_writer.pending_moves(game_id))
+    moves = []
+    while len(moves) + 1 in numbered:
+        moves.append(numbered[len(moves) + 1])
+    return moves
+
+
+def index_game(game_id, moves=None):
+    """
+    Add the positions of a finished game to the index, once. `moves` (UCI,
+    from the starting position) are loaded when not given. Returns False if
+    the game is unfinished or was already indexed.
+    """
+    if moves is None:
+        moves = stored_moves(game_id)
+    with transaction.atomic():
+        if not Game.objects.filter(id=game_id, game_over=True, indexed=False).update(indexed=True):
+            return False
+        white_id, winner_id = Game.objects.values_list("player_white_id", "winner_id").get(id=game_id)
+        result_field = RESULT_FIELDS[game_result(white_id, winner_id)]
+        keys = set(position_moves(moves, settings.POSITION_INDEX_MAX_PLY))
+        PositionStat.objects.bulk_create(
+            [PositionStat(zobrist_hash=key, uci_move=uci_move) for key, uci_move in keys],
+            ignore_conflicts=True,
+        )
+        for key, uci_move in keys:
+            PositionStat.objects.filter(zobrist_hash=key, uci_move=uci_move).update(
+                games=F("games") + 1, **{result_field: F(result_field) + 1}
+            )
+    return True
+
+
+def rebuild_index(chunk_size=1000):
+    """
+    Rebuild the whole index from the finished games, streaming them in
+    chunks and writing the counters in bulk. Returns the number of games.
+    """
+    max_ply = settings.POSITION_INDEX_MAX_PLY
+    counters = defaultdict(lambda: {"games": 0, "white_wins": 0, "black_wins": 0, "draws": 0})
+    count = 0
+    last_id = 0
+    while True:
+        games = list(
+            Game.objects.filter(game_over=True, id__gt=last_id)
+            .order_by("id")
+            .values_list("id", "player_white_id", "winner_id")[:chunk_size]
+        )
+        if not games:
+            break
+        last_id = games[-1][0]
+        moves = load_game_moves([game[0] for game in games], max_ply)
+        for game_id, white_id, winner_id in games:
+            result_field = RESULT_FIELDS[game_result(white_id, winner_id)]
+            for key in set(position_moves(moves[game_id], max_ply)):
+                counter = counters[key]
+                counter["games"] += 1
+                counter[result_field] += 1
+            count += 1
+
+    with transaction.atomic():
+        PositionStat.objects.all().delete()
+        PositionStat.objects.bulk_create(
+            (
+                PositionStat(zobrist_hash=key, uci_move=uci_move, **counter)
+                for (key, uci_move), counter in counters.items()
+            ),
+            batch_size=2000,
+        )
+        Game.objects.filter(game_over=True, id__lte=last_id).update(indexed=True)
+    return count
+
+
+def explore(fen):
+    """
+    Return the moves played from the position `fen`, most played first.
+    Raises ValueError for an invalid FEN.
+    """
+    board = chess.Board(fen)
+    stats = PositionStat.objects.filter(zobrist_hash=position_key(board)).order_by("-games").values_list(
+        "uci_move", "games", "white_wins", "draws", "black_wins"
+    )
+    moves = []
+    for uci_move, games, white_wins, draws, black_wins in stats:
+        move = chess.Move.from_uci(uci_move)
+        if not board.is_legal(move):
+            continue  # Hash collision with another position
+        moves.append({
+            "uci": uci_move,
+            "san": board.san(move),
+            "games": games,
+            "white": white_wins,
+            "draws": draws,
+            "black": black_wins,
+        })
+    return {"fen": board.fen(), "moves": moves}
@@ -0,0 +1,62 @@
+"""
+Compact binary protocol for the game websocket.
+
+Clients opt in by requesting the COMPACT_SUBPROTOCOL websocket subprotocol.
+Moves travel as 16-bit integers (from square, to square, promotion piece)
+and each update only carries the ply, the move and the clocks; the FEN is
+sent as a JSON "sync" message on connect and whenever the client asks.
+
+Client -> server frames:  MOVE (B opcode, H move), SYNC (B opcode), RESIGN (B opcode)
+Server -> client frames:  UPDATE (B opcode, H ply, H move, i white ms, i black ms)
+Clocks are -1 in untimed games. All integers are big-endian.
+"""
+import struct
+
+import chess
+
+COMPACT_SUBPROTOCOL = "chess.compact.v1"
+
+OP_MOVE = 1
+OP_SYNC = 2
+OP_RESIGN = 3
+
+OP_UPDATE = 1
+
+_MOVE_FRAME = struct.Struct(">BH")
+_UPDATE_FRAME = struct.Struct(">BHHii")
+
+
+def encode_move(move):
+    """
+    Pack a move as from | to << 6 | promotion << 12.
+    """
+    return move.from_square | move.to_square << 6 | (move.promotion or 0) << 12
+
+
+def decode_move(value):
+    return chess.Move(value & 0x3F, value >> 6 & 0x3F, value >> 12 or None)
+
+
+def unpack_client_frame(data):
+    """
+    Return (opcode, move) for a client frame; move is None except for OP_MOVE.
+    Raises ValueError on malformed frames.
+    """
+    if not data:
+        raise ValueError("Empty frame")
+    if data[0] == OP_MOVE:
+        try:
+            _, value = _MOVE_FRAME.unpack(data)
+        except struct.error as e:
+            raise ValueError(str(e))
+        if value >> 12 not in (0, chess.KNIGHT, chess.BISHOP, chess.ROOK, chess.QUEEN):
+            raise ValueError(f"Invalid promotion piece {value >> 12}")
+        return OP_MOVE, decode_move(value)
+    if data[0] in (OP_SYNC, OP_RESIGN) and len(data) == 1:
+        return data[0], None
+    raise ValueError(f"Unknown frame opcode {data[0]}")
+
+
+def pack_update(ply, move, clock):
+    white_ms, black_ms = (clock["white"], clock["black"]) if clock else (-1, -1)
+    return _UPDATE_FRAME.pack(OP_UPDATE, ply, move, white_ms, black_ms)
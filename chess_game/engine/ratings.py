@@ -0,0 +1,170 @@
+"""
+Glicko-2 ratings (http://www.glicko.net/glicko/glicko2.pdf).
+
+Every game is rated on its own as soon as it is finished, i.e. a rating
+period holds a single game. recompute_ratings() replays the whole history
+the same way in one pass.
+"""
+import math
+
+from django.conf import settings
+from django.db import transaction
+
+from .leaderboard import get_leaderboard
+from .models import Game, Rating
+
+# Glicko-2 works on a scale where 1500 / 350 become 0 / 2.01
+SCALE = 173.7178
+DEFAULT_RATING = 1500.0
+DEFAULT_DEVIATION = 350.0
+DEFAULT_VOLATILITY = 0.06
+# Convergence tolerance of the volatility iteration
+EPSILON = 0.000001
+
+
+def glicko2_update(rating, deviation, volatility, results, tau):
+    """
+    Return the new (rating, deviation, volatility) of a player after a rating
+    period with `results`, a list of (opponent rating, opponent deviation,
+    score) where score is 1, 0.5 or 0.
+    """
+    mu = (rating - DEFAULT_RATING) / SCALE
+    phi = deviation / SCALE
+    if not results:
+        return rating, math.sqrt(phi ** 2 + volatility ** 2) * SCALE, volatility
+
+    v_inverse = 0.0
+    improvement = 0.0
+    for opponent_rating, opponent_deviation, score in results:
+        opponent_mu = (opponent_rating - DEFAULT_RATING) / SCALE
+        g = 1 / math.sqrt(1 + 3 * (opponent_deviation / SCALE) ** 2 / math.pi ** 2)
+        expected = 1 / (1 + math.exp(-g * (mu - opponent_mu)))
+        v_inverse += g ** 2 * expected * (1 - expected)
+        improvement += g * (score - expected)
+    v = 1 / v_inverse
+    delta = v * improvement
+
+    # New volatility by the Illinois algorithm (step 5 of the paper)
+    a = math.log(volatility ** 2)
+
+    def f(x):
+        ex = math.exp(x)
+        return ex * (delta ** 2 - phi ** 2 - v - ex) / (2 * (phi ** 2 + v + ex) ** 2) - (x - a) / tau ** 2
+
+    A = a
+    if delta ** 2 > phi ** 2 + v:
+        B = math.log(delta ** 2 - phi ** 2 - v)
+    else:
+        k = 1
+        while f(a - k * tau) < 0:
+            k += 1
+        B = a - k * tau
+    f_A, f_B = f(A), f(B)
+    while abs(B - A) > EPSILON:
+        C = A + (A - B) * f_A / (f_B - f_A)
+        f_C = f(C)
+        if f_C * f_B <= 0:
+            A, f_A = B, f_B
+        else:
+            f_A /= 2
+        B, f_B = C, f_C
+    new_volatility = math.exp(A / 2)
+
+    phi_star = math.sqrt(phi ** 2 + new_volatility ** 2)
+    new_phi = 1 / math.sqrt(1 / phi_star ** 2 + 1 / v)
+    new_mu = mu + new_phi ** 2 * improvement
+    return DEFAULT_RATING + new_mu * SCALE, new_phi * SCALE, new_volatility
+
+
+def white_score(white_id, winner_id):
+    if winner_id is None:
+        return 0.5
+    return 1.0 if winner_id == white_id else 0.0
+
+
+def _rate_pair(white, black, score):
+    """
+    Update two Rating rows (in memory) with the result of one game.
+    """
+    tau = settings.GLICKO2_TAU
+    white_before = (white.rating, white.deviation)
+    black_before = (black.rating, black.deviation)
+    white.rating, white.deviation, white.volatility = glicko2_update(
+        white.rating, white.deviation, white.volatility, [(*black_before, score)], tau
+    )
+    black.rating, black.deviation, black.volatility = glicko2_update(
+        black.rating, black.deviation, black.volatility, [(*white_before, 1 - score)], tau
+    )
+    white.games += 1
+    black.games += 1
+
+
+def rate_game(game_id):
+    """
+    Rate a finished game once and move both players on the leaderboard.
+    Returns False if the game is unfinished or was already rated.
+    """
+    with transaction.atomic():
+        # Claiming the game first makes rating idempotent across processes
+        if not Game.objects.filter(id=game_id, game_over=True, rated=False).update(rated=True):
+            return False
+        game = Game.objects.values("player_white_id", "player_black_id", "winner_id").get(id=game_id)
+        white_id, black_id = game["player_white_id"], game["player_black_id"]
+        for user_id in (white_id, black_id):
+            Rating.objects.get_or_create(user_id=user_id)
+        ratings = {
+            rating.user_id: rating
+            for rating in Rating.objects.select_for_update().select_related("user").filter(
+                user_id__in=(white_id, black_id)
+            )
+        }
+        white, black = ratings[white_id], ratings[black_id]
+        _rate_pair(white, black, white_score(white_id, game["winner_id"]))
+        Rating.objects.bulk_update([white, black], ["rating", "deviation", "volatility", "games"])
+
+    leaderboard = get_leaderboard()
+    for rating in (white, black):
+        leaderboard.update(rating.user_id, rating.user.username, rating.rating)
+    return True
+
+
+def recompute_ratings():
+    """
+    Rebuild every rating from the finished games in the order they were
+    played, then rebuild the leaderboard. Returns the number of games rated.
+    """
+    ratings = {}
+
+    def rating_of(user_id):
+        rating = ratings.get(user_id)
+        if rating is None:
+            rating = ratings[user_id] = Rating(user_id=user_id)
+        return rating
+
+    games = Game.objects.filter(game_over=True).order_by("id").values_list(
+        "player_white_id", "player_black_id", "winner_id"
+    )
+    count = 0
+    with transaction.atomic():
+        for white_id, black_id, winner_id in games.iterator(chunk_size=2000):
+            _rate_pair(rating_of(white_id), rating_of(black_id), white_score(white_id, winner_id))
+            count += 1
+        Rating.objects.all().delete()
+        Rating.objects.bulk_create(ratings.values(), batch_size=1000)
+        Game.objects.filter(game_over=True, rated=False).update(rated=True)
+    rebuild_leaderboard()
+    return count
+
+
+def rebuild_leaderboard():
+    get_leaderboard().rebuild(
+        Rating.objects.filter(games__gt=0).values_list("user_id", "user__username", "rating").iterator()
+    )
+
+
+def player_rating(user_id):
+    """
+    Current rating of a player, DEFAULT_RATING if unrated.
+    """
+    rating = Rating.objects.filter(user_id=user_id).values_list("rating", flat=True).first()
+    return DEFAULT_RATING if rating is None else rating
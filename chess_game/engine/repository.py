@@ -0,0 +1,117 @@
+"""
+Data access of the consumers.
+
+Every function loads or changes what one handler needs in a single trip
+to the database thread and returns snapshots, never model instances with
+lazy relations, so consumers cannot trigger a query from the event loop.
+
+Django's async ORM methods still run in asgiref's thread-sensitive
+executor, which serialises all the queries of the process: single queries
+use them directly, and handlers that need several statements get one
+sync function wrapped once with sync_to_async, instead of one hop each.
+"""
+from collections import namedtuple
+
+from asgiref.sync import sync_to_async
+from django.db import models
+
+from . import bot, challenges, history, positions
+from .history import game_changed_events
+from .models import Game, Rating
+from .ratings import DEFAULT_RATING
+
+GameSnapshot = namedtuple(
+    "GameSnapshot", ["id", "white_id", "white_name", "black_id", "black_name", "journal_entry", "game_over"]
+)
+
+
+def game_snapshot(game):
+    """
+    Snapshot of a game loaded with select_related("player_white", "player_black").
+    """
+    return GameSnapshot(
+        game.id,
+        game.player_white_id,
+        game.player_white.username if game.player_white else None,
+        game.player_black_id,
+        game.player_black.username if game.player_black else None,
+        game.journal_entry,
+        game.game_over,
+    )
+
+
+async def get_game(game_id):
+    """
+    Raises Game.DoesNotExist.
+    """
+    game = await Game.objects.select_related("player_white", "player_black").aget(id=game_id)
+    return game_snapshot(game)
+
+
+async def game_position(game_id):
+    """
+    Return (white id, black id, current FEN). Raises Game.DoesNotExist.
+    """
+    return await Game.objects.values_list("player_white_id", "player_black_id", "current_fen").aget(id=game_id)
+
+
+async def player_rating(user_id):
+    """
+    Current rating of a player, DEFAULT_RATING if unrated.
+    """
+    rating = await Rating.objects.filter(user_id=user_id).values_list("rating", flat=True).afirst()
+    return DEFAULT_RATING if rating is None else rating
+
+
+async def ongoing_game_id(user_id):
+    return await Game.objects.filter(
+        models.Q(player_white_id=user_id) | models.Q(player_black_id=user_id),
+        game_over=False,
+    ).values_list("id", flat=True).afirst()
+
+
+@sync_to_async
+def update_journal(game_id, user_id, journal_entry):
+    """
+    Save the journal of a game of `user_id`. Returns the game_changed events
+    of its players, or None if `user_id` does not play it.
+    Raises Game.DoesNotExist.
+    """
+    game = Game.objects.select_related("player_white", "player_black").get(id=game_id)
+    if user_id not in (game.player_white_id, game.player_black_id):
+        return None
+    game.journal_entry = journal_entry
+    game.save(update_fields=["journal_entry"])
+    return game_changed_events(game)
+
+
+@sync_to_async
+def delete_game(game_id, user_id):
+    """
+    Delete a game of `user_id`. Returns the snapshot of the deleted game, or
+    None if `user_id` does not play it. Raises Game.DoesNotExist.
+    """
+    game = Game.objects.select_related("player_white", "player_black").get(id=game_id)
+    if user_id not in (game.player_white_id, game.player_black_id):
+        return None
+    snapshot = game_snapshot(game)
+    game.delete()
+    return snapshot
+
+
+@sync_to_async
+def create_bot_game(user, game_fields):
+    """
+    Create a game of `user` against the bot and return its id.
+    """
+    return bot.create_bot_game(user, game_fields).id
+
+
+# The challenge lifecycle lives in engine.challenges, shared with the views
+create_challenge = sync_to_async(challenges.create_challenge)
+pending_challenges = sync_to_async(challenges.pending_challenges)
+respond_to_challenge = sync_to_async(challenges.respond_to_challenge)
+
+# Also used by the views, which call them directly
+history_page = sync_to_async(history.history_page)
+explore = sync_to_async(positions.explore)
@@ -0,0 +1,222 @@
+"""
+Move search of the computer opponent: iterative-deepening alpha-beta
+(negamax) with a transposition table, quiescence search and simple move
+ordering, on python-chess move generation.
+
+This module runs in the bot's worker processes, so it must not import Django.
+"""
+import os
+import time
+
+import chess
+import chess.polyglot
+
+PIECE_VALUES = {
+    chess.PAWN: 100,
+    chess.KNIGHT: 320,
+    chess.BISHOP: 330,
+    chess.ROOK: 500,
+    chess.QUEEN: 900,
+    chess.KING: 0,
+}
+MATE_SCORE = 100000
+# Bonus for pieces on the four centre squares and on the rest of the c3-f6 square
+CENTRE = chess.SquareSet(chess.BB_CENTER)
+RING = chess.SquareSet(0x00003C3C3C3C0000) - CENTRE
+
+# Transposition table entry bounds
+EXACT, LOWER, UPPER = 0, 1, 2
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+def evaluate(board):
+    """
+    Static evaluation in centipawns from the side to move's point of view.
+    """
+    score = 0
+    for piece_type, value in PIECE_VALUES.items():
+        for color, sign in ((chess.WHITE, 1), (chess.BLACK, -1)):
+            pieces = board.pieces(piece_type, color)
+            score += sign * (value * len(pieces) + 10 * len(pieces & CENTRE) + 5 * len(pieces & RING))
+    return score if board.turn == chess.WHITE else -score
+
+
+class Searcher:
+    def __init__(self, deadline, table_size):
+        self.deadline = deadline
+        self.table = {}  # zobrist hash -> (depth, score, bound, best move)
+        self.table_size = table_size
+        self.nodes = 0
+        self.root_move = None
+
+    def _check_time(self):
+        self.nodes += 1
+        if self.nodes & 1023 == 0 and time.monotonic() > self.deadline:
+            raise SearchTimeout()
+
+    def _ordered_moves(self, board, first=None):
+        def priority(move):
+            if move == first:
+                return -10000
+            victim = board.piece_type_at(move.to_square)
+            if victim is not None:
+                # Most valuable victim, least valuable attacker
+                return -PIECE_VALUES[victim] + PIECE_VALUES[board.piece_type_at(move.from_square)] // 10
+            return 1000 if move.promotion is None else 0
+
+        return sorted(board.legal_moves, key=priority)
+
+    def quiesce(self, board, alpha, beta):
+        self._check_time()
+        stand_pat = evaluate(board)
+        if stand_pat >= beta:
+            return stand_pat
+        alpha = max(alpha, stand_pat)
+        for move in self._ordered_moves(board):
+            if not board.is_capture(move):
+                continue
+            board.push(move)
+            score = -self.quiesce(board, -beta, -alpha)
+            board.pop()
+            if score >= beta:
+                return score
+            alpha = max(alpha, score)
+        return alpha
+
+    def negamax(self, board, depth, alpha, beta, ply):
+        self._check_time()
+        if board.is_checkmate():
+            return -MATE_SCORE + ply
+        if board.is_stalemate() or board.is_insufficient_material() or (ply and board.is_repetition(2)):
+            return 0
+        if depth <= 0:
+            return self.quiesce(board, alpha, beta)
+
+        key = chess.polyglot.zobrist_hash(board)
+        entry = self.table.get(key)
+        best_move = None
+        if entry is not None:
+            entry_depth, entry_score, bound, best_move = entry
+            if entry_depth >= depth:
+                if bound == EXACT:
+                    return entry_score
+                if bound == LOWER and entry_score >= beta:
+                    return entry_score
+                if bound == UPPER and entry_score <= alpha:
+                    return entry_score
+
+        original_alpha = alpha
+        best_score = -MATE_SCORE - 1
+        for move in self._ordered_moves(board, best_move):
+            board.push(move)
+            score = -self.negamax(board, depth - 1, -beta, -alpha, ply + 1)
+            board.pop()
+            if score > best_score:
+                best_score, best_move = score, move
+            alpha = max(alpha, score)
+            if alpha >= beta:
+                break
+
+        if best_score <= original_alpha:
+            bound = UPPER
+        elif best_score >= beta:
+            bound = LOWER
+        else:
+            bound = EXACT
+        if len(self.table) < self.table_size or key in self.table:
+            self.table[key] = (depth, best_score, bound, best_move)
+        if ply == 0:
+            self.root_move = best_move
+        return best_score
+
+    def iterate(self, board, max_depth):
+        """
+        Deepen the search until `max_depth` or the deadline. Returns (depth,
+        score, best move) of the deepest completed iteration, depth 0 if none
+        completed.
+        """
+        completed = (0, None, None)
+        root_ply = len(board.move_stack)
+        for depth in range(1, max_depth + 1):
+            try:
+                score = self.negamax(board, depth, -MATE_SCORE - 1, MATE_SCORE + 1, 0)
+            except SearchTimeout:
+                # Unwind the moves of the interrupted iteration
+                while len(board.move_stack) > root_ply:
+                    board.pop()
+                break
+            completed = (depth, score, self.root_move)
+        return completed
+
+    def best_move(self, board, max_depth):
+        return self.iterate(board, max_depth)[2]
+
+    def principal_variation(self, board, first, length):
+        """
+        Follow the best moves stored in the transposition table from `first`.
+        """
+        board = board.copy(stack=False)
+        line = []
+        move = first
+        while move is not None and len(line) < length and board.is_legal(move):
+            line.append(move)
+            board.push(move)
+            entry = self.table.get(chess.polyglot.zobrist_hash(board))
+            move = entry[3] if entry else None
+        return line
+
+
+def lower_priority(niceness):
+    """
+    Initializer of the worker processes: searches yield the CPU to the
+    processes serving human games.
+    """
+    if niceness and hasattr(os, "nice"):
+        os.nice(niceness)
+
+
+def choose_move(fen, max_depth, time_limit, table_size):
+    """
+    Return the UCI move the bot plays in `fen`, or None if there is no legal move.
+    Entry point of the worker processes.
+    """
+    board = chess.Board(fen)
+    if board.is_game_over():
+        return None
+    searcher = Searcher(time.monotonic() + time_limit, table_size)
+    move = searcher.best_move(board, max_depth)
+    if move is None:
+        # Not even depth 1 finished in time
+        move = searcher._ordered_moves(board)[0]
+    return move.uci()
+
+
+def analyse(fen, max_depth, time_limit, table_size):
+    """
+    Evaluate `fen` for the analysis API. Returns a dict with the completed
+    depth, the score in centipawns from White's point of view (or "mate" in
+    moves, negative when Black mates) and the best line in UCI.
+    Entry point of the worker processes.
+    """
+    board = chess.Board(fen)
+    analysis = {"depth": 0, "score": None, "mate": None, "pv": []}
+    if board.is_game_over():
+        return analysis
+    searcher = Searcher(time.monotonic() + time_limit, table_size)
+    depth, score, move = searcher.iterate(board, max_depth)
+    if move is None:
+        return analysis
+    if board.turn == chess.BLACK:
+        score = -score
+    if abs(score) > MATE_SCORE - 1000:
+        plies = MATE_SCORE - abs(score)
+        analysis["mate"] = (plies + 1) // 2 * (1 if score > 0 else -1)
+    else:
+        analysis["score"] = score
+    analysis["depth"] = depth
+    analysis["pv"] = [move.uci() for move in searcher.principal_variation(board, move, depth)]
+    return analysis
+
@@ -0,0 +1,106 @@
+"""
+Sticky sharding of games across server processes.
+
+With GAME_WORKERS above 1, every game is owned by one worker, picked by a
+consistent hash of its id. Only the owner loads the game into game_states
+and runs its clock and its bot. A socket connected to any other worker
+forwards its actions to the owner over the channel layer, and gets the
+owner's replies back the same way; game events reach every worker through
+the game's group as before.
+
+Ownership only decides where a game is played. Commits stay
+compare-and-swap on Game.version, so a game played by two workers at once,
+e.g. while GAME_WORKERS changes, still never loses a move.
+"""
+import asyncio
+import logging
+from collections import deque
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+def jump_hash(key, buckets):
+    """
+    Jump consistent hash (Lamping and Veach): maps `key` to one of `buckets`,
+    moving only 1/n of the keys when a bucket is added.
+    """
+    bucket, jump = -1, 0
+    while jump < buckets:
+        bucket = jump
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        jump = int((bucket + 1) * (float(1 << 31) / ((key >> 33) + 1)))
+    return bucket
+
+
+def owner_of(game_id):
+    return jump_hash(int(game_id), settings.GAME_WORKERS)
+
+
+def owns_game(game_id):
+    """
+    Whether this process holds the authoritative state of the game.
+    """
+    return settings.GAME_WORKERS <= 1 or owner_of(game_id) == settings.GAME_WORKER_INDEX
+
+
+def worker_channel(index):
+    return f"game-worker.{index}"
+
+
+async def forward(channel_layer, game_id, message):
+    """
+    Send a message to the worker owning `game_id`.
+    """
+    await channel_layer.send(worker_channel(owner_of(game_id)), {"game_id": int(game_id), **message})
+
+
+class GameWorker:
+    """
+    Receives the messages forwarded to this worker and hands them to
+    `handle`, one at a time per game and in arrival order, so a game's
+    actions run in the order its sockets sent them. Messages without a
+    game, such as seeks, share one queue of their own.
+    """
+
+    def __init__(self, handle):
+        self.handle = handle
+        self._mailboxes = {}  # game id, or None, -> deque of messages
+        self._task = None
+
+    def start(self):
+        if settings.GAME_WORKERS > 1 and self._task is None:
+            channel = worker_channel(settings.GAME_WORKER_INDEX)
+            self._task = asyncio.get_running_loop().create_task(self._run(channel))
+
+    async def _run(self, channel):
+        channel_layer = get_channel_layer()
+        while True:
+            try:
+                message = await channel_layer.receive(channel)
+            except Exception:
+                logger.exception("Game worker could not receive from %s", channel)
+                await asyncio.sleep(1)
+                continue
+            game_id = message.get("game_id")
+            mailbox = self._mailboxes.get(game_id)
+            if mailbox is None:
+                mailbox = self._mailboxes[game_id] = deque([message])
+                asyncio.get_running_loop().create_task(self._drain(game_id, mailbox))
+            else:
+                mailbox.append(message)
+
+    async def _drain(self, game_id, mailbox):
+        # The message being handled stays queued, so new ones join this drain
+        try:
+            while mailbox:
+                try:
+                    await self.handle(mailbox[0])
+                except Exception:
+                    logger.exception("Forwarded %s of game %s failed", mailbox[0]["type"], game_id)
+                mailbox.popleft()
+        finally:
+            del self._mailboxes[game_id]
+
@@ -0,0 +1,10 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from engine.history import invalidate_history
+from engine.models import Game
+
+@receiver(post_save, sender=Game)
+@receiver(post_delete, sender=Game)
+def invalidate_game_history(sender, instance, **kwargs):
+    # Both players' cached history pages include this game
+    invalidate_history(instance.player_white_id, instance.player_black_id)
@@ -0,0 +1,148 @@
+import asyncio
+import logging
+from collections import deque
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Longest wait, in seconds, between attempts to resubscribe a failed relay
+RELAY_MAX_BACKOFF = 30
+
+
+class SpectatorMailbox:
+    """
+    Outgoing events of one spectator socket.
+
+    While the socket is still busy sending, a newer game_update replaces a
+    queued one instead of piling up behind it. Updates only carry the last
+    move, so the socket is resynced with the full position when updates
+    were skipped or the queue overflowed.
+    """
+
+    def __init__(self, consumer, max_queue):
+        self.consumer = consumer
+        self.max_queue = max_queue
+        self._queue = deque()  # (event, coalesced)
+        self._task = None
+
+    def put(self, event):
+        if event["type"] == "game_update" and self._queue and self._queue[-1][0]["type"] == "game_update":
+            self._queue[-1] = (event, True)
+        elif len(self._queue) >= self.max_queue:
+            # Too far behind, a full resync is cheaper than catching up
+            self.resync()
+            return
+        else:
+            self._queue.append((event, False))
+        self._ensure_draining()
+
+    def resync(self):
+        """
+        Replace the queued events with a resync, after events may have been lost.
+        """
+        self._queue.clear()
+        self._queue.append(({"type": "game_update"}, True))
+        self._ensure_draining()
+
+    def _ensure_draining(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._drain())
+
+    async def _drain(self):
+        while self._queue:
+            event, coalesced = self._queue.popleft()
+            if coalesced:
+                await self.consumer.send_sync()
+            else:
+                await self.consumer.dispatch(event)
+
+    def close(self):
+        if self._task is not None:
+            self._task.cancel()
+
+
+class SpectatorRelay:
+    """
+    Subscribes once per process to a game group and re-broadcasts its events
+    to the spectator sockets connected to this process, so a watched game
+    costs one channel-layer message per process rather than per viewer.
+    """
+
+    def __init__(self, channel_layer, game_id):
+        self.channel_layer = channel_layer
+        self.game_id = game_id
+        self.group_name = f"game_{game_id}"
+        self.channel_name = None
+        self._mailboxes = {}
+        self._task = None
+        # Held while subscribing or unsubscribing, which both await
+        self._lock = asyncio.Lock()
+
+    def __len__(self):
+        return len(self._mailboxes)
+
+    async def add(self, consumer):
+        self._mailboxes[consumer] = SpectatorMailbox(consumer, settings.SPECTATOR_MAX_QUEUE)
+        async with self._lock:
+            # The last spectator may have left while we waited
+            if self._task is None and self._mailboxes:
+                await self._subscribe()
+                self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def remove(self, consumer):
+        mailbox = self._mailboxes.pop(consumer, None)
+        if mailbox is not None:
+            mailbox.close()
+        async with self._lock:
+            # A spectator may have joined while we waited
+            if not self._mailboxes and self._task is not None:
+                self._task.cancel()
+                self._task = None
+                await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    async def _subscribe(self):
+        self.channel_name = await self.channel_layer.new_channel()
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+
+    async def _run(self):
+        backoff = 1
+        while True:
+            try:
+                event = await self.channel_layer.receive(self.channel_name)
+            except Exception:
+                logger.exception("Spectator relay of game %s could not receive, resubscribing", self.game_id)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, RELAY_MAX_BACKOFF)
+                try:
+                    await self.channel_layer.group_discard(self.group_name, self.channel_name)
+                    await self._subscribe()
+                except Exception:
+                    logger.exception("Spectator relay of game %s could not resubscribe", self.game_id)
+                    continue
+                # Events sent meanwhile are lost, so every spectator resyncs
+                for mailbox in list(self._mailboxes.values()):
+                    mailbox.resync()
+                continue
+            backoff = 1
+            for mailbox in list(self._mailboxes.values()):
+                mailbox.put(event)
+
+
+_relays = {}
+
+
+async def add_spectator(consumer, game_id):
+    relay = _relays.get(game_id)
+    if relay is None:
+        relay = _relays[game_id] = SpectatorRelay(consumer.channel_layer, game_id)
+    await relay.add(consumer)
+
+
+async def remove_spectator(consumer, game_id):
+    relay = _relays.get(game_id)
+    if relay is None:
+        return
+    await relay.remove(consumer)
+    if not relay:
+        del _relays[game_id]
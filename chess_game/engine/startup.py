@@ -0,0 +1,59 @@
+"""
+Work every server process starts as soon as its event loop runs, before
+it serves anything, so it does not wait for the first connection.
+
+Daphne runs its event loop through Twisted and sends no ASGI lifespan
+events, so the hook is registered with its reactor; servers that send
+lifespan events, e.g. uvicorn, run it on lifespan.startup. Anything else
+(runserver, tests) runs it on the first connection or request.
+"""
+import sys
+
+_startup_hooks = []
+
+
+def on_startup(hook):
+    """
+    Register a function called once in the event loop when the process
+    starts. Returns `hook`, so it can be used as a decorator.
+    """
+    _startup_hooks.append(hook)
+    return hook
+
+
+def with_startup(application):
+    """
+    Wrap the ASGI application so the startup hooks run once per process.
+    """
+    started = False
+
+    def start():
+        nonlocal started
+        if started:
+            return
+        started = True
+        for hook in _startup_hooks:
+            hook()
+
+    if "daphne.server" in sys.modules:
+        # Daphne installs its asyncio reactor before importing the application.
+        # Delayed calls run inside the asyncio loop, unlike callWhenRunning
+        from twisted.internet import reactor
+
+        reactor.callLater(0, start)
+
+    async def app(scope, receive, send):
+        if scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+                if message["type"] == "lifespan.startup":
+                    start()
+                    await send({"type": "lifespan.startup.complete"})
+                elif message["type"] == "lifespan.shutdown":
+                    await send({"type": "lifespan.shutdown.complete"})
+                    return
+        start()
+        return await application(scope, receive, send)
+
+    return app
+
@@ -1,3 +1,213 @@
-from django.test import TestCase
+import asyncio
+import time
+from datetime import timedelta
 
-# Create your tests here.
+import chess
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db.models import F
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from .archive import decode_moves, encode_moves
+from .challenges import create_challenge, pending, sweep_challenges
+from .clock import TimerWheel
+from .game_state import GameStateCache
+from .models import Challenge, Game
+from .protocol import (
+    OP_MOVE, OP_RESIGN, OP_SYNC, OP_UPDATE, decode_move, encode_move, pack_update, unpack_client_frame,
+)
+from .ratings import glicko2_update
+from .sharding import jump_hash
+
+# The tests must not need the Redis cache of the deployment
+LOCAL_CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+class Glicko2Tests(SimpleTestCase):
+    def test_paper_example(self):
+        # Example calculation of Glickman's "Example of the Glicko-2 system"
+        rating, deviation, volatility = glicko2_update(
+            1500, 200, 0.06, [(1400, 30, 1), (1550, 100, 0), (1700, 300, 0)], 0.5
+        )
+        self.assertAlmostEqual(rating, 1464.05, delta=0.01)
+        self.assertAlmostEqual(deviation, 151.52, delta=0.01)
+        self.assertAlmostEqual(volatility, 0.059996, delta=0.000001)
+
+    def test_no_games_only_grows_deviation(self):
+        rating, deviation, volatility = glicko2_update(1500, 200, 0.06, [], 0.5)
+        self.assertEqual((rating, volatility), (1500, 0.06))
+        self.assertGreater(deviation, 200)
+
+
+class JumpHashTests(SimpleTestCase):
+    def test_in_range_and_deterministic(self):
+        for key in range(1000):
+            bucket = jump_hash(key, 7)
+            self.assertTrue(0 <= bucket < 7)
+            self.assertEqual(bucket, jump_hash(key, 7))
+        self.assertEqual({jump_hash(key, 1) for key in range(100)}, {0})
+
+    def test_added_bucket_only_takes_keys(self):
+        for buckets in range(1, 10):
+            for key in range(1000):
+                before, after = jump_hash(key, buckets), jump_hash(key, buckets + 1)
+                self.assertIn(after, (before, buckets))
+
+
+class ProtocolTests(SimpleTestCase):
+    def test_move_round_trip(self):
+        for uci in ("e2e4", "g1f3", "a7a8q", "h2h1n", "e7d8r", "b2c1b"):
+            move = chess.Move.from_uci(uci)
+            self.assertEqual(decode_move(encode_move(move)), move)
+            frame = bytes([OP_MOVE]) + encode_move(move).to_bytes(2, "big")
+            self.assertEqual(unpack_client_frame(frame), (OP_MOVE, move))
+
+    def test_opcode_frames(self):
+        self.assertEqual(unpack_client_frame(bytes([OP_SYNC])), (OP_SYNC, None))
+        self.assertEqual(unpack_client_frame(bytes([OP_RESIGN])), (OP_RESIGN, None))
+
+    def test_malformed_frames(self):
+        e2e4 = encode_move(chess.Move.from_uci("e2e4"))
+        for frame in (
+            b"",
+            bytes([OP_MOVE]),
+            bytes([OP_MOVE, 0]),
+            bytes([OP_MOVE]) + e2e4.to_bytes(2, "big") + b"\x00",
+            bytes([OP_MOVE]) + (e2e4 | chess.PAWN << 12).to_bytes(2, "big"),
+            bytes([OP_MOVE]) + (e2e4 | 7 << 12).to_bytes(2, "big"),
+            bytes([OP_SYNC, 0]),
+            bytes([99]),
+        ):
+            with self.subTest(frame=frame):
+                with self.assertRaises(ValueError):
+                    unpack_client_frame(frame)
+
+    def test_pack_update(self):
+        move = encode_move(chess.Move.from_uci("e2e4"))
+        frame = pack_update(1, move, {"white": 1000, "black": 2000})
+        self.assertEqual(frame[0], OP_UPDATE)
+        self.assertEqual(int.from_bytes(frame[1:3], "big"), 1)
+        self.assertEqual(int.from_bytes(frame[3:5], "big"), move)
+        self.assertEqual(int.from_bytes(frame[5:9], "big", signed=True), 1000)
+        self.assertEqual(int.from_bytes(frame[9:13], "big", signed=True), 2000)
+        self.assertEqual(pack_update(1, move, None)[5:], (-1).to_bytes(4, "big", signed=True) * 2)
+
+
+class ArchiveTests(SimpleTestCase):
+    # Fool's mate, plus a game with castling, en passant and a promotion
+    GAMES = [
+        ["f2f3", "e7e5", "g2g4", "d8h4"],
+        ["e2e4", "d7d5", "e4e5", "f7f5", "e5f6", "g8h6", "f6g7", "e8f7", "g7h8q", "b8c6",
+         "g1f3", "d8d6", "f1e2", "c8d7", "e1g1"],
+    ]
+
+    def test_round_trip(self):
+        for moves in self.GAMES:
+            packed, board = encode_moves(moves)
+            self.assertEqual(len(packed), len(moves) + 1)
+            self.assertEqual(decode_moves(packed), moves)
+            self.assertEqual(decode_moves(packed, max_ply=2), moves[:2])
+            self.assertEqual([move.uci() for move in board.move_stack], moves)
+
+    def test_illegal_move(self):
+        with self.assertRaises(ValueError):
+            encode_moves(["e2e5"])
+
+    def test_unknown_format(self):
+        packed, _ = encode_moves(self.GAMES[0])
+        with self.assertRaises(ValueError):
+            decode_moves(b"\x00" + packed[1:])
+
+
+class TimerWheelTests(SimpleTestCase):
+    def test_expiry(self):
+        async def run():
+            wheel = TimerWheel(0.01, 8)
+            fired = []
+
+            async def fire(key):
+                fired.append(key)
+
+            now = time.time()
+            wheel.schedule("soon", now + 0.03, lambda: fire("soon"))
+            wheel.schedule("cancelled", now + 0.03, lambda: fire("cancelled"))
+            # Further than one turn of the wheel, so skipped until its round
+            wheel.schedule("later", now + 10, lambda: fire("later"))
+            wheel.schedule("moved", now + 10, lambda: fire("moved"))
+            wheel.schedule("moved", now + 0.05, lambda: fire("moved"))
+            wheel.cancel("cancelled")
+            self.assertEqual(len(wheel), 3)
+            await asyncio.sleep(0.2)
+            self.assertEqual(sorted(fired), ["moved", "soon"])
+            self.assertEqual(len(wheel), 1)
+            wheel.cancel("later")
+            await asyncio.sleep(0.05)
+            self.assertTrue(wheel._task.done())
+
+        asyncio.run(run())
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class GameStateCacheTests(TestCase):
+    def setUp(self):
+        white = User.objects.create_user("white", password="p")
+        black = User.objects.create_user("black", password="p")
+        self.game = Game.objects.create(player_white=white, player_black=black, current_fen=chess.Board().fen())
+
+    async def test_commit(self):
+        cache = GameStateCache(10)
+        state = await cache.get(self.game.id)
+        state.board.push_uci("e2e4")
+        self.assertTrue(await cache.commit(state))
+        self.assertEqual(state.version, 1)
+        await self.game.arefresh_from_db()
+        self.assertEqual((self.game.current_fen, self.game.version), (state.board.fen(), 1))
+
+    async def test_version_conflict(self):
+        cache = GameStateCache(10)
+        state = await cache.get(self.game.id)
+        # A move committed through another process
+        await Game.objects.filter(id=self.game.id).aupdate(version=F("version") + 1)
+        state.board.push_uci("e2e4")
+        self.assertFalse(await cache.commit(state))
+        self.assertNotIn(self.game.id, cache)
+        await self.game.arefresh_from_db()
+        self.assertEqual(self.game.current_fen, chess.Board().fen())
+        self.assertEqual((await cache.get(self.game.id)).version, 1)
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class ChallengeTests(TestCase):
+    def setUp(self):
+        self.challenger = User.objects.create_user("challenger", password="p")
+        self.challenged = User.objects.create_user("challenged", password="p")
+
+    def test_repeat_returns_pending_challenge(self):
+        challenge_id, events = create_challenge(self.challenger, self.challenged.id)
+        self.assertEqual(events, [(self.challenged.id, {
+            "type": "challenge_added", "challenge": {"id": challenge_id, "challenger": "challenger"},
+        })])
+        self.assertEqual(create_challenge(self.challenger, self.challenged.id), (challenge_id, []))
+        self.assertEqual(Challenge.objects.count(), 1)
+
+    def test_expiry(self):
+        challenge_id, _ = create_challenge(self.challenger, self.challenged.id)
+        expired = timezone.now() + timedelta(seconds=settings.CHALLENGE_TTL + 1)
+        self.assertTrue(pending().filter(id=challenge_id).exists())
+        self.assertFalse(pending(expired).filter(id=challenge_id).exists())
+        self.assertEqual(sweep_challenges(), [])
+        self.assertEqual(sweep_challenges(expired), [
+            (self.challenged.id, {"type": "challenge_removed", "challenge_id": challenge_id}),
+        ])
+        self.assertFalse(Challenge.objects.exists())
+
+    def test_expired_challenge_is_replaced_before_sweep(self):
+        challenge_id, _ = create_challenge(self.challenger, self.challenged.id)
+        Challenge.objects.filter(id=challenge_id).update(
+            created_at=timezone.now() - timedelta(seconds=settings.CHALLENGE_TTL + 1)
+        )
+        new_id, events = create_challenge(self.challenger, self.challenged.id)
+        self.assertNotEqual(new_id, challenge_id)
+        self.assertEqual([event["type"] for _, event in events], ["challenge_removed", "challenge_added"])
+        self.assertEqual(list(Challenge.objects.values_list("id", flat=True)), [new_id])
@@ -4,6 +4,7 @@ from . import views
 urlpatterns = [
     path('game/<int:game_id>/resign/', views.resign_game, name='resign_game'),
     path('game/<int:game_id>/status/', views.check_game_status, name='check_game_status'),
+    path('game/<int:game_id>/analysis/', views.game_analysis, name='game_analysis'),
     path('game/<int:game_id>/', views.game_detail, name='game_detail'),
     path('game/<int:game_id>/update_board/', views.update_board, name='update_board'),
     path('challenge/<int:challenge_id>/respond/', views.respond_challenge, name='respond_challenge'),
@@ -12,6 +13,12 @@ urlpatterns = [
     path('game/<int:game_id>/over/', views.game_over, name='game_over'),
     path('game/<int:game_id>/delete/', views.delete_game, name='delete_game'),
     path('game/<int:game_id>/edit_journal/', views.edit_journal, name='edit_journal'),
+    path('game/<int:game_id>/pgn/', views.export_game_pgn, name='export_game_pgn'),
+    path('players/<str:username>/pgn/', views.export_user_pgn, name='export_user_pgn'),
+    path('export/games.pgn', views.export_all_pgn, name='export_all_pgn'),
+    path('leaderboard/', views.leaderboard, name='leaderboard'),
+    path('explorer/', views.explorer, name='explorer'),
     path('heartbeat/', views.heartbeat, name='heartbeat'),
     path('healthcheck/', views.healthcheck, name='healthcheck'),
+    path('metrics/', views.metrics, name='metrics'),
 ]
\ No newline at end of file
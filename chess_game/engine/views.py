@@ -1,18 +1,34 @@
 from django.shortcuts import render, redirect, get_object_or_404
-from django.contrib.auth.decorators import login_required
+from django.contrib.auth.decorators import login_required, user_passes_test
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition
 from django.contrib.auth.models import User
 from django.contrib import messages
-from django.http import JsonResponse, HttpResponseForbidden
+from django.conf import settings
+from django.http import Http404, HttpResponse, JsonResponse, HttpResponseForbidden, StreamingHttpResponse
 from django.urls import reverse
 from django.db import models
 from django.template.loader import render_to_string
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
-from .models import Game, Move, Challenge
+from .models import Game, Move, Challenge, Rating
 from .forms import JournalForm
+from .clock import ChessClock
+from .game_state import invalidate_game, resign_game as resign_game_for
+from .analysis import analyse_position, analysis_depth
+from .board_render import render_board
+from .bot import BotBusy
+from .challenges import TooManyChallenges, challenge_removed_event, create_challenge, pending, respond_to_challenge, send_challenge_events
+from .history import game_changed_events, load_game_changed_events
+from .leaderboard import get_leaderboard
+from .matchmaking import withdraw_seek
+from .metrics import render_metrics
+from .pgn import stream_pgn
+from .positions import explore
 
 import chess
+import hashlib
+import time
 
 
 @login_required(login_url='login')
@@ -32,33 +48,33 @@ def home(request):
         challenged_player_id = request.POST.get('player_black')
         challenged_player = User.objects.get(id=challenged_player_id)
 
-        challenge = Challenge.objects.create(
-            challenger=request.user,
-            challenged=challenged_player
-        )
+        try:
+            _, events = create_challenge(
+                request.user,
+                challenged_player.id,
+                request.POST.get('base_time'),
+                request.POST.get('increment'),
+            )
+        except TooManyChallenges:
+            messages.error(request, "You have too many pending challenges.")
+            return redirect('home')
 
-        # Broadcast the challenge update to the challenged player
-        channel_layer = get_channel_layer()
-        async_to_sync(channel_layer.group_send)(
-            f"user_{challenged_player.id}",
-            {"type": "broadcast_challenges"}
-        )
+        # Push the challenge to the challenged player
+        async_to_sync(send_challenge_events)(get_channel_layer(), events)
 
         messages.success(request, f"Challenge sent to {challenged_player.username}!")
         return redirect('home')
     
-    available_players = User.objects.filter(userstatus__is_logged_in=True).exclude(id=request.user.id)
-    
-    challenges_received = Challenge.objects.filter(challenged=request.user, accepted=None)
+    challenges_received = pending().filter(challenged=request.user).select_related('challenger')
 
     games = Game.objects.filter(
         models.Q(player_white=request.user) | models.Q(player_black=request.user)
     ).order_by('-id')
     
     return render(request, 'engine/home.html', {
-        'available_players': available_players,
         'challenges_received': challenges_received,
         'games': games,
+        'presence_heartbeat_interval': settings.PRESENCE_HEARTBEAT_INTERVAL,
     })
 
 @login_required
@@ -69,15 +85,59 @@ def heartbeat(request):
         return JsonResponse({'status': 'alive'})
     return JsonResponse({'status': 'error'}, status=400)
 
+def pgn_response(games, filename):
+    response = StreamingHttpResponse(stream_pgn(games), content_type='application/x-chess-pgn')
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+@login_required(login_url='login')
+def export_game_pgn(request, game_id):
+    get_object_or_404(Game, id=game_id)
+    return pgn_response(Game.objects.filter(id=game_id), f'game_{game_id}.pgn')
+
+@login_required(login_url='login')
+def export_user_pgn(request, username):
+    user = get_object_or_404(User, username=username)
+    games = Game.objects.filter(models.Q(player_white=user) | models.Q(player_black=user), game_over=True)
+    return pgn_response(games, f'{username}.pgn')
+
+@user_passes_test(lambda user: user.is_staff, login_url='login')
+def export_all_pgn(request):
+    return pgn_response(Game.objects.filter(game_over=True), 'games.pgn')
+
+@login_required(login_url='login')
+def leaderboard(request):
+    board = get_leaderboard()
+    return render(request, 'engine/leaderboard.html', {
+        'players': board.top(settings.LEADERBOARD_SIZE),
+        'rank': board.rank(request.user.id),
+        'rating': Rating.objects.filter(user=request.user).first(),
+    })
+
+@login_required(login_url='login')
+def explorer(request):
+    try:
+        position = explore(request.GET.get('fen') or chess.STARTING_FEN)
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'Invalid FEN.'}, status=400)
+    return JsonResponse(position)
+
 def healthcheck(request):
     return JsonResponse({'status': 'alive'})
 
+def metrics(request):
+    # Figures of the process serving the request, see engine.metrics
+    if not settings.METRICS_ENABLED:
+        raise Http404()
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 @login_required(login_url='login')
 def delete_game(request, game_id):
     game = get_object_or_404(Game, id=game_id)
 
     if request.user == game.player_white or request.user == game.player_black:
         game.delete()
+        async_to_sync(invalidate_game)(get_channel_layer(), game_id)
         messages.success(request, 'Game has been deleted successfully.')
     else:
         messages.error(request, 'You are not authorized to delete this game.')
@@ -94,7 +154,8 @@ def edit_journal(request, game_id):
     if request.method == "POST":
         form = JournalForm(request.POST, instance=game)
         if form.is_valid():
-            form.save()
+            form.save(commit=False)
+            game.save(update_fields=["journal_entry"])
             messages.success(request, "Journal updated successfully!")
             return redirect('home')
     else:
@@ -116,53 +177,24 @@ def start_new_game(request):
 
 @login_required(login_url='login')
 def resign_game(request, game_id):
-    game = get_object_or_404(Game, id=game_id)
-
-    if request.user == game.player_white:
-        game.winner = game.player_black
-    elif request.user == game.player_black:
-        game.winner = game.player_white
-
-    game.resignation = True
-    game.game_over = True
-    game.save()
-
     channel_layer = get_channel_layer()
-    print(f"Player {request.user.username} resigned. Notifying players...")
-    async_to_sync(channel_layer.group_send)(
-        f"user_{game.player_white.id}",
-        {"type": "broadcast_game_history"}
-    )
-    async_to_sync(channel_layer.group_send)(
-        f"user_{game.player_black.id}",
-        {"type": "broadcast_game_history"}
-    )
+    try:
+        # Same commit as a resignation over the socket: players only, once
+        event = async_to_sync(resign_game_for)(channel_layer, game_id, request.user.id)
+    except Game.DoesNotExist:
+        raise Http404("Game not found.")
+    if event is None:
+        return HttpResponseForbidden("You cannot resign this game.")
+
+    game = Game.objects.select_related('player_white', 'player_black', 'winner').get(id=game_id)
+    for user_id, changed in game_changed_events(game).items():
+        async_to_sync(channel_layer.group_send)(f"user_{user_id}", changed)
 
     context = {
         'game': game,
         'winner': game.winner,
         'resigned_player': request.user
     }
-
-    async_to_sync(channel_layer.group_send)(
-        f"user_{game.player_white.id}",
-        {
-            "type": "game_resigned",
-            "winner": game.winner.username
-        }
-    )
-    print(f"Sent resignation notification to user_{game.player_white.id}")
-
-
-    async_to_sync(channel_layer.group_send)(
-        f"user_{game.player_black.id}",
-        {
-            "type": "game_resigned",
-            "winner": game.winner.username
-        }
-    )
-    print(f"Sent resignation notification to user_{game.player_black.id}")
-
     return render(request, 'engine/game_over.html', context)
 
 def rules_view(request):
@@ -183,111 +215,93 @@ def about_view(request):
     """
     return render(request, 'about.html')
 
-def generate_board_structure_with_labels(board):
-    board_structure = []
-    for rank in range(8, 0, -1):
-        row = []
-        for file in range(8):
-            square = chess.square(file, rank - 1)
-            piece = board.piece_at(square)
-            row.append(piece.symbol() if piece else None)
-        board_structure.append(row)
-
-    rank_labels = list(range(8, 0, -1))
-    zipped_structure = zip(board_structure, rank_labels)
-    return zipped_structure
-
 @login_required(login_url='login')
 def game_detail(request, game_id):
     game = get_object_or_404(Game, id=game_id)
 
     board = chess.Board(game.current_fen)
+    clock = ChessClock.for_game(
+        game.base_time, game.increment, game.white_time_ms, game.black_time_ms, game.clock_updated_at
+    )
 
     context = {
         'game': game,
         'fen': game.current_fen,
         'is_ongoing': not game.game_over,
         'player_color': 'white' if request.user == game.player_white else 'black',
-        'turn': board.turn == chess.WHITE
+        'is_player': request.user in (game.player_white, game.player_black),
+        'turn': board.turn == chess.WHITE,
+        'clock': clock.snapshot(board.turn, time.time()) if clock else None,
+        'legal_moves': '' if game.game_over else ' '.join(move.uci() for move in board.legal_moves),
     }
 
     return render(request, 'engine/game_detail.html', context)
 
-def update_board(request, game_id):
-    game = get_object_or_404(Game, id=game_id)
-    board = chess.Board(game.current_fen)
-
-    context = {
-        'board_structure': generate_board_structure_with_labels(board),
-        'is_ongoing': not game.game_over
-    }
+def board_etag(request, game_id):
+    fen = Game.objects.filter(id=game_id).values_list('current_fen', flat=True).first()
+    if fen is None:
+        return None
+    orientation = request.GET.get('orientation', 'white')
+    return hashlib.sha1(f"{fen}|{orientation}".encode()).hexdigest()
 
-    board_html = render_to_string('engine/partials/chessboard.html', context)
-    return JsonResponse({'board_html': board_html, 'turn': board.turn})
+# Polling clients get a 304 without any rendering while the position is unchanged
+@condition(etag_func=board_etag)
+def update_board(request, game_id):
+    fen = get_object_or_404(Game.objects.values_list('current_fen', flat=True), id=game_id)
+    placement, turn = fen.split()[:2]
+    board_html = render_board(placement, request.GET.get('orientation') == 'black')
+    return JsonResponse({'board_html': board_html, 'turn': turn == 'w'})
 
 @csrf_exempt
 @login_required(login_url='login')
 def respond_challenge(request, challenge_id):
-    challenge = get_object_or_404(Challenge, id=challenge_id, challenged=request.user)
     channel_layer = get_channel_layer()
 
     if request.method == 'POST':
         action = request.POST.get('action')
-        if action == 'accept':
-            challenge.accepted = True
-            challenge.save()
-
-            game = Game.objects.create(
-                player_white=challenge.challenger,
-                player_black=challenge.challenged,
-                current_fen=chess.Board().fen()
-            )
+        if action in ('accept', 'reject'):
+            try:
+                challenge, game_id = respond_to_challenge(challenge_id, request.user.id, action == 'accept')
+            except Challenge.DoesNotExist:
+                raise Http404("Challenge not found.")
+            if challenge.challenged_id != request.user.id:
+                raise Http404("Challenge not found.")
 
-            if not game.id:
-                messages.error(request, "Game creation failed. Please try again.")
-                return redirect("home")
-
-            async_to_sync(channel_layer.group_send)(
-                f"user_{challenge.challenger.id}",
-                {
-                    "type": "broadcast_game_start",
-                    "game_id": game.id
-                }
-            )
             async_to_sync(channel_layer.group_send)(
-                f"user_{challenge.challenged.id}",
-                {
-                    "type": "broadcast_game_start",
-                    "game_id": game.id
-                }
-            )
-
-            async_to_sync(channel_layer.group_send)(
-                f"user_{challenge.challenger.id}",
-                {"type": "broadcast_game_history"}
-            )
-            async_to_sync(channel_layer.group_send)(
-                f"user_{challenge.challenged.id}",
-                {"type": "broadcast_game_history"}
-            )
-
-            return redirect("game_detail", game_id=game.id)
-        elif action == 'reject':
-            challenge.accepted = False
-            challenge.save()
-
-            # Notify the challenger of rejection
-            async_to_sync(channel_layer.group_send)(
-                f"user_{challenge.challenger.id}",
-                {"type": "broadcast_challenges"}
+                f"user_{request.user.id}", challenge_removed_event(challenge.id)
             )
+            if game_id is None:
+                # Notify the challenger of rejection
+                async_to_sync(channel_layer.group_send)(
+                    f"user_{challenge.challenger_id}",
+                    {
+                        "type": "challenge_rejected",
+                        "challenger": request.user.username,
+                        "challenge_id": challenge.id,
+                    }
+                )
+                return redirect("home")
 
-            return redirect("home")
+            for user_id in (challenge.challenger_id, challenge.challenged_id):
+                # Neither player can be paired into a second game
+                async_to_sync(withdraw_seek)(channel_layer, user_id)
+                async_to_sync(channel_layer.group_send)(
+                    f"user_{user_id}",
+                    {
+                        "type": "broadcast_game_start",
+                        "game_id": game_id
+                    }
+                )
+
+            for user_id, event in load_game_changed_events(game_id).items():
+                async_to_sync(channel_layer.group_send)(f"user_{user_id}", event)
+
+            return redirect("game_detail", game_id=game_id)
     return redirect("home")
 
 @login_required(login_url='login')
 def check_challenges(request):
-    challenges_received = Challenge.objects.filter(challenged=request.user, accepted=None)
+    challenges_received = pending().filter(challenged=request.user).select_related('challenger')
 
     challenges_html = render_to_string('engine/partials/challenge_requests.html', {'challenges_received': challenges_received})
 
@@ -315,7 +329,8 @@ def check_game_status(request, game_id):
     if game.game_over:
         return JsonResponse({
             'game_over': True,
-            'winner': game.winner.username
+            'winner': game.winner.username if game.winner else None,
+            'termination': game.termination,
         })
 
     return JsonResponse({
@@ -324,6 +339,19 @@ def check_game_status(request, game_id):
         'turn': board.turn
     })
 
+@login_required(login_url='login')
+def game_analysis(request, game_id):
+    game = get_object_or_404(Game, id=game_id)
+    try:
+        depth = analysis_depth(request.GET.get('depth'))
+    except ValueError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+    try:
+        analysis = async_to_sync(analyse_position)(game.current_fen, depth)
+    except BotBusy:
+        return JsonResponse({'status': 'error', 'message': 'Analysis is busy, please try again later.'}, status=503)
+    return JsonResponse(analysis)
+
 @login_required(login_url='login')
 def game_over(request, game_id):
     game = get_object_or_404(Game, id=game_id)
@@ -11,9 +11,4 @@ class UserStatus(models.Model):
 @receiver(post_save, sender=User)
 def create_user_status(sender, instance, created, **kwargs):
     if created:
-        UserStatus.objects.create(user=instance)
-
-# Save UserStatus when the user is saved
-@receiver(post_save, sender=User)
-def save_user_status(sender, instance, **kwargs):
-    instance.userstatus.save()
\ No newline at end of file
+        UserStatus.objects.create(user=instance)
\ No newline at end of file
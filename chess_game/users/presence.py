@@ -0,0 +1,230 @@
+import asyncio
+import time
+import weakref
+from functools import lru_cache
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+class BasePresenceBackend:
+    """
+    Tracks which users are online by counting their open lobby sockets.
+
+    Every socket is registered with an expiry that is pushed forward by
+    heartbeats, so sockets that vanish without disconnecting (e.g. after a
+    server restart) expire on their own.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+
+    async def connect(self, user, channel_name):
+        """
+        Register a socket. Returns True if the user just came online.
+        """
+        raise NotImplementedError
+
+    async def disconnect(self, user_id, channel_name):
+        """
+        Unregister a socket. Returns True if the user just went offline.
+        """
+        raise NotImplementedError
+
+    async def heartbeat(self, user, channel_name):
+        """
+        Extend a socket's expiry. Returns True if the user had expired and
+        is online again.
+        """
+        raise NotImplementedError
+
+    async def clear_user(self, user_id):
+        """
+        Drop every socket of a user. Returns True if the user was online.
+        """
+        raise NotImplementedError
+
+    async def expire_stale(self):
+        """
+        Remove users whose sockets all expired and return their ids.
+        """
+        raise NotImplementedError
+
+    async def online_players(self):
+        """
+        Return every online player as {"id", "username"}.
+        """
+        raise NotImplementedError
+
+
+class LocalPresenceBackend(BasePresenceBackend):
+    """
+    In-process backend for tests and single-process development servers.
+    """
+
+    def __init__(self, ttl):
+        super().__init__(ttl)
+        self._connections = {}  # user id -> {channel name: expiry}
+        self._usernames = {}
+
+    def _prune(self, user_id, now):
+        connections = self._connections.get(user_id, {})
+        for channel_name, expiry in list(connections.items()):
+            if expiry <= now:
+                del connections[channel_name]
+        if not connections:
+            self._connections.pop(user_id, None)
+            self._usernames.pop(user_id, None)
+            return False
+        return True
+
+    async def connect(self, user, channel_name):
+        now = time.time()
+        was_online = self._prune(user.id, now)
+        self._connections.setdefault(user.id, {})[channel_name] = now + self.ttl
+        self._usernames[user.id] = user.username
+        return not was_online
+
+    async def disconnect(self, user_id, channel_name):
+        if user_id not in self._connections:
+            return False
+        self._connections[user_id].pop(channel_name, None)
+        return not self._prune(user_id, time.time())
+
+    async def heartbeat(self, user, channel_name):
+        return await self.connect(user, channel_name)
+
+    async def clear_user(self, user_id):
+        self._usernames.pop(user_id, None)
+        return self._connections.pop(user_id, None) is not None
+
+    async def expire_stale(self):
+        now = time.time()
+        return [user_id for user_id in list(self._connections) if not self._prune(user_id, now)]
+
+    async def online_players(self):
+        now = time.time()
+        return [
+            {"id": user_id, "username": self._usernames[user_id]}
+            for user_id in list(self._connections)
+            if self._prune(user_id, now)
+        ]
+
+
+class RedisPresenceBackend(BasePresenceBackend):
+    """
+    Shares presence between processes through Redis.
+
+    presence:online          sorted set of user ids scored by expiry
+    presence:conns:<user id> sorted set of channel names scored by expiry
+    presence:names           hash of user id -> username
+    """
+
+    ONLINE_KEY = "presence:online"
+    NAMES_KEY = "presence:names"
+
+    def __init__(self, ttl, url):
+        super().__init__(ttl)
+        self.url = url
+        # redis.asyncio connections are bound to the loop that opened them
+        self._clients = weakref.WeakKeyDictionary()
+
+    def _client(self):
+        import redis.asyncio as redis
+
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            client = self._clients[loop] = redis.Redis.from_url(self.url, decode_responses=True)
+        return client
+
+    def _connections_key(self, user_id):
+        return f"presence:conns:{user_id}"
+
+    async def connect(self, user, channel_name):
+        now = time.time()
+        key = self._connections_key(user.id)
+        async with self._client().pipeline(transaction=True) as pipe:
+            pipe.zremrangebyscore(key, "-inf", now)
+            pipe.zadd(key, {channel_name: now + self.ttl})
+            pipe.zcard(key)
+            pipe.expire(key, self.ttl)
+            pipe.zadd(self.ONLINE_KEY, {user.id: now + self.ttl})
+            pipe.hset(self.NAMES_KEY, user.id, user.username)
+            results = await pipe.execute()
+        return results[2] == 1
+
+    async def disconnect(self, user_id, channel_name):
+        key = self._connections_key(user_id)
+        async with self._client().pipeline(transaction=True) as pipe:
+            pipe.zrem(key, channel_name)
+            pipe.zremrangebyscore(key, "-inf", time.time())
+            pipe.zcard(key)
+            results = await pipe.execute()
+        if results[2]:
+            return False
+        return await self.clear_user(user_id)
+
+    async def heartbeat(self, user, channel_name):
+        expiry = time.time() + self.ttl
+        key = self._connections_key(user.id)
+        async with self._client().pipeline(transaction=True) as pipe:
+            pipe.zadd(key, {channel_name: expiry})
+            pipe.expire(key, self.ttl)
+            pipe.zadd(self.ONLINE_KEY, {user.id: expiry})
+            pipe.hset(self.NAMES_KEY, user.id, user.username)
+            results = await pipe.execute()
+        # ZADD reports 1 only when the user was not in the online set
+        return results[2] == 1
+
+    async def clear_user(self, user_id):
+        async with self._client().pipeline(transaction=True) as pipe:
+            pipe.delete(self._connections_key(user_id))
+            pipe.zrem(self.ONLINE_KEY, user_id)
+            pipe.hdel(self.NAMES_KEY, user_id)
+            results = await pipe.execute()
+        return bool(results[1])
+
+    async def expire_stale(self):
+        client = self._client()
+        now = time.time()
+        stale = await client.zrangebyscore(self.ONLINE_KEY, "-inf", now)
+        expired = []
+        for user_id in stale:
+            # Only the caller that actually removes the entry reports it
+            if await client.zrem(self.ONLINE_KEY, user_id):
+                await client.hdel(self.NAMES_KEY, user_id)
+                expired.append(int(user_id))
+        return expired
+
+    async def online_players(self):
+        client = self._client()
+        user_ids = await client.zrangebyscore(self.ONLINE_KEY, time.time(), "+inf")
+        if not user_ids:
+            return []
+        usernames = await client.hmget(self.NAMES_KEY, user_ids)
+        return [
+            {"id": int(user_id), "username": username}
+            for user_id, username in zip(user_ids, usernames)
+            if username is not None
+        ]
+
+
+@lru_cache(maxsize=None)
+def get_presence_backend():
+    backend_class = import_string(settings.PRESENCE_BACKEND)
+    return backend_class(**settings.PRESENCE_OPTIONS)
+
+
+def player_joined_event(user):
+    return {
+        "type": "player_joined",
+        "player": {"id": user.id, "username": user.username},
+    }
+
+
+def player_left_event(user_id):
+    return {
+        "type": "player_left",
+        "player_id": user_id,
+    }
@@ -1,7 +1,6 @@
 from django.shortcuts import render, redirect
 from django.contrib.auth import authenticate, login, logout 
 from .forms import UserCreationForm, LoginForm
-from .models import UserStatus
 
 # Create your views here.
 def index(request):
@@ -35,13 +34,6 @@ def user_login(request):
 
 # logout page
 def user_logout(request):
-    user = request.user
-    if hasattr(user, 'userstatus'):
-        user.userstatus.is_logged_in = False
-        user.userstatus.save()
-    else:
-        # Create a UserStatus if it doesn't exist
-        UserStatus.objects.create(user=user, is_logged_in=False)
-    
+    # Presence is cleared by the user_logged_out signal
     logout(request)
     return redirect('login')
\ No newline at end of file